@@ -1,28 +1,60 @@
-import json
 import os
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Optional, List, Tuple
 
-import funcy
 import numpy as np
 import typer
 import time
 import shutil
 import yaml
-from tqdm import tqdm
-from coco_assistant import COCO_Assistant
 from coco_assistant import coco_visualiser as cocovis
 from PIL import Image
 from pycocotools.coco import COCO
 from sklearn.model_selection import train_test_split
 
 from tools.helpers import (
-    filter_annotations,
-    check_coco_sanity,
-    locate_images,
-    save_coco,
     get_image_files,
     has_segmentation_data,
 )
+from tools.coco_index import CocoIndex, load_cached_index
+from tools.coco_merge import consolidate_images, merge_coco
+from tools.image_index import CONFLICTING, DUPLICATE, ImageIndex
+from tools.name_keys import NameMatcher
+from tools.relational import key_array, semi_join
+from tools.snapshots import STORE_DIR, SnapshotStore
+from tools.splits import (
+    FIELD_PREFIX,
+    TRAIN,
+    VAL,
+    count_matrix,
+    fold_split,
+    group_keys,
+    group_split,
+    hash_split,
+    stratified_folds,
+    stratified_split,
+)
+from tools.transfer import Placement, transfer
+from tools import coco_delta, serialization
+from tools.serialization import split_ext
+from tools.coco_shards import (
+    is_shard_dir,
+    iter_shard,
+    load_shard,
+    map_shards,
+    read_header,
+    shard_coco,
+    shard_path,
+    transform_shards,
+    unshard_coco,
+)
+from tools.coco_stream import (
+    CocoWriter,
+    read_sections,
+    transform_coco,
+)
 
 import tkinter as tk
 from tools.cocoviewer import (
@@ -35,6 +67,12 @@ from tools.cocoviewer import (
     Controller,
 )
 
+# Annotation files picked up from a folder, compressed or not
+ANN_EXTENSIONS = (".json", ".json.gz", ".json.zst")
+
+# Image records hashed at once by the streaming split
+HASH_CHUNK = 65536
+
 app = typer.Typer(help="Awesome cvOps Tool.", rich_markup_mode="rich")
 
 
@@ -143,6 +181,21 @@ def visualizebox(
 def merge(
     img_dir: str = typer.Argument(..., help="directory of images"),
     ann_dir: str = typer.Argument(..., help="directory of annotations"),
+    workers: Optional[int] = typer.Option(
+        None, help="Worker processes for the merge, one per core by default."
+    ),
+    aliases: Optional[str] = typer.Option(
+        None,
+        help="Category manage config whose process: section renames categories before they are matched by name.",
+    ),
+    merge_images: bool = typer.Option(
+        True,
+        help="Gather the images of all samples into results/merged/images. Clashing file names get a content hash.",
+    ),
+    placement: Placement = typer.Option(
+        Placement.hardlink,
+        help="Place merged images as copies, hardlinks, symlinks or reflinks. Links fall back to copies where the file system refuses them.",
+    ),
 ):
     """
     [bold green]Merge coco sample[/bold green]
@@ -162,45 +215,96 @@ def merge(
     [/blue]
     """
 
-    # Create COCO_Assistant object
-    cas = COCO_Assistant(img_dir, ann_dir)
-    cas.merge()
-    print("update merged.json into right format.")
-    merged_coco_path = os.path.join(
-        os.path.dirname(ann_dir), "results", "merged", "annotations", "merged.json"
+    img_dir, ann_dir = os.path.abspath(img_dir), os.path.abspath(ann_dir)
+    if os.path.dirname(img_dir) != os.path.dirname(ann_dir):
+        raise ValueError("Image and annotation folders must share a parent directory")
+    img_folders = sorted(
+        f
+        for f in os.listdir(img_dir)
+        if os.path.isdir(os.path.join(img_dir, f)) and not f.startswith(".")
+    )
+    # Plain and compressed exports alike, i.e. sample1.json.gz
+    ann_files = sorted(
+        (f for f in os.listdir(ann_dir) if split_ext(f)[1].lower() in ANN_EXTENSIONS),
+        key=lambda f: split_ext(f)[0],
+    )
+    if len(img_folders) != len(ann_files):
+        raise ValueError("Number of image folders and annotation files do not match")
+    for folder, ann_file in zip(img_folders, ann_files):
+        if folder != split_ext(ann_file)[0]:
+            raise ValueError(
+                f"Image folder {folder} has no annotation file {folder}.json"
+            )
+
+    out_dir = os.path.join(os.path.dirname(ann_dir), "results", "merged")
+    out_img_dir = os.path.join(out_dir, "images")
+    out_ann_dir = os.path.join(out_dir, "annotations")
+    for directory in (out_img_dir, out_ann_dir) if merge_images else (out_ann_dir,):
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    renames = None
+    if merge_images:
+        renames = consolidate_images(
+            [os.path.join(img_dir, folder) for folder in img_folders],
+            out_img_dir,
+            placement,
+        )
+        n_renamed = sum(map(len, renames))
+        if n_renamed:
+            print(f"Renamed {n_renamed} images whose file names clashed.")
+
+    alias_table = None
+    if aliases:
+        with open(aliases, "r") as file:
+            alias_table = yaml.safe_load(file).get("process") or {}
+
+    merged_coco_path = os.path.join(out_ann_dir, "merged.json")
+    counts = merge_coco(
+        [os.path.join(ann_dir, f) for f in ann_files],
+        merged_coco_path,
+        max_workers=workers,
+        aliases=alias_table,
+        renames=renames,
+    )
+    print(
+        f"Merged {len(ann_files)} files into {merged_coco_path}: "
+        f"{counts['images']} images, {counts['annotations']} annotations, "
+        f"{counts['categories']} categories."
     )
-    check_coco_sanity(merged_coco_path)
 
 
 @app.command()
 def convert(
-    ann_path: str = typer.Argument(..., help="Path to COCO annotations file."),
+    ann_path: str = typer.Argument(
+        ..., help="Path to COCO annotations file or shard directory."
+    ),
     mask_save_dir: str = typer.Argument(..., help="Path to COCO annotations file."),
     multi: bool = typer.Option(
         False,
         help="Make mask covering multi class. if false, it makes binary mask. (fore/background mask) by adding --multi",
     ),
 ):
-    coco = COCO(ann_path)
+    if is_shard_dir(ann_path):
+        # Every shard holds whole images, so shards are converted in parallel
+        map_shards(ann_path, _convert_shard, mask_save_dir, multi)
+    else:
+        _save_masks(CocoIndex.from_file(ann_path), mask_save_dir, multi)
 
-    annsIds = coco.getAnnIds()
-    imgsIds = coco.getImgIds()
-    cat_ids = coco.getCatIds()
 
-    for imgId in imgsIds:
-        img = coco.imgs[imgId]
-        imgFileName = img.get("file_name")
-        imgShape = (img.get("height"), img.get("width"))
-        anns_ids = coco.getAnnIds(imgIds=img["id"], catIds=cat_ids, iscrowd=None)
-        anns = coco.loadAnns(anns_ids)
+def _save_masks(index: CocoIndex, mask_save_dir: str, multi: bool) -> None:
+    # Annotations are read image by image, by their byte offsets when cached
+    for img_pos, imgFileName in enumerate(index.file_names):
+        imgShape = (int(index.img_heights[img_pos]), int(index.img_widths[img_pos]))
+        anns = index.take_anns(index.ann_positions_for_images([img_pos]))
 
         mask = np.zeros(imgShape, dtype=np.uint8)
         for ann in anns:
             if multi:
-                mask += coco.annToMask(ann) * ann["category_id"]
+                mask += index.ann_to_mask(ann) * ann["category_id"]
             else:
                 # every mask has value 1. (binary)
-                mask += coco.annToMask(ann)
+                mask += index.ann_to_mask(ann)
 
         # save masks to BW images
         file_path = os.path.join(
@@ -211,6 +315,10 @@ def convert(
         print(f"Successfully generated mask file: {imgFileName}")
 
 
+def _convert_shard(shard_dir: str, shard: int, mask_save_dir: str, multi: bool):
+    _save_masks(CocoIndex(load_shard(shard_dir, shard)), mask_save_dir, multi)
+
+
 @app.command()
 def split(
     ann_path: str = typer.Argument(..., help="Path to COCO annotations file."),
@@ -227,39 +335,55 @@ def split(
     independent: bool = typer.Option(
         False, help="False if it's dependent to other pipeline."
     ),
+    compact: bool = typer.Option(
+        False, help="Write annotations without indentation or key sorting."
+    ),
+    placement: Placement = typer.Option(
+        Placement.copy,
+        help="Place images as copies, hardlinks, symlinks or reflinks. Links fall back to copies where the file system refuses them.",
+    ),
+    group_by: Optional[str] = typer.Option(
+        None,
+        help="Keep groups of images on one side: a regex whose first group (or whole match) in the file name is the group, or field:<name> for an image field.",
+    ),
+    seed: Optional[int] = typer.Option(
+        None, help="Seed of the shuffle, for a reproducible split."
+    ),
+    stratify: bool = typer.Option(
+        False,
+        help="Balance the share of every category between train and val, rare ones included, and report the counts per category.",
+    ),
+    hashed: bool = typer.Option(
+        False,
+        "--hash",
+        help="Assign every image from a stable hash of its file name, or group key, and the seed: the same image always lands on the same side. Streams the file in bounded memory.",
+    ),
 ):
 
-    def save_annotations(path, info, licenses, images, annotations, categories):
-        save_coco(path, info, licenses, images, annotations, categories)
-        print(f"Saved {len(annotations)} entries in {path}")
-
     def create_image_dirs(parent_dir, subdir, images_list):
         os.makedirs(subdir, exist_ok=True)
-        for img_obj in images_list:
-            file_name = img_obj.get("file_name")
-            source = os.path.join(image_locate, file_name)
-            destination = os.path.join(subdir, file_name)
-            locate_images(source, destination)
-
-    with open(ann_path, "rt", encoding="UTF-8") as annotations_file:
-        coco = json.load(annotations_file)
-        info, licenses, images, annotations, categories = (
-            coco["info"],
-            coco.get("licenses"),
-            coco["images"],
-            coco["annotations"],
-            coco["categories"],
+        transfer(
+            (
+                (
+                    os.path.join(image_locate, img_obj.get("file_name")),
+                    os.path.join(subdir, img_obj.get("file_name")),
+                )
+                for img_obj in images_list
+            ),
+            placement=placement,
+            desc=f"Locating images in {subdir}",
         )
 
-    images_with_annotations = funcy.lmap(lambda a: int(a["image_id"]), annotations)
-    images = [i for i in images if i["id"] in images_with_annotations]
-
-    X_train, X_test = train_test_split(images, train_size=split, shuffle=True)
-    anns_train = filter_annotations(annotations, X_train)
-    anns_test = filter_annotations(annotations, X_test)
-
-    save_annotations(train_path, info, licenses, X_train, anns_train, categories)
-    save_annotations(test_path, info, licenses, X_test, anns_test, categories)
+    if hashed and stratify:
+        raise ValueError("--hash and --stratify cannot be combined")
+    if hashed:
+        X_train, X_test = _split_by_hash(
+            ann_path, train_path, test_path, split, compact, group_by, seed
+        )
+    else:
+        X_train, X_test = _split_in_memory(
+            ann_path, train_path, test_path, split, compact, group_by, seed, stratify
+        )
 
     if image_locate:
         parent_train_dir = (
@@ -285,6 +409,276 @@ def split(
         create_image_dirs(parent_val_dir, test_dir, X_test)
 
 
+def _split_in_memory(
+    ann_path: str,
+    train_path: str,
+    test_path: str,
+    split: float,
+    compact: bool,
+    group_by: Optional[str],
+    seed: Optional[int],
+    stratify: bool,
+) -> Tuple[List[dict], List[dict]]:
+    """Splits the annotated images in memory; returns the train and test images."""
+    # Stream the file and its deltas: header and images first, annotations
+    # record by record
+    coco = coco_delta.read_sections(
+        ann_path, ("info", "licenses", "categories", "images")
+    )
+    info, licenses, images, categories = (
+        coco["info"],
+        coco["licenses"],
+        coco["images"] or [],
+        coco["categories"],
+    )
+    ann_columns = np.array(
+        [
+            (int(a["image_id"]), int(a["category_id"]))
+            for a in coco_delta.iter_records(
+                ann_path, "annotations", fields=("image_id", "category_id")
+            )
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    annotated_ids = np.unique(ann_columns[:, 0])
+    images = semi_join(images, "id", annotated_ids)
+
+    if stratify:
+        counts, cat_ids = count_matrix(key_array(images, "id"), *ann_columns.T)
+        keys = group_keys(images, group_by) if group_by else None
+        in_train = stratified_split(counts, split, seed, keys)
+        _print_class_balance(categories, counts, cat_ids, in_train)
+    elif group_by:
+        in_train = group_split(group_keys(images, group_by), split, seed)
+    if stratify or group_by:
+        X_train = [img for img, train in zip(images, in_train) if train]
+        X_test = [img for img, train in zip(images, in_train) if not train]
+    else:
+        X_train, X_test = train_test_split(
+            images, train_size=split, shuffle=True, random_state=seed
+        )
+
+    # Route every annotation to the side of its image in a second pass,
+    # writing both files as the records stream by
+    side_of_image = dict.fromkeys(key_array(X_train, "id").tolist(), 0)
+    side_of_image.update(dict.fromkeys(key_array(X_test, "id").tolist(), 1))
+    with CocoWriter(train_path, compact=compact, sort_keys=True) as train_writer:
+        with CocoWriter(test_path, compact=compact, sort_keys=True) as test_writer:
+            writers = (train_writer, test_writer)
+            # Same section order as save_coco (sorted keys)
+            for writer in writers:
+                writer.begin_array("annotations")
+            for ann in coco_delta.iter_records(ann_path, "annotations"):
+                side = side_of_image.get(int(ann["image_id"]))
+                if side is not None:
+                    writers[side].write_record(ann)
+            for writer, images, path in zip(
+                writers, (X_train, X_test), (train_path, test_path)
+            ):
+                n_annotations = writer.end_array()
+                writer.write_value("categories", categories)
+                writer.write_array("images", images)
+                writer.write_value("info", info)
+                writer.write_value("licenses", licenses)
+                print(f"Saved {n_annotations} entries in {path}")
+
+    return X_train, X_test
+
+
+def _split_by_hash(
+    ann_path: str,
+    train_path: str,
+    test_path: str,
+    split: float,
+    compact: bool,
+    group_by: Optional[str],
+    seed: Optional[int],
+) -> Tuple[List[dict], List[dict]]:
+    """Splits by a stable hash of every file name or group key, streaming the file.
+
+    Only the image ids and sides are held in memory, not the records. Images
+    without annotations are left out, as in _split_in_memory.
+
+    Returns:
+        Tuple[List[dict], List[dict]]: ``file_name`` of the train and test images
+    """
+    fields = ("id", "file_name")
+    if group_by and group_by.startswith(FIELD_PREFIX):
+        fields += (group_by[len(FIELD_PREFIX) :],)
+
+    # First pass: the side of every image, a chunk of records at a time
+    img_ids, in_train = [], []
+    records = coco_delta.iter_records(ann_path, "images", fields=fields)
+    while True:
+        chunk = list(islice(records, HASH_CHUNK))
+        if not chunk:
+            break
+        if group_by:
+            keys = group_keys(chunk, group_by)
+        else:
+            keys = [img["file_name"] for img in chunk]
+        img_ids.append(key_array(chunk, "id"))
+        in_train.append(hash_split(keys, split, seed))
+    img_ids = np.concatenate(img_ids) if img_ids else np.zeros(0, dtype=np.int64)
+    in_train = np.concatenate(in_train) if in_train else np.zeros(0, dtype=bool)
+    order = np.argsort(img_ids, kind="stable")
+    sorted_ids = img_ids[order]
+
+    def position(img_id: int) -> int:
+        i = int(np.searchsorted(sorted_ids, img_id))
+        return int(order[i]) if i < len(order) and sorted_ids[i] == img_id else -1
+
+    # Second pass routes the annotations, third pass the annotated images
+    header = coco_delta.read_sections(ann_path, ("info", "licenses", "categories"))
+    annotated = np.zeros(len(img_ids), dtype=bool)
+    file_names = ([], [])
+    with CocoWriter(train_path, compact=compact, sort_keys=True) as train_writer:
+        with CocoWriter(test_path, compact=compact, sort_keys=True) as test_writer:
+            writers = (train_writer, test_writer)
+            for writer in writers:
+                writer.begin_array("annotations")
+            for ann in coco_delta.iter_records(ann_path, "annotations"):
+                pos = position(int(ann["image_id"]))
+                if pos >= 0:
+                    annotated[pos] = True
+                    writers[0 if in_train[pos] else 1].write_record(ann)
+            n_annotations = [writer.end_array() for writer in writers]
+            for writer in writers:
+                writer.write_value("categories", header["categories"])
+                writer.begin_array("images")
+            for img in coco_delta.iter_records(ann_path, "images"):
+                pos = position(int(img["id"]))
+                if annotated[pos]:
+                    side = 0 if in_train[pos] else 1
+                    writers[side].write_record(img)
+                    file_names[side].append({"file_name": img["file_name"]})
+            for writer, count, path in zip(
+                writers, n_annotations, (train_path, test_path)
+            ):
+                writer.end_array()
+                writer.write_value("info", header["info"])
+                writer.write_value("licenses", header["licenses"])
+                print(f"Saved {count} entries in {path}")
+    return file_names
+
+
+def _print_class_balance(
+    categories: list, counts, cat_ids: np.ndarray, in_train: np.ndarray
+) -> None:
+    """Prints the train and val annotation counts of every category."""
+    names = {cat["id"]: cat["name"] for cat in categories or []}
+    train = np.asarray(counts[in_train].sum(axis=0)).ravel()
+    val = np.asarray(counts[~in_train].sum(axis=0)).ravel()
+    for cat_id, n_train, n_val in zip(cat_ids.tolist(), train, val):
+        share = n_val / max(n_train + n_val, 1)
+        print(
+            f"{names.get(cat_id, cat_id)}: {n_train} train, {n_val} val "
+            f"({share:.1%} val)"
+        )
+
+
+@app.command()
+def kfold(
+    ann_path: str = typer.Argument(..., help="Path to COCO annotations file."),
+    out_dir: str = typer.Argument(..., help="Directory to store the folds in"),
+    folds: int = typer.Argument(default=5, help="Number of folds; at least 2"),
+    image_locate: Optional[str] = typer.Argument(
+        default="", help="Locate images of every fold if the value is given."
+    ),
+    compact: bool = typer.Option(
+        False, help="Write annotations without indentation or key sorting."
+    ),
+    placement: Placement = typer.Option(
+        Placement.hardlink,
+        help="Place images as copies, hardlinks, symlinks or reflinks. Links fall back to copies where the file system refuses them.",
+    ),
+    group_by: Optional[str] = typer.Option(
+        None,
+        help="Keep groups of images in one fold: a regex whose first group (or whole match) in the file name is the group, or field:<name> for an image field.",
+    ),
+    seed: Optional[int] = typer.Option(
+        None, help="Seed of the shuffle, for reproducible folds."
+    ),
+    stratify: bool = typer.Option(
+        False,
+        help="Balance the share of every category between the folds, rare ones included, and report the counts per category.",
+    ),
+):
+    """
+    Writes fold_<i>/train and fold_<i>/val annotations for every fold i, val being
+    the i-th fold and train the others, and their images to fold_<i>/train_images
+    and fold_<i>/val_images.
+    """
+    # Load once; every fold takes its images and annotations by position
+    index = CocoIndex.from_file(ann_path)
+    dataset = index.dataset
+    annotated = np.flatnonzero(index.anns_per_image() > 0)
+    keys = group_keys(index.take_imgs(annotated), group_by) if group_by else None
+    if stratify:
+        counts, cat_ids = count_matrix(
+            index.img_ids[annotated], index.ann_image_ids, index.ann_category_ids
+        )
+        fold_of = stratified_folds(counts, folds, seed, keys)
+    else:
+        fold_of = fold_split(len(annotated), folds, seed, keys)
+
+    ext = split_ext(ann_path)[1]
+    outputs, pairs = [], []
+    for fold in range(folds):
+        fold_dir = os.path.join(out_dir, f"fold_{fold}")
+        os.makedirs(fold_dir, exist_ok=True)
+        in_val = fold_of == fold
+        if stratify:
+            print(f"Fold {fold}:")
+            _print_class_balance(index.categories, counts, cat_ids, ~in_val)
+        for name, members in (("train", ~in_val), ("val", in_val)):
+            positions = annotated[members]
+            images = index.take_imgs(positions)
+            ann_positions = np.sort(index.ann_positions_for_images(positions))
+            outputs.append(
+                (
+                    os.path.join(fold_dir, name + ext),
+                    {
+                        "annotations": index.take_anns(ann_positions),
+                        "categories": index.categories,
+                        "images": images,
+                        "info": dataset.get("info"),
+                        "licenses": dataset.get("licenses"),
+                    },
+                )
+            )
+            if image_locate:
+                pairs.extend(
+                    (
+                        os.path.join(image_locate, img["file_name"]),
+                        os.path.join(fold_dir, f"{name}_images", img["file_name"]),
+                    )
+                    for img in images
+                )
+
+    # All train/val files at once, then the images of every fold in one transfer
+    paths = [path for path, _ in outputs]
+    with ThreadPoolExecutor() as pool:
+        written = pool.map(
+            partial(_write_fold, compact=compact), paths, [c for _, c in outputs]
+        )
+        for path, n_annotations in zip(paths, written):
+            print(f"Saved {n_annotations} entries in {path}")
+    if image_locate:
+        transfer(pairs, placement=placement, desc=f"Locating images of {folds} folds")
+
+
+def _write_fold(path: str, coco: dict, compact: bool) -> int:
+    """Writes one train or val file, sections in the order of split."""
+    with CocoWriter(path, compact=compact, sort_keys=True) as writer:
+        n_annotations = writer.write_array("annotations", coco["annotations"])
+        writer.write_value("categories", coco["categories"])
+        writer.write_array("images", coco["images"])
+        writer.write_value("info", coco["info"])
+        writer.write_value("licenses", coco["licenses"])
+    return n_annotations
+
+
 @app.command()
 def update(
     new_ann_path: str = typer.Argument(..., help="Path to new COCO annotations file."),
@@ -300,20 +694,73 @@ def update(
     new_image_locate: Optional[str] = typer.Argument(
         default="", help="Locate images based on the split if the value is given."
     ),
+    placement: Placement = typer.Option(
+        Placement.copy,
+        help="Place images as copies, hardlinks, symlinks or reflinks. Links fall back to copies where the file system refuses them.",
+    ),
+    snapshot: bool = typer.Option(
+        False,
+        help=f"Record the results as a deduplicated snapshot in {STORE_DIR}.",
+    ),
+    append: bool = typer.Option(
+        False,
+        help="Append the new annotations as delta segments next to the existing train and val files instead of writing merged files. Fold them in with compact.",
+    ),
+    dedup: bool = typer.Option(
+        True,
+        help="Skip new images already in train or val, by name or content, and stop on new images that reuse an existing name for different content.",
+    ),
+    group_by: Optional[str] = typer.Option(
+        None,
+        help="Keep groups of images on one side: a regex whose first group (or whole match) in the file name is the group, or field:<name> for an image field.",
+    ),
+    seed: Optional[int] = typer.Option(
+        None, help="Seed of the shuffle, for a reproducible split."
+    ),
+    stratify: bool = typer.Option(
+        False,
+        help="Balance the share of every category between train and val, rare ones included, and report the counts per category.",
+    ),
+    hashed: bool = typer.Option(
+        False,
+        "--hash",
+        help="Assign every image from a stable hash of its file name, or group key, and the seed: the same image always lands on the same side. Streams the file in bounded memory.",
+    ),
 ):
+    if hashed and stratify:
+        raise ValueError("--hash and --stratify cannot be combined")
+    # The new batch is parsed once and split in memory; the existing train
+    # and val files are streamed by the merge. Only the merged files are written.
+    new_dataset = serialization.load(new_ann_path)
+    new_index = CocoIndex(new_dataset, new_ann_path)
     assert (
-        validate(new_image_locate, new_ann_path) is True
+        _match_file_names(new_image_locate, new_index.file_names) is True
     ), "Images in coco and image DIR doesn't match."
 
+    unseen = np.ones(len(new_index), dtype=bool)
+    if dedup:
+        unseen = _unseen_images(
+            new_index.file_names, new_image_locate, train_ann_path, val_ann_path
+        )
+        if not unseen.any():
+            typer.echo("All new images are already in train or val.")
+            return
+
     now = int(time.time())
     current_path = os.getcwd()  # Get the current working directory
     outcome_path = os.path.join(
         current_path, f"results/{now}"
     )  # Make outcome_path absolute
 
-    # Setup paths
-    outcome_train_ann = os.path.join(outcome_path, "train", "ann")
-    outcome_val_ann = os.path.join(outcome_path, "val", "ann")
+    # Setup paths. The updated annotations are the merged files postupdate
+    # reads, or with --append the existing files that take the deltas
+    if append:
+        outcome_train_ann, outcome_val_ann = train_ann_path, val_ann_path
+    else:
+        outcome_train_ann, outcome_val_ann = (
+            os.path.join(outcome_path, side, "results/merged/annotations/merged.json")
+            for side in ("train", "val")
+        )
     outcome_train_img = os.path.join(outcome_path, "train", "images")
     outcome_val_img = os.path.join(outcome_path, "val", "images")
 
@@ -325,8 +772,14 @@ def update(
         "train_ann_path": train_ann_path,
         "val_ann_path": val_ann_path,
         "split_ratio": split_ratio,
+        "group_by": group_by,
+        "seed": seed,
+        "stratify": stratify,
+        "hash": hashed,
+        "outcome_path": outcome_path,
         "outcome_train_ann": outcome_train_ann,
         "outcome_val_ann": outcome_val_ann,
+        "append": append,
     }
 
     with open("latest_update_configs.yaml", "w") as file:
@@ -334,34 +787,127 @@ def update(
 
     typer.echo("Update configurations saved to latest_update_configs.yaml")
 
-    # Create relevant folders
-    os.makedirs(outcome_train_ann, exist_ok=True)
-    os.makedirs(outcome_val_ann, exist_ok=True)
-
-    # place holders to run COCO Assistant successfully. no images will be actually located to run memory efficiently.
-    os.makedirs(os.path.join(outcome_train_img, "existing_train"), exist_ok=True)
-    os.makedirs(os.path.join(outcome_train_img, "new_train_images"), exist_ok=True)
-    os.makedirs(os.path.join(outcome_val_img, "existing_val"), exist_ok=True)
-    os.makedirs(os.path.join(outcome_val_img, "new_val_images"), exist_ok=True)
-
-    split(
-        new_ann_path,
-        os.path.join(outcome_train_ann, "new_train_images.json"),
-        os.path.join(outcome_val_ann, "new_val_images.json"),
-        split_ratio,
-        new_image_locate,
+    # Split the annotated images of the new batch
+    annotated = np.flatnonzero(
+        np.isin(new_index.img_ids, new_index.ann_image_ids) & unseen
     )
+    keys = pinned = None
+    if group_by:
+        keys = group_keys(new_index.take_imgs(annotated), group_by)
+    if group_by and not hashed:
+        # Groups already in train or val stay there
+        pinned = {}
+        for side, ann_path in ((VAL, val_ann_path), (TRAIN, train_ann_path)):
+            existing = coco_delta.read_sections(ann_path, ("images",))["images"]
+            pinned.update(dict.fromkeys(group_keys(existing or [], group_by), side))
+    if hashed:
+        # Same name, or group, and seed: same side as in every earlier update
+        if keys is None:
+            keys = [new_index.file_names[i] for i in annotated]
+        in_train = hash_split(keys, split_ratio, seed)
+    elif stratify:
+        counts, cat_ids = count_matrix(
+            new_index.img_ids[annotated],
+            new_index.ann_image_ids,
+            new_index.ann_category_ids,
+        )
+        in_train = stratified_split(counts, split_ratio, seed, keys, pinned)
+        _print_class_balance(new_index.categories, counts, cat_ids, in_train)
+    elif group_by:
+        in_train = group_split(keys, split_ratio, seed, pinned)
+    if hashed or stratify or group_by:
+        train_pos, val_pos = annotated[in_train], annotated[~in_train]
+    else:
+        train_pos, val_pos = train_test_split(
+            annotated, train_size=split_ratio, shuffle=True, random_state=seed
+        )
 
-    # Move splitted images
-    locate_images(
-        train_ann_path, os.path.join(outcome_train_ann, "existing_train.json")
+    sides = (
+        ("train", train_pos, train_ann_path, outcome_train_img, outcome_train_ann),
+        ("val", val_pos, val_ann_path, outcome_val_img, outcome_val_ann),
     )
-    locate_images(val_ann_path, os.path.join(outcome_val_ann, "existing_val.json"))
+    for side, img_pos, existing_ann_path, outcome_img, merged_path in sides:
+        images = new_index.take_imgs(img_pos)
+        new_subset = {
+            "info": new_dataset.get("info"),
+            "licenses": new_dataset.get("licenses"),
+            "categories": new_index.categories,
+            "images": images,
+            "annotations": new_index.take_anns(
+                np.sort(new_index.ann_positions_for_images(img_pos))
+            ),
+        }
+
+        # postupdate picks the new images up from here
+        new_images_dir = os.path.join(outcome_img, f"new_{side}_images")
+        os.makedirs(new_images_dir, exist_ok=True)
+        if new_image_locate:
+            transfer(
+                (
+                    (
+                        os.path.join(new_image_locate, img["file_name"]),
+                        os.path.join(new_images_dir, img["file_name"]),
+                    )
+                    for img in images
+                ),
+                placement=placement,
+                desc=f"Locating images in {new_images_dir}",
+            )
+
+        if append:
+            # Only the new records are written; readers see them with the base
+            delta_path, counts = coco_delta.append(existing_ann_path, new_subset)
+            print(
+                f"Appended {counts['images']} images and {counts['annotations']} "
+                f"annotations to {existing_ann_path} in {delta_path}"
+            )
+            continue
+
+        # Existing samples first, so that they keep their ids
+        os.makedirs(os.path.dirname(merged_path), exist_ok=True)
+        counts = merge_coco([existing_ann_path, new_subset], merged_path, max_workers=1)
+        print(
+            f"Saved {counts['images']} images and {counts['annotations']} "
+            f"annotations in {merged_path}"
+        )
+
+    if snapshot:
+        _record_snapshot(outcome_path, f"results-{now}")
+
+
+def _unseen_images(
+    file_names: List[str], new_image_locate: str, train_ann_path: str, val_ann_path: str
+) -> np.ndarray:
+    """Mask of the new images that are in neither train nor val.
+
+    Existing images are hashed in train_images and val_images next to their
+    annotation files, the layout written by postupdate; without those
+    folders they are matched by name only.
+    """
+    image_index = ImageIndex()
+    for name, ann_path in (("train", train_ann_path), ("val", val_ann_path)):
+        img_dir = os.path.join(os.path.dirname(ann_path), f"{name}_images")
+        image_index.add(name, _image_file_names(ann_path), img_dir)
+    matches = image_index.classify(file_names, new_image_locate or None)
+
+    conflicting = [
+        (file_name, match)
+        for file_name, match in zip(file_names, matches)
+        if match.status == CONFLICTING
+    ]
+    for file_name, match in conflicting[:10]:
+        print(f"{file_name} differs from {match.file_name} in {match.split}")
+    if conflicting:
+        raise ValueError(
+            f"{len(conflicting)} new images reuse the names of different existing images"
+        )
 
-    # Merge train and val coco json
-    # path of outcome_train/val_img is not effective. just a place holder.
-    merge(outcome_train_img, outcome_train_ann)
-    merge(outcome_val_img, outcome_val_ann)
+    duplicate = np.array([match.status == DUPLICATE for match in matches], dtype=bool)
+    print(
+        f"{len(matches) - duplicate.sum()} new images, "
+        f"{duplicate.sum()} already in train or val are skipped"
+    )
+    return ~duplicate
 
 
 @app.command()
@@ -369,47 +915,44 @@ def separate_by_name(
     img_path: str = typer.Argument(..., help="Path to image files"),
     ann_path: str = typer.Argument(..., help="Path to COCO annotations file"),
     name_keys: List[str] = typer.Argument(...),
+    compact: bool = typer.Option(
+        False, help="Write annotations without indentation or key sorting."
+    ),
+    placement: Placement = typer.Option(
+        Placement.copy,
+        help="Place images as copies, hardlinks, symlinks or reflinks. Links fall back to copies where the file system refuses them.",
+    ),
 ):
+    """
+    Keys are substrings of the file names, or named regular expressions and shell
+    patterns such as cam1=re:^cam1_ and cam1=glob:cam1_*.jpg.
+    """
     # Load COCO annotations
-    coco = COCO(ann_path)
-    separated_cocos = []
-    covered_img_ids = set()
-    new_coco_dicts = {}
+    index = CocoIndex.from_file(ann_path)
+    matcher = NameMatcher(name_keys)
+    file_names = index.file_names
 
     # Get the initial counts
-    initial_image_count = len(coco.getImgIds())
-    initial_annotation_count = len(coco.getAnnIds())
-
-    for name_key in name_keys:
-        # Filter image ids that contain the name_key in their file name
-        img_ids = [
-            img_id
-            for img_id in coco.getImgIds()
-            if name_key in coco.loadImgs(img_id)[0]["file_name"]
-        ]
-        covered_img_ids.update(img_ids)
-
-        # Load images and annotations for these image ids
-        images = coco.loadImgs(img_ids)
-        annotations = coco.loadAnns(coco.getAnnIds(imgIds=img_ids))
-        categories = coco.loadCats(coco.getCatIds())
-
-        # Create separate COCO annotation
-        separated_coco = {
-            "images": images,
-            "annotations": annotations,
-            "categories": categories,
-        }
+    initial_image_count = len(index)
+    initial_annotation_count = index.n_annotations
 
-        # Collect the changes in a dictionary
-        new_coco_dicts[name_key] = separated_coco
+    # One pass over all file names finds the keys of every image
+    img_pos, key_pos = matcher.match(file_names)
+    bounds = np.searchsorted(key_pos, np.arange(len(matcher.labels) + 1))
+    new_coco_dicts = {}
+    for k, name_key in enumerate(matcher.labels):
+        positions = img_pos[bounds[k] : bounds[k + 1]]
+        new_coco_dicts[name_key] = {
+            "images": index.take_imgs(positions),
+            "annotations": index.take_anns(index.ann_positions_for_images(positions)),
+            "categories": index.categories,
+        }
 
     # Check for uncovered images
-    all_img_ids = set(coco.getImgIds())
-    uncovered_img_ids = all_img_ids - covered_img_ids
-    if uncovered_img_ids:
-        uncovered_images = coco.loadImgs(list(uncovered_img_ids))
-        uncovered_filenames = [img["file_name"] for img in uncovered_images]
+    covered = np.zeros(len(index), dtype=bool)
+    covered[img_pos] = True
+    if not covered.all():
+        uncovered_filenames = [file_names[i] for i in np.flatnonzero(~covered)]
         raise ValueError(f"Uncovered images found: {uncovered_filenames}")
 
     # Verify the counts
@@ -430,49 +973,69 @@ def separate_by_name(
             f"Annotation count mismatch: {initial_annotation_count} != {post_annotation_count}"
         )
 
-    # Apply the changes after validation
+    # Apply the changes after validation: images of all keys in one transfer,
+    # the separate COCO files in parallel
     parent_dir = os.path.dirname(img_path)
-    for name_key, separated_coco in new_coco_dicts.items():
-        # Create directory for name_key if it doesn't exist
+    for name_key in new_coco_dicts:
         os.makedirs(os.path.join(parent_dir, name_key), exist_ok=True)
+    transfer(
+        (
+            (
+                os.path.join(img_path, img["file_name"]),
+                os.path.join(parent_dir, name_key, img["file_name"]),
+            )
+            for name_key, separated_coco in new_coco_dicts.items()
+            for img in separated_coco["images"]
+        ),
+        placement=placement,
+        missing_ok=True,
+        desc="Copying separated images",
+    )
 
-        # Move images to respective directories
-        for img in separated_coco["images"]:
-            src = os.path.join(img_path, img["file_name"])
-            dst = os.path.join(parent_dir, name_key, img["file_name"])
-            if os.path.exists(src):  # Ensure the file exists before copying
-                shutil.copy(src, dst)
-
-        # Save separate COCO file
-        coco_file_name = f"{name_key}.json"
-        with open(os.path.join(parent_dir, coco_file_name), "w") as f:
-            json.dump(separated_coco, f, indent=2)
-        separated_cocos.append(coco_file_name)
+    separated_cocos = [
+        f"{name_key}{split_ext(ann_path)[1]}" for name_key in new_coco_dicts
+    ]
+    with ThreadPoolExecutor() as pool:
+        list(
+            pool.map(
+                partial(_write_separated, compact=compact),
+                [os.path.join(parent_dir, name) for name in separated_cocos],
+                new_coco_dicts.values(),
+            )
+        )
 
     return separated_cocos
 
 
+def _write_separated(path: str, separated_coco: dict, compact: bool) -> None:
+    with CocoWriter(path, compact=compact) as writer:
+        writer.write_array("images", separated_coco["images"])
+        writer.write_array("annotations", separated_coco["annotations"])
+        writer.write_value("categories", separated_coco["categories"])
+
+
 @app.command()
 def validate(
     img_path: str = typer.Argument(..., help="Path to image files"),
-    ann_path: str = typer.Argument(..., help="Path to COCO annotations file"),
+    ann_path: str = typer.Argument(..., help="Path to COCO annotations file or shard directory"),
 ):
     """
     This code validates if all images in coco exist in img_path.
     """
 
-    filenames_in_folder = get_image_files(img_path)
-    filenames_in_folder = [os.path.basename(i) for i in filenames_in_folder]
-
-    coco = COCO(ann_path)
+    # Get filenames for each image
+    if is_shard_dir(ann_path):
+        file_names = sum(map_shards(ann_path, _shard_file_names), [])
+    else:
+        file_names = _image_file_names(ann_path)
+    return _match_file_names(img_path, file_names)
 
-    img_ids = coco.getImgIds()
 
-    # Get filenames for each image
-    filenames_in_coco = [
-        os.path.basename(coco.loadImgs(image_id)[0]["file_name"])
-        for image_id in img_ids
-    ]
+def _match_file_names(img_path: str, file_names: List[str]) -> bool:
+    """True if the images in img_path are exactly the given COCO file names."""
+    filenames_in_folder = get_image_files(img_path)
+    filenames_in_folder = [os.path.basename(i) for i in filenames_in_folder]
+    filenames_in_coco = [os.path.basename(name) for name in file_names]
 
     if sorted(filenames_in_folder) == sorted(filenames_in_coco):
         print("Filenames in folder and filenames in coco exactly matches!!")
@@ -495,10 +1058,66 @@ def validate(
         return False
 
 
+def _shard_file_names(shard_dir: str, shard: int) -> List[str]:
+    images = iter_shard(shard_path(shard_dir, read_header(shard_dir), "images", shard))
+    return [img["file_name"] for img in images]
+
+
+def _image_file_names(ann_path: str) -> List[str]:
+    """File names of a COCO file, from its index cache or the images section alone.
+
+    Delta segments appended to the file are read as well, without the cache.
+    """
+    index = None if coco_delta.delta_paths(ann_path) else load_cached_index(ann_path)
+    if index is not None:
+        return index.file_names
+    images = coco_delta.read_sections(
+        ann_path, ("images",), fields={"images": ("file_name",)}
+    )
+    return [img["file_name"] for img in images["images"] or []]
+
+
+def _read_categories(ann_path: str) -> list:
+    """Categories of a COCO file or shard directory."""
+    if is_shard_dir(ann_path):
+        return read_header(ann_path)["sections"].get("categories") or []
+    return read_sections(ann_path, ("categories",))["categories"] or []
+
+
+def _transform(ann_path: str, suffix: str, handlers: dict, **kwargs) -> str:
+    """Rewrites a COCO file or shard directory next to it, named with ``suffix``."""
+    directory = os.path.dirname(os.path.normpath(ann_path))
+    filename, ext = split_ext(os.path.basename(os.path.normpath(ann_path)))
+    out_path = os.path.join(directory, filename + suffix + ext)
+    if is_shard_dir(ann_path):
+        kwargs.pop("compact", None)
+        kwargs.pop("fields", None)
+        transform_shards(ann_path, out_path, handlers, **kwargs)
+    else:
+        transform_coco(ann_path, out_path, handlers, **kwargs)
+    return out_path
+
+
+def _drop_category(cat_ids: set, category: dict) -> Optional[dict]:
+    return None if category["id"] in cat_ids else category
+
+
+def _drop_annotation(cat_ids: set, annotation: dict) -> Optional[dict]:
+    return None if annotation["category_id"] in cat_ids else annotation
+
+
+def _remap_annotation(convert_category_id: dict, annotation: dict) -> dict:
+    annotation["category_id"] = convert_category_id[annotation["category_id"]]
+    return annotation
+
+
 @app.command()
 def delete(
     config: str = typer.Argument(..., help="Path to category manage config file"),
-    ann_path: str = typer.Argument(..., help="Path to COCO annotations file"),
+    ann_path: str = typer.Argument(..., help="Path to COCO annotations file or shard directory"),
+    compact: bool = typer.Option(
+        False, help="Write annotations without indentation or key sorting."
+    ),
 ):
     """
     This code referes to COCO-Assistant > remove_cat.
@@ -508,37 +1127,27 @@ def delete(
         config_catman = yaml.safe_load(file)
 
     # list of cagetories to be removed
-    rcats = config_catman["delete"]
-
-    coco = COCO(ann_path)
+    rcats = set(config_catman["delete"])
 
     # Gives you a list of category ids of the categories to be removed
-    catids_remove = coco.getCatIds(catNms=rcats)
+    categories = _read_categories(ann_path)
+    catids_remove = {cat["id"] for cat in categories if cat["name"] in rcats}
 
     if len(catids_remove) == 0:
         print("Nothing to be removed.")
         return
 
-    # Gives you a list of ids of annotations that contain those categories
-    annids_remove = coco.getAnnIds(catIds=catids_remove)
-
-    # Get keep category ids
-    catids_keep = list(set(coco.getCatIds()) - set(catids_remove))
-    # Get keep annotation ids
-    annids_keep = list(set(coco.getAnnIds()) - set(annids_remove))
-
-    with open(ann_path) as it:
-        ann = json.load(it)
-
-    del ann["categories"]
-    ann["categories"] = coco.loadCats(catids_keep)
-    del ann["annotations"]
-    ann["annotations"] = coco.loadAnns(annids_keep)
-
-    directory = os.path.dirname(ann_path)
-    filename = os.path.splitext(os.path.basename(ann_path))[0]
-    with open(os.path.join(directory, filename + "_delete.json"), "w") as oa:
-        json.dump(ann, oa, indent=4)
+    # Stream the file (or every shard) once, dropping the categories and their annotations
+    _transform(
+        ann_path,
+        "_delete",
+        {
+            "categories": partial(_drop_category, catids_remove),
+            "annotations": partial(_drop_annotation, catids_remove),
+        },
+        compact=compact,
+        fields={"annotations": ("category_id",)},
+    )
 
     print("Successfully deleted the desired categories.")
 
@@ -554,6 +1163,14 @@ def postupdate(
     results_path: str = typer.Option(
         None, help="Path to results directory containing the merged JSON annotations"
     ),
+    placement: Placement = typer.Option(
+        Placement.copy,
+        help="Place images as copies, hardlinks, symlinks or reflinks. Links fall back to copies where the file system refuses them.",
+    ),
+    snapshot: bool = typer.Option(
+        False,
+        help=f"Record the results as a deduplicated snapshot in {STORE_DIR}.",
+    ),
 ):
     """
     Combines new and existing image datasets from specified directories and moves corresponding annotations to the processed_result directory.
@@ -593,12 +1210,16 @@ def postupdate(
         if not os.path.isdir(source_dir):
             print(f"Source directory not found: {source_dir}")
             return False
-        for filename in os.listdir(source_dir):
-            source_path = os.path.join(source_dir, filename)
-            dest_path = os.path.join(dest_dir, filename)
-            if not os.path.exists(dest_path):
-                shutil.copy(source_path, dest_path)
-        return True
+        stats = transfer(
+            (
+                (os.path.join(source_dir, f), os.path.join(dest_dir, f))
+                for f in os.listdir(source_dir)
+            ),
+            placement=placement,
+            skip_existing=True,
+            desc=f"Copying {source_dir}",
+        )
+        return not stats.failed
 
     # Copy images from sources to destinations
     if (
@@ -613,6 +1234,9 @@ def postupdate(
     shutil.copy(new_train_ann_path, os.path.join(processed_result_dir, "train.json"))
     shutil.copy(new_val_ann_path, os.path.join(processed_result_dir, "val.json"))
 
+    if snapshot:
+        _record_snapshot(processed_result_dir, f"processed_results-{now}")
+
     typer.echo("Post-processing completed successfully.")
 
     return (
@@ -626,7 +1250,10 @@ def postupdate(
 @app.command()
 def process(
     config: str = typer.Argument(..., help="Path to category manage config file"),
-    ann_path: str = typer.Argument(..., help="Path to COCO annotations file"),
+    ann_path: str = typer.Argument(..., help="Path to COCO annotations file or shard directory"),
+    compact: bool = typer.Option(
+        False, help="Write annotations without indentation or key sorting."
+    ),
 ):
     with open(config, "r") as file:
         config_catman = yaml.safe_load(file)
@@ -634,13 +1261,12 @@ def process(
     # list of cagetories to be processed
     pcat = config_catman["process"]
 
-    with open(ann_path, "r") as file:
-        ann = json.load(file)
+    categories = _read_categories(ann_path)
 
     unique_categories = {}
     convert_category_id = {}
 
-    for category in ann["categories"]:
+    for category in categories:
         if category["name"] in pcat:
             category["name"] = pcat[category["name"]]
 
@@ -658,16 +1284,15 @@ def process(
                 category["id"] = cat_id
                 unique_categories[category["name"]] = category
 
-    # Replace the categories in the Coco data
-    ann["categories"] = list(unique_categories.values())
-
-    for annotation in ann["annotations"]:
-        annotation["category_id"] = convert_category_id[annotation["category_id"]]
-
-    directory = os.path.dirname(ann_path)
-    filename = os.path.splitext(os.path.basename(ann_path))[0]
-    with open(os.path.join(directory, filename + "_process.json"), "w") as oa:
-        json.dump(ann, oa, indent=4)
+    # Replace the categories and category ids while streaming the Coco data
+    _transform(
+        ann_path,
+        "_process",
+        {"annotations": partial(_remap_annotation, convert_category_id)},
+        replace={"categories": list(unique_categories.values())},
+        compact=compact,
+        fields={"annotations": ("category_id",)},
+    )
 
     print("Successfully processed the categories and annotations.")
 
@@ -692,20 +1317,143 @@ def replaceimgformat(
     None. The function operates in-place on the provided JSON file.
     """
     if os.path.isfile(annotation):
-        with open(annotation, "r") as file:
-            ann = json.load(file)
 
-        # Replace the image extension to desired format
-        for ann_img in ann["images"]:
+        def replace_format(ann_img):
+            # Replace the image extension to desired format
             ann_img["file_name"] = ann_img["file_name"].split(".")[0] + "." + format
-
-        # Save the Python object as JSON
-        with open(annotation, "w") as file:
-            json.dump(ann, file, indent=4)
+            return ann_img
+
+        # Rewrite the file in a single streaming pass, decoding only file names
+        transform_coco(
+            annotation,
+            annotation,
+            {"images": replace_format},
+            fields={"images": ("file_name",)},
+        )
 
     else:
         print(f"{annotation} does not exist.")
 
 
+@app.command()
+def shard(
+    ann_path: str = typer.Argument(..., help="Path to COCO annotations file"),
+    shard_dir: Optional[str] = typer.Argument(
+        None, help="Output directory. Defaults to <annotations>.shards"
+    ),
+    num_shards: int = typer.Option(8, help="Number of shards."),
+    compress: bool = typer.Option(False, help="gzip the shard files."),
+):
+    """
+    [bold green]Convert a COCO file into JSONL shards partitioned by image id[/bold green]
+
+    delete, process, convert and validate accept the shard directory in place of
+    the annotations file and process the shards in parallel.
+    """
+    if shard_dir is None:
+        shard_dir = split_ext(ann_path)[0] + ".shards"
+    header = shard_coco(ann_path, shard_dir, num_shards=num_shards, compress=compress)
+    print(
+        f"Saved {sum(header['counts']['images'])} images and "
+        f"{sum(header['counts']['annotations'])} annotations "
+        f"in {num_shards} shards at {shard_dir}"
+    )
+
+
+@app.command()
+def unshard(
+    shard_dir: str = typer.Argument(..., help="Shard directory written by shard"),
+    ann_path: str = typer.Argument(..., help="Where to store the COCO file"),
+    compact: bool = typer.Option(
+        False, help="Write annotations without indentation or key sorting."
+    ),
+):
+    """
+    [bold green]Reassemble a shard directory into a standard COCO file[/bold green]
+    """
+    unshard_coco(shard_dir, ann_path, compact=compact)
+    print(f"Saved {ann_path}")
+
+
+@app.command("compact")
+def compact_deltas(
+    ann_path: str = typer.Argument(
+        ..., help="Path to a COCO annotations file with appended deltas"
+    ),
+    compact: bool = typer.Option(False, help="Write annotations without indentation."),
+):
+    """
+    [bold green]Fold the delta segments appended by update --append into the file[/bold green]
+    """
+    counts = coco_delta.fold(ann_path, compact=compact)
+    if not counts:
+        print(f"No deltas appended to {ann_path}")
+        return
+    print(
+        f"Saved {counts['images']} images and {counts['annotations']} "
+        f"annotations in {ann_path}"
+    )
+
+
+def _record_snapshot(directory: str, name: str, store: str = STORE_DIR) -> None:
+    result = SnapshotStore(store).snapshot(directory, name)
+    print(
+        f"Recorded snapshot {name}: {len(result['files'])} files, "
+        f"{result['new_objects']} new objects ({result['new_bytes'] / 1e6:.1f} MB)"
+    )
+
+
+@app.command()
+def snapshot(
+    directory: str = typer.Argument(..., help="Directory to record"),
+    name: Optional[str] = typer.Argument(
+        None, help="Snapshot name. Defaults to the directory name"
+    ),
+    store: str = typer.Option(STORE_DIR, help="Snapshot store directory."),
+):
+    """
+    [bold green]Record a directory as a deduplicated snapshot[/bold green]
+
+    Files are stored once by content hash, and the recorded files are replaced
+    by hardlinks to the stored objects.
+    """
+    name = name or os.path.basename(os.path.normpath(directory))
+    _record_snapshot(directory, name, store)
+
+
+@app.command()
+def checkout(
+    name: str = typer.Argument(..., help="Snapshot name"),
+    target: str = typer.Argument(..., help="Directory to place the files in"),
+    store: str = typer.Option(STORE_DIR, help="Snapshot store directory."),
+    placement: Placement = typer.Option(
+        Placement.hardlink,
+        help="Place files as copies, hardlinks, symlinks or reflinks. Edit copies only; links share the stored objects.",
+    ),
+):
+    """
+    [bold green]Place the files of a snapshot in a directory[/bold green]
+    """
+    n_files = SnapshotStore(store).checkout(name, target, placement)
+    print(f"Checked out {n_files} files of {name} at {target}")
+
+
+@app.command()
+def gc(
+    store: str = typer.Option(STORE_DIR, help="Snapshot store directory."),
+    remove: Optional[List[str]] = typer.Option(
+        None, help="Snapshots to delete before collecting."
+    ),
+):
+    """
+    [bold green]Delete stored objects that no snapshot refers to[/bold green]
+    """
+    snapshot_store = SnapshotStore(store)
+    for name in remove or []:
+        snapshot_store.remove(name)
+    removed, freed = snapshot_store.gc()
+    print(f"Deleted {removed} objects, freed {freed / 1e6:.1f} MB")
+
+
 if __name__ == "__main__":
     app()
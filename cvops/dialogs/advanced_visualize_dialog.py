@@ -20,7 +20,7 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt, QSize
 from PyQt5.QtGui import QColor, QIcon, QFont
 from cvops.coco_operation import visualize as coco_visualize
-from pycocotools.coco import COCO
+from tools.coco_index import CocoIndex
 
 
 class AdvancedVisualizeDialog(QDialog):
@@ -39,7 +39,7 @@ class AdvancedVisualizeDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("Advanced Visualization")
         self.setMinimumSize(700, 500)
-        self.coco = None
+        self.index = None
         self.categories = []
         self.selected_categories = []
         self.visualization_colors = {}
@@ -161,7 +161,7 @@ class AdvancedVisualizeDialog(QDialog):
     
     def selectAnnPath(self):
         annPath, _ = QFileDialog.getOpenFileName(
-            self, "Select Annotation File", filter="JSON files (*.json)"
+            self, "Select Annotation File", filter="JSON files (*.json *.json.gz *.json.zst)"
         )
         if annPath:
             self.annPathLabel.setText(f"Annotation File: {annPath}")
@@ -169,13 +169,12 @@ class AdvancedVisualizeDialog(QDialog):
     
     def loadCategories(self, ann_path):
         try:
-            self.coco = COCO(ann_path)
+            self.index = CocoIndex.from_file(ann_path)
             self.categories = []
             self.categoryList.clear()
             
             # Get all categories
-            for cat_id in self.coco.getCatIds():
-                cat = self.coco.loadCats(cat_id)[0]
+            for cat in self.index.categories:
                 self.categories.append(cat)
                 
                 # Create list item with category name
@@ -11,6 +11,7 @@ from PyQt5.QtWidgets import (
 )
 
 from cvops.coco_operation import merge as cvops_merge
+from tools.transfer import Placement
 
 
 class MergeDialog(QDialog):
@@ -44,6 +45,7 @@ class MergeDialog(QDialog):
         layout.addWidget(annDirButton)
 
         self.mergeImagesCheckBox = QCheckBox("Merge Images")
+        self.mergeImagesCheckBox.setChecked(True)
         layout.addWidget(self.mergeImagesCheckBox)
 
         mergeButton = QPushButton("Merge")
@@ -73,7 +75,14 @@ class MergeDialog(QDialog):
             return
 
         try:
-            cvops_merge(img_dir, ann_dir)
+            cvops_merge(
+                img_dir,
+                ann_dir,
+                workers=None,
+                aliases=None,
+                merge_images=self.mergeImagesCheckBox.isChecked(),
+                placement=Placement.hardlink,
+            )
             QMessageBox.information(self, "Merge", "Datasets merged successfully.")
         except TypeError:
             QMessageBox.information(self, "Merge", "Datasets merge fail!")
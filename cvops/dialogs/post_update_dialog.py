@@ -4,6 +4,7 @@ import datetime
 
 from cvops.coco_operation import postupdate as coco_postupdate
 from cvops.coco_operation import visualize as coco_visualize
+from tools.transfer import Placement
 from tools.s3_handler import upload_s3_files, load_aws_credentials
 
 from PyQt5.QtCore import Qt
@@ -95,9 +96,7 @@ class PostUpdateDialog(QDialog):
 
                 # Using full paths from the configuration
                 existing_samples_dir = os.path.dirname(config.get("train_ann_path", ""))
-                results_path = os.path.dirname(
-                    os.path.dirname(config.get("outcome_train_ann", ""))
-                )
+                results_path = config.get("outcome_path", "")
 
                 # Validate paths are valid directories
                 if not (
@@ -138,7 +137,10 @@ class PostUpdateDialog(QDialog):
 
         try:
             train_json, train_img_dir, val_json, val_img_dir = coco_postupdate(
-                existing_samples_dir=existing_samples_dir, results_path=results_path
+                existing_samples_dir=existing_samples_dir,
+                results_path=results_path,
+                placement=Placement.copy,
+                snapshot=False,
             )
             QMessageBox.information(
                 self, "Post-update", "Dataset post-update completed successfully."
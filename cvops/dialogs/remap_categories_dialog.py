@@ -1,5 +1,4 @@
 import os
-import json
 
 from PyQt5.QtWidgets import (
     QFileDialog,
@@ -13,6 +12,9 @@ from PyQt5.QtWidgets import (
     QFormLayout,
 )
 
+from tools import serialization
+from tools.coco_stream import read_sections, transform_coco
+
 
 class RemapCategoriesDialog(QDialog):
     def __init__(self, parent=None):
@@ -36,7 +38,7 @@ class RemapCategoriesDialog(QDialog):
 
         # Initialize the QTextEdit with pretty JSON, if needed
         initialJsonData = {"5": 6, "6": 7, "7": 5}  # Example data
-        prettyJsonStr = json.dumps(initialJsonData, indent=4)  # Prettify the JSON
+        prettyJsonStr = serialization.dumps(initialJsonData, indent=4)  # Prettify the JSON
         self.jsonTextEdit.setText(prettyJsonStr)
 
         layout.addLayout(formLayout)
@@ -49,7 +51,7 @@ class RemapCategoriesDialog(QDialog):
 
     def selectAnnPath(self):
         path, _ = QFileDialog.getOpenFileName(
-            self, "Select Annotation File", "", "JSON files (*.json)"
+            self, "Select Annotation File", "", "JSON files (*.json *.json.gz *.json.zst)"
         )
         if path:
             self.annPathLabel.setText(f"Annotation File: {path}")
@@ -69,42 +71,44 @@ class RemapCategoriesDialog(QDialog):
 
         try:
             # Load mapping from the QTextEdit string
-            mapping_dict = json.loads(mapping_str)
+            mapping_dict = serialization.loads(mapping_str)
             mapping_dict = {int(k): int(v) for k, v in mapping_dict.items()}
 
-            # Load the COCO annotation data
-            with open(ann_file_path) as f:
-                coco_data = json.load(f)
-
-            # Apply the mapping to 'category_id' in all annotations
-            for annotation in coco_data["annotations"]:
-                if annotation["category_id"] in mapping_dict:
-                    annotation["category_id"] = mapping_dict[annotation["category_id"]]
+            # Load only the categories; annotations are streamed below
+            categories = read_sections(ann_file_path, ("categories",))["categories"]
 
-            for category in coco_data["categories"]:
+            for category in categories or []:
                 if category["id"] in mapping_dict:
                     category["id"] = mapping_dict[category["id"]]
 
             # Optionally, sort categories by the new 'id' values
-            coco_data["categories"] = sorted(
-                coco_data["categories"], key=lambda x: x["id"]
-            )
+            categories = sorted(categories or [], key=lambda x: x["id"])
 
-            # Also, consider if you want to update category IDs in the "categories" section
+            # Apply the mapping to 'category_id' in all annotations
+            def remap_annotation(annotation):
+                if annotation["category_id"] in mapping_dict:
+                    annotation["category_id"] = mapping_dict[annotation["category_id"]]
+                return annotation
 
             # Generate the updated file name
-            updated_file_name = f"{ann_file_path.rsplit('.', 1)[0]}_updated.json"
-
-            # Save the updated COCO data back to the new file
-            with open(updated_file_name, "w") as f:
-                json.dump(coco_data, f, indent=4)
+            root, ext = serialization.split_ext(ann_file_path)
+            updated_file_name = f"{root}_updated{ext}"
+
+            # Save the updated COCO data to the new file in one streaming pass
+            transform_coco(
+                ann_file_path,
+                updated_file_name,
+                {"annotations": remap_annotation},
+                replace={"categories": categories},
+                fields={"annotations": ("category_id",)},
+            )
 
             QMessageBox.information(
                 self,
                 "Success",
                 f"Categories remapped successfully.\nUpdated file: {updated_file_name}",
             )
-        except json.JSONDecodeError:
+        except serialization.JSONDecodeError:
             QMessageBox.critical(self, "Error", "Invalid JSON format for mapping.")
         except ValueError as e:  # Catching conversion errors for IDs
             QMessageBox.critical(self, "Error", str(e))
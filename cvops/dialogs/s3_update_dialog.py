@@ -10,6 +10,7 @@ from PyQt5.QtWidgets import (
     QInputDialog,
 )
 from cvops.coco_operation import update as coco_update
+from tools.transfer import Placement
 from tools.s3_handler import download_s3_files, load_aws_credentials
 
 
@@ -178,6 +179,14 @@ class S3UpdateDialog(QDialog):
             val_ann_path=os.path.join(existing_data_path, "val.json"),
             split_ratio=0.8,
             new_image_locate=new_image_path,
+            placement=Placement.copy,
+            snapshot=False,
+            append=False,
+            dedup=True,
+            group_by=None,
+            seed=None,
+            stratify=False,
+            hashed=False,
         )
         # MessageBox or logging
         print("Update Complete", "Dataset has been updated with files from S3.")
@@ -9,9 +9,12 @@ from PyQt5.QtWidgets import (
     QLabel,
     QLineEdit,
     QInputDialog,
+    QCheckBox,
 )
 from cvops.coco_operation import split as coco_split
+from tools.transfer import Placement
 from tools.s3_handler import upload_s3_files, load_aws_credentials
+from tools.serialization import split_ext
 
 
 class SplitDialog(QDialog):
@@ -51,6 +54,20 @@ class SplitDialog(QDialog):
         layout.addWidget(QLabel("Split Ratio (Train Size):"))
         layout.addWidget(self.splitRatioLineEdit)
 
+        # Optional: keep groups of images on one side, and a reproducible shuffle
+        self.groupByLineEdit = QLineEdit("")
+        layout.addWidget(QLabel("Group By (file name regex or field:<name>):"))
+        layout.addWidget(self.groupByLineEdit)
+
+        self.seedLineEdit = QLineEdit("")
+        layout.addWidget(QLabel("Seed:"))
+        layout.addWidget(self.seedLineEdit)
+
+        self.stratifyCheckBox = QCheckBox(
+            "Balance every category between train and val"
+        )
+        layout.addWidget(self.stratifyCheckBox)
+
         splitButton = QPushButton("Split")
         splitButton.clicked.connect(self.split)
         layout.addWidget(splitButton)
@@ -64,7 +81,7 @@ class SplitDialog(QDialog):
 
     def selectAnnPath(self):
         path, _ = QFileDialog.getOpenFileName(
-            self, "Select Annotation File", "", "JSON files (*.json)"
+            self, "Select Annotation File", "", "JSON files (*.json *.json.gz *.json.zst)"
         )
         if path:
             self.annPathLabel.setText(f"Annotation File: {path}")
@@ -75,6 +92,9 @@ class SplitDialog(QDialog):
         )  # Getting image directory for splitting
         ann_path = self.annPathLabel.text().replace("Annotation File: ", "")
         split_ratio = float(self.splitRatioLineEdit.text())
+        group_by = self.groupByLineEdit.text().strip() or None
+        seed_text = self.seedLineEdit.text().strip()
+        seed = int(seed_text) if seed_text else None
 
         if not os.path.exists(img_dir) or not os.path.exists(ann_path):
             QMessageBox.critical(
@@ -84,8 +104,10 @@ class SplitDialog(QDialog):
             )
             return
 
-        train_path = os.path.join(os.path.dirname(ann_path), "train.json")
-        val_path = os.path.join(os.path.dirname(ann_path), "val.json")
+        # Keep the compression of the input for the outputs
+        ext = split_ext(ann_path)[1]
+        train_path = os.path.join(os.path.dirname(ann_path), "train" + ext)
+        val_path = os.path.join(os.path.dirname(ann_path), "val" + ext)
 
         # Include the image_locate argument when calling coco_split
         coco_split(
@@ -95,6 +117,12 @@ class SplitDialog(QDialog):
             split=split_ratio,
             image_locate=img_dir,  # Passing the selected image directory
             independent=True,
+            compact=False,
+            placement=Placement.copy,
+            group_by=group_by,
+            seed=seed,
+            stratify=self.stratifyCheckBox.isChecked(),
+            hashed=False,
         )
 
         self.prompt_s3_upload(train_path, val_path)
@@ -16,6 +16,7 @@ from PyQt5.QtWidgets import (
 
 # Import the separate_by_name function
 from cvops.coco_operation import separate_by_name
+from tools.transfer import Placement
 
 
 class SplitNameDialog(QDialog):
@@ -61,7 +62,7 @@ class SplitNameDialog(QDialog):
 
     def browse_ann_path(self):
         file_name, _ = QFileDialog.getOpenFileName(
-            self, "Select Annotations File", filter="JSON files (*.json)"
+            self, "Select Annotations File", filter="JSON files (*.json *.json.gz *.json.zst)"
         )
         if file_name:
             self.annPathEdit.setText(file_name)
@@ -83,7 +84,13 @@ class SplitNameDialog(QDialog):
             return
 
         try:
-            separated_cocos = separate_by_name(img_path, ann_path, name_keys)
+            separated_cocos = separate_by_name(
+                img_path,
+                ann_path,
+                name_keys,
+                compact=False,
+                placement=Placement.copy,
+            )
             QMessageBox.information(self, "Success", "Files separated successfully.")
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
@@ -26,7 +26,8 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
-from pycocotools.coco import COCO
+
+from tools.coco_index import CocoIndex
 
 
 class MplCanvas(FigureCanvas):
@@ -50,7 +51,7 @@ class StatsDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("Dataset Statistics")
         self.setMinimumSize(900, 700)
-        self.coco = None
+        self.index = None
         self.setupUI()
     
     def setupUI(self):
@@ -147,7 +148,7 @@ class StatsDialog(QDialog):
     
     def selectAnnPath(self):
         annPath, _ = QFileDialog.getOpenFileName(
-            self, "Select Annotation File", filter="JSON files (*.json)"
+            self, "Select Annotation File", filter="JSON files (*.json *.json.gz *.json.zst)"
         )
         if annPath:
             self.annPathLabel.setText(f"Annotation File: {annPath}")
@@ -160,8 +161,8 @@ class StatsDialog(QDialog):
             return
         
         try:
-            # Load COCO dataset
-            self.coco = COCO(ann_path)
+            # Load COCO dataset into the columnar index
+            self.index = CocoIndex.from_file(ann_path)
             
             # Update all tabs with the dataset information
             self.updateSummaryTab()
@@ -175,30 +176,27 @@ class StatsDialog(QDialog):
             QMessageBox.critical(self, "Error", f"Analysis failed: {str(e)}")
     
     def updateSummaryTab(self):
-        if not self.coco:
+        if self.index is None:
             return
         
         # Get basic statistics
-        num_images = len(self.coco.imgs)
-        num_annotations = len(self.coco.anns)
-        num_categories = len(self.coco.cats)
+        num_images = len(self.index)
+        num_annotations = self.index.n_annotations
+        num_categories = len(self.index.categories)
         
         # Calculate annotations per image
-        anns_per_img = {}
-        for img_id in self.coco.imgs:
-            ann_ids = self.coco.getAnnIds(imgIds=img_id)
-            anns_per_img[img_id] = len(ann_ids)
+        anns_per_img = self.index.anns_per_image()
         
-        avg_anns_per_img = sum(anns_per_img.values()) / len(anns_per_img) if anns_per_img else 0
-        max_anns_per_img = max(anns_per_img.values()) if anns_per_img else 0
-        min_anns_per_img = min(anns_per_img.values()) if anns_per_img else 0
+        avg_anns_per_img = anns_per_img.mean() if len(anns_per_img) else 0
+        max_anns_per_img = anns_per_img.max() if len(anns_per_img) else 0
+        min_anns_per_img = anns_per_img.min() if len(anns_per_img) else 0
         
         # Get image size information
-        img_widths = [img['width'] for img in self.coco.imgs.values()]
-        img_heights = [img['height'] for img in self.coco.imgs.values()]
+        img_widths = self.index.img_widths
+        img_heights = self.index.img_heights
         
-        avg_width = sum(img_widths) / len(img_widths) if img_widths else 0
-        avg_height = sum(img_heights) / len(img_heights) if img_heights else 0
+        avg_width = img_widths.mean() if len(img_widths) else 0
+        avg_height = img_heights.mean() if len(img_heights) else 0
         
         # Format summary text
         summary_text = f"<h2>Dataset Summary</h2>"
@@ -220,18 +218,12 @@ class StatsDialog(QDialog):
         self.summaryText.setHtml(summary_text)
     
     def updateCategoriesTab(self):
-        if not self.coco:
+        if self.index is None:
             return
         
         # Get category distribution
-        category_counts = {}
-        for cat_id in self.coco.cats:
-            category_counts[cat_id] = 0
-        
-        for ann in self.coco.anns.values():
-            cat_id = ann['category_id']
-            if cat_id in category_counts:
-                category_counts[cat_id] += 1
+        category_counts = self.index.category_counts()
+        cat_by_id = {cat['id']: cat for cat in self.index.categories}
         
         # Create bar chart of category distribution
         self.categoryCanvas.axes.clear()
@@ -240,7 +232,7 @@ class StatsDialog(QDialog):
         sorted_cats = sorted(category_counts.items(), key=lambda x: x[1], reverse=True)
         cat_ids = [cat_id for cat_id, _ in sorted_cats]
         counts = [count for _, count in sorted_cats]
-        cat_names = [self.coco.cats[cat_id]['name'] for cat_id in cat_ids]
+        cat_names = [cat_by_id[cat_id]['name'] for cat_id in cat_ids]
         
         # Create bar chart
         bars = self.categoryCanvas.axes.bar(range(len(cat_ids)), counts, color='skyblue')
@@ -261,21 +253,21 @@ class StatsDialog(QDialog):
         self.categoryCanvas.draw()
         
         # Update category table
-        self.categoryTable.setRowCount(len(self.coco.cats))
+        self.categoryTable.setRowCount(len(cat_by_id))
         
-        for i, (cat_id, cat) in enumerate(self.coco.cats.items()):
+        for i, (cat_id, cat) in enumerate(cat_by_id.items()):
             self.categoryTable.setItem(i, 0, QTableWidgetItem(str(cat_id)))
             self.categoryTable.setItem(i, 1, QTableWidgetItem(cat['name']))
             self.categoryTable.setItem(i, 2, QTableWidgetItem(cat.get('supercategory', 'N/A')))
             self.categoryTable.setItem(i, 3, QTableWidgetItem(str(category_counts.get(cat_id, 0))))
     
     def updateImagesTab(self):
-        if not self.coco:
+        if self.index is None:
             return
         
         # Get image size information
-        img_widths = [img['width'] for img in self.coco.imgs.values()]
-        img_heights = [img['height'] for img in self.coco.imgs.values()]
+        img_widths = self.index.img_widths.tolist()
+        img_heights = self.index.img_heights.tolist()
         img_areas = [w * h for w, h in zip(img_widths, img_heights)]
         aspect_ratios = [w / h for w, h in zip(img_widths, img_heights)]
         
@@ -319,18 +311,15 @@ class StatsDialog(QDialog):
         self.imageStatsText.setHtml(stats_text)
     
     def updateAnnotationsTab(self):
-        if not self.coco:
+        if self.index is None:
             return
         
         # Calculate annotations per image
-        anns_per_img = {}
-        for img_id in self.coco.imgs:
-            ann_ids = self.coco.getAnnIds(imgIds=img_id)
-            anns_per_img[img_id] = len(ann_ids)
+        anns_per_img = self.index.anns_per_image()
         
         # Create histogram of annotations per image
         self.annotationsCanvas.axes.clear()
-        self.annotationsCanvas.axes.hist(list(anns_per_img.values()), bins=20, alpha=0.7, color='skyblue')
+        self.annotationsCanvas.axes.hist(anns_per_img, bins=20, alpha=0.7, color='skyblue')
         self.annotationsCanvas.axes.set_xlabel('Annotations per Image')
         self.annotationsCanvas.axes.set_ylabel('Number of Images')
         self.annotationsCanvas.axes.set_title('Distribution of Annotations per Image')
@@ -338,7 +327,7 @@ class StatsDialog(QDialog):
         self.annotationsCanvas.draw()
         
         # Calculate annotation statistics
-        ann_counts = list(anns_per_img.values())
+        ann_counts = anns_per_img.tolist()
         avg_anns = sum(ann_counts) / len(ann_counts) if ann_counts else 0
         median_anns = sorted(ann_counts)[len(ann_counts)//2] if ann_counts else 0
         max_anns = max(ann_counts) if ann_counts else 0
@@ -348,13 +337,8 @@ class StatsDialog(QDialog):
         zero_anns = sum(1 for count in ann_counts if count == 0)
         
         # Check for segmentation vs bbox annotations
-        has_segmentation = 0
-        has_bbox = 0
-        for ann in self.coco.anns.values():
-            if 'segmentation' in ann and ann['segmentation']:
-                has_segmentation += 1
-            if 'bbox' in ann and ann['bbox']:
-                has_bbox += 1
+        has_segmentation = int(self.index.ann_has_segmentation.sum())
+        has_bbox = int(self.index.ann_has_bbox.sum())
         
         # Format annotation statistics text
         stats_text = f"<h3>Annotation Distribution</h3>"
@@ -365,7 +349,7 @@ class StatsDialog(QDialog):
         stats_text += f"<p><b>Images with No Annotations:</b> {zero_anns} ({zero_anns/len(ann_counts)*100:.1f}% of images)</p>"
         
         stats_text += f"<h3>Annotation Types</h3>"
-        stats_text += f"<p><b>Annotations with Segmentation:</b> {has_segmentation} ({has_segmentation/len(self.coco.anns)*100:.1f}% of annotations)</p>"
-        stats_text += f"<p><b>Annotations with Bounding Boxes:</b> {has_bbox} ({has_bbox/len(self.coco.anns)*100:.1f}% of annotations)</p>"
+        stats_text += f"<p><b>Annotations with Segmentation:</b> {has_segmentation} ({has_segmentation/self.index.n_annotations*100:.1f}% of annotations)</p>"
+        stats_text += f"<p><b>Annotations with Bounding Boxes:</b> {has_bbox} ({has_bbox/self.index.n_annotations*100:.1f}% of annotations)</p>"
         
         self.annotationStatsText.setHtml(stats_text)
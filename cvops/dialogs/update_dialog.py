@@ -12,6 +12,7 @@ from PyQt5.QtWidgets import (
     QApplication,
 )
 from cvops.coco_operation import update as coco_update
+from tools.transfer import Placement
 
 
 class UpdateDialog(QDialog):
@@ -146,6 +147,14 @@ class UpdateDialog(QDialog):
                 val_ann_path=val_ann_path,
                 split_ratio=split_ratio,
                 new_image_locate=new_image_locate,
+                placement=Placement.copy,
+                snapshot=False,
+                append=False,
+                dedup=True,
+                group_by=None,
+                seed=None,
+                stratify=False,
+                hashed=False,
             )
             print("Update complete!")
             QApplication.quit()  # Quit the application
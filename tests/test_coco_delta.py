@@ -0,0 +1,136 @@
+import json
+import shutil
+
+import pytest
+
+from tools import coco_delta
+from tools.coco_index import CocoIndex
+from tools.coco_merge import merge_coco
+
+
+@pytest.fixture
+def coco_data_detections():
+    return "data/detections_1/images", "data/detections_1/annotations.json"
+
+
+@pytest.fixture
+def coco_data_segmentations():
+    return "data/segmentations_2/images", "data/segmentations_2/annotations.json"
+
+
+def test_append_and_fold_match_merge(
+    coco_data_detections, coco_data_segmentations, tmp_path
+):
+    """
+    Test that a base file read with its appended deltas, and the base after folding the
+    deltas in, hold the same dataset as merging all files at once.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, det_file = coco_data_detections
+    _, seg_file = coco_data_segmentations
+    base = tmp_path / "train.json"
+    shutil.copy(det_file, base)
+    base_bytes = base.read_bytes()
+
+    merge_coco([det_file, seg_file, seg_file], str(tmp_path / "merged.json"))
+    with open(tmp_path / "merged.json") as f:
+        expected = json.load(f)
+
+    with open(seg_file) as f:
+        seg = json.load(f)
+    paths = [coco_delta.append(str(base), seg_file)[0]]
+    paths.append(coco_delta.append(str(base), seg)[0])
+
+    assert base.read_bytes() == base_bytes, "appending must not rewrite the base"
+    assert coco_delta.delta_paths(str(base)) == paths
+    assert all(p.endswith(f".delta-0000{i}.json") for i, p in enumerate(paths, 1))
+    loaded = coco_delta.load(str(base))
+    for section in ("images", "annotations", "categories"):
+        assert loaded[section] == expected[section]
+    images = coco_delta.read_sections(str(base), ("images",))["images"]
+    assert images == expected["images"]
+    index = CocoIndex.from_file(str(base))
+    assert index.img_ids.tolist() == [img["id"] for img in expected["images"]]
+
+    counts = coco_delta.fold(str(base))
+    assert counts["annotations"] == len(expected["annotations"])
+    assert coco_delta.delta_paths(str(base)) == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["merged.json", "train.json"]
+    with open(base) as f:
+        folded = json.load(f)
+    for section in ("images", "annotations", "categories"):
+        assert folded[section] == expected[section]
+
+
+def test_append_refuses_changed_base(
+    coco_data_detections, coco_data_segmentations, tmp_path
+):
+    """
+    Test that deltas are refused once their base file was rewritten, as their ids no
+    longer continue it.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, det_file = coco_data_detections
+    _, seg_file = coco_data_segmentations
+    base = tmp_path / "train.json"
+    shutil.copy(det_file, base)
+    coco_delta.append(str(base), seg_file)
+
+    shutil.copy(seg_file, base)
+    with pytest.raises(ValueError, match="changed after deltas"):
+        coco_delta.load(str(base))
+    with pytest.raises(ValueError, match="changed after deltas"):
+        coco_delta.append(str(base), seg_file)
+
+
+def test_append_after_unsorted_ids(coco_data_segmentations, tmp_path):
+    """
+    Test that deltas continue after the largest ids of a base whose ids are not sorted,
+    as split writes them, so that the file read with its deltas, and folded, has
+    unique ids.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, seg_file = coco_data_segmentations
+    img_ids = [4, 2, 8, 9, 6]
+    base = tmp_path / "train.json"
+    base.write_text(
+        json.dumps(
+            {
+                "images": [{"id": i, "file_name": f"{i}.jpg"} for i in img_ids],
+                "annotations": [
+                    {"id": 10 * i, "image_id": i, "category_id": 1} for i in img_ids
+                ],
+                "categories": [{"id": 1, "name": "leaf"}],
+            }
+        )
+    )
+    with open(seg_file) as f:
+        seg = json.load(f)
+    coco_delta.append(str(base), seg)
+    loaded = coco_delta.load(str(base))
+    coco_delta.fold(str(base))
+    with open(base) as f:
+        folded = json.load(f)
+
+    seg_names = {img["id"]: img["file_name"] for img in seg["images"]}
+    for coco in (loaded, folded):
+        ids = [img["id"] for img in coco["images"]]
+        assert ids[:5] == img_ids and min(ids[5:]) == 10
+        assert len(set(ids)) == len(ids)
+        ann_ids = [ann["id"] for ann in coco["annotations"]]
+        assert len(set(ann_ids)) == len(ann_ids) and min(ann_ids[5:]) == 91
+        file_names = {img["id"]: img["file_name"] for img in coco["images"]}
+        assert [file_names[a["image_id"]] for a in coco["annotations"][5:]] == [
+            seg_names[a["image_id"]] for a in seg["annotations"]
+        ]
@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+
+import numpy as np
+import pytest
+from pycocotools.coco import COCO
+
+from tools.coco_index import COLUMNS, CocoIndex, cache_path, load_cached_index
+
+
+@pytest.fixture
+def coco_data_segmentations():
+    return "data/segmentations_2/images", "data/segmentations_2/annotations.json"
+
+
+def test_index_matches_pycocotools(coco_data_segmentations):
+    """
+    Test that CocoIndex answers the lookups the commands need exactly like pycocotools.COCO.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    """
+    _, ann_file = coco_data_segmentations
+    coco = COCO(ann_file)
+    index = CocoIndex.from_file(ann_file)
+
+    assert index.get_img_ids() == coco.getImgIds()
+    assert index.get_cat_ids() == coco.getCatIds()
+
+    for img_pos, img_id in enumerate(index.get_img_ids()):
+        expected = sorted(coco.getAnnIds(imgIds=img_id))
+        positions = index.ann_positions_for_images([img_pos])
+        assert sorted(index.ann_ids[positions].tolist()) == expected
+        assert index.anns_per_image()[img_pos] == len(expected)
+
+    cat_ids = coco.getCatIds(catNms=["apple", "banana"])
+    assert index.get_cat_ids(cat_names=["apple", "banana"]) == cat_ids
+    assert sorted(index.get_ann_ids(cat_ids=cat_ids)) == sorted(
+        coco.getAnnIds(catIds=cat_ids)
+    )
+
+    ann = index.annotations[0]
+    assert np.array_equal(index.ann_to_mask(ann), coco.annToMask(ann))
+
+
+def test_index_handles_unknown_ids(tmp_path):
+    """
+    Test that lookups of unknown ids and annotations pointing to missing images don't break the index.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    dataset = {
+        "images": [{"id": 7, "file_name": "a.jpg", "height": 2, "width": 2}],
+        "annotations": [
+            {"id": 1, "image_id": 7, "category_id": 1, "bbox": [0, 0, 1, 1]},
+            {"id": 2, "image_id": 99, "category_id": 1, "bbox": [0, 0, 1, 1]},
+        ],
+        "categories": [{"id": 1, "name": "leaf"}],
+    }
+    ann_path = tmp_path / "annotations.json"
+    ann_path.write_text(json.dumps(dataset))
+
+    index = CocoIndex.from_file(str(ann_path))
+    assert index.img_positions([7, 8]).tolist() == [0, -1]
+    assert index.anns_per_image().tolist() == [1]
+    assert index.load_anns([2, 3]) == [dataset["annotations"][1]]
+    assert index.category_counts() == {1: 2}
+
+
+def test_index_cache_roundtrip_and_invalidation(tmp_path):
+    """
+    Test that the sidecar cache is reused while the file is unchanged and rebuilt after it changes.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    dataset = {
+        "images": [
+            {"id": 3, "file_name": "b.jpg", "height": 4, "width": 6},
+            {"id": 1, "file_name": "ä.jpg", "height": 2, "width": 2},
+        ],
+        "annotations": [
+            {"id": 5, "image_id": 1, "category_id": 2, "bbox": [0, 0, 1, 1]},
+            {"id": 6, "image_id": 3, "category_id": 2, "segmentation": [[0, 0, 1, 1, 1, 0]]},
+        ],
+        "categories": [{"id": 2, "name": "leaf"}],
+    }
+    ann_path = tmp_path / "annotations.json"
+    ann_path.write_text(json.dumps(dataset, indent=2, ensure_ascii=False), encoding="UTF-8")
+
+    built = CocoIndex.from_file(str(ann_path))
+    assert os.path.isfile(cache_path(str(ann_path)))
+
+    cached = load_cached_index(str(ann_path))
+    assert cached is not None
+    for name in COLUMNS:
+        assert np.array_equal(getattr(cached, name), getattr(built, name))
+    assert cached.file_names == ["b.jpg", "ä.jpg"]
+    assert cached.categories == dataset["categories"]
+    assert cached.anns_for_image(1) == [dataset["annotations"][0]]
+    assert cached.load_imgs([1, 3]) == [dataset["images"][1], dataset["images"][0]]
+    assert cached.has_segmentation()
+    # Records were read through their byte spans, without parsing the file
+    assert cached.has_spans and cached._dataset is None
+
+    # Touching the file keeps the cache valid through the content hash
+    os.utime(ann_path, ns=(0, 0))
+    assert load_cached_index(str(ann_path)) is not None
+
+    dataset["images"][0]["file_name"] = "c.jpg"
+    ann_path.write_text(json.dumps(dataset))
+    assert load_cached_index(str(ann_path)) is None
+    assert CocoIndex.from_file(str(ann_path)).file_names == ["c.jpg", "ä.jpg"]
+
+
+def test_index_cache_with_empty_columns(tmp_path):
+    """
+    Test that a cache holding empty columns, the byte spans of a compressed file or the
+    annotations of a file without any, loads again instead of failing, and that a
+    truncated cache is rebuilt.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    dataset = {
+        "images": [{"id": 3, "file_name": "b.jpg", "height": 4, "width": 6}],
+        "annotations": [
+            {"id": 5, "image_id": 3, "category_id": 2, "bbox": [0, 0, 1, 1]}
+        ],
+        "categories": [{"id": 2, "name": "leaf"}],
+    }
+    gz_path = tmp_path / "annotations.json.gz"
+    with gzip.open(gz_path, "wt", encoding="UTF-8") as f:
+        json.dump(dataset, f)
+    empty_path = tmp_path / "empty.json"
+    empty_path.write_text(json.dumps(dict(dataset, annotations=[])))
+
+    for ann_path, n_annotations in ((gz_path, 1), (empty_path, 0)):
+        built = CocoIndex.from_file(str(ann_path))
+        cached = CocoIndex.from_file(str(ann_path))
+        assert load_cached_index(str(ann_path)) is not None
+        for name in COLUMNS:
+            assert np.array_equal(getattr(cached, name), getattr(built, name))
+        assert cached.n_annotations == n_annotations
+        assert cached.file_names == ["b.jpg"]
+
+    with open(cache_path(str(empty_path)), "r+b") as f:
+        f.truncate(64)
+    assert load_cached_index(str(empty_path)) is None
+    assert len(CocoIndex.from_file(str(empty_path))) == 1
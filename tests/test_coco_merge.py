@@ -0,0 +1,309 @@
+import json
+import os
+import shutil
+
+import pytest
+from coco_assistant import COCO_Assistant
+
+from tools.coco_merge import consolidate_images, merge_coco
+
+
+@pytest.fixture
+def coco_data_detections():
+    return "data/detections_1/images", "data/detections_1/annotations.json"
+
+
+@pytest.fixture
+def coco_data_segmentations():
+    return "data/segmentations_2/images", "data/segmentations_2/annotations.json"
+
+
+@pytest.mark.parametrize("order", [("a", "b"), ("b", "a")])
+def test_merge_matches_coco_assistant(
+    coco_data_detections, coco_data_segmentations, tmp_path, order
+):
+    """
+    Test that the native merge assigns the same image and annotation ids as
+    COCO_Assistant.merge, with empty [[]] segmentations normalized to [], and the same
+    category to every annotation. New category ids differ: they follow the largest id
+    in use instead of the number of categories.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - order: which dataset comes first in the merge.
+    """
+    sources = dict(zip(order, (coco_data_detections, coco_data_segmentations)))
+    (tmp_path / "anns").mkdir()
+    for name, (img_dir, ann_file) in sources.items():
+        shutil.copytree(img_dir, tmp_path / "imgs" / name)
+        shutil.copy(ann_file, tmp_path / "anns" / f"{name}.json")
+
+    COCO_Assistant(str(tmp_path / "imgs"), str(tmp_path / "anns")).merge()
+    with open(tmp_path / "results/merged/annotations/merged.json") as f:
+        expected = json.load(f)
+    for ann in expected["annotations"]:
+        if ann.get("segmentation") == [[]]:
+            ann["segmentation"] = []
+
+    out_path = tmp_path / "native.json"
+    counts = merge_coco(
+        [str(tmp_path / "anns" / "a.json"), str(tmp_path / "anns" / "b.json")],
+        str(out_path),
+    )
+    with open(out_path) as f:
+        merged = json.load(f)
+
+    def by_name(coco):
+        names = {c["id"]: c["name"].lower() for c in coco["categories"]}
+        annotations = [
+            dict(ann, category_id=names[ann["category_id"]])
+            for ann in coco["annotations"]
+        ]
+        return dict(coco, annotations=annotations, categories=sorted(names.values()))
+
+    assert by_name(merged) == by_name(expected)
+    cat_ids = [c["id"] for c in merged["categories"]]
+    assert len(set(cat_ids)) == len(cat_ids)
+    assert counts["images"] == len(expected["images"])
+    assert counts["annotations"] == len(expected["annotations"])
+
+
+@pytest.mark.parametrize("compact", [True, False])
+def test_parallel_merge_is_deterministic(coco_data_segmentations, tmp_path, compact):
+    """
+    Test that merging in a process pool writes the same bytes as merging in one process,
+    whatever the number of workers.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - compact: whether the merged file is written without indentation.
+    """
+    _, ann_file = coco_data_segmentations
+    ann_paths = [ann_file] * 5
+
+    outputs = []
+    for workers in (1, 2, 3):
+        out_path = tmp_path / f"merged_{workers}.json"
+        counts = merge_coco(ann_paths, str(out_path), compact, max_workers=workers)
+        outputs.append(out_path.read_bytes())
+
+    assert outputs[0] == outputs[1] == outputs[2]
+    merged = json.loads(outputs[0])
+    assert counts["images"] == len(merged["images"]) == 50
+    assert len({img["id"] for img in merged["images"]}) == 50
+    assert len({ann["id"] for ann in merged["annotations"]}) == counts["annotations"]
+
+
+def test_merge_with_category_aliases(
+    coco_data_detections, coco_data_segmentations, tmp_path
+):
+    """
+    Test that category aliases rename categories before they are matched by name, so
+    categories of both files that share an alias end up under one id.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, seg_file = coco_data_segmentations
+    _, det_file = coco_data_detections
+    aliases = {"apple": "fruit", "Orange": "fruit", "bus": "vehicle", "car": "vehicle"}
+
+    out_path = tmp_path / "merged.json"
+    merge_coco([seg_file, det_file], str(out_path), max_workers=1, aliases=aliases)
+    with open(out_path) as f:
+        merged = json.load(f)
+    with open(seg_file) as f:
+        seg = json.load(f)
+    with open(det_file) as f:
+        det = json.load(f)
+
+    ids = {}
+    for category in merged["categories"]:
+        assert category["name"] not in ids, "category names must stay unique"
+        ids[category["name"]] = category["id"]
+    assert "apple" not in ids and "orange" not in ids and "car" not in ids
+
+    def expected_name(category):
+        lowered = {k.lower(): v for k, v in aliases.items()}
+        return lowered.get(category["name"], category["name"]).lower()
+
+    # Every annotation keeps its category, now addressed by the merged name
+    names = {c["id"]: expected_name(c) for c in seg["categories"]}
+    seg_names = [names[a["category_id"]] for a in seg["annotations"]]
+    names = {c["id"]: expected_name(c) for c in det["categories"]}
+    det_names = [names[a["category_id"]] for a in det["annotations"]]
+    assert [a["category_id"] for a in merged["annotations"]] == [
+        ids[name] for name in seg_names + det_names
+    ]
+
+
+def test_merge_with_gapped_category_ids(tmp_path):
+    """
+    Test that categories new to the merge get ids after the largest id in use, so that
+    they cannot take the id of an existing category when the ids have gaps.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    first = {
+        "images": [{"id": 1, "file_name": "a.jpg"}],
+        "annotations": [
+            {"id": 1, "image_id": 1, "category_id": 1},
+            {"id": 2, "image_id": 1, "category_id": 3},
+        ],
+        "categories": [{"id": 1, "name": "cat"}, {"id": 3, "name": "dog"}],
+    }
+    second = {
+        "images": [{"id": 1, "file_name": "b.jpg"}],
+        "annotations": [
+            {"id": 1, "image_id": 1, "category_id": 1},
+            {"id": 2, "image_id": 1, "category_id": 2},
+        ],
+        "categories": [{"id": 1, "name": "bird"}, {"id": 2, "name": "dog"}],
+    }
+    out_path = tmp_path / "merged.json"
+    merge_coco([first, second], str(out_path), max_workers=1)
+    with open(out_path) as f:
+        merged = json.load(f)
+
+    ids = {c["name"]: c["id"] for c in merged["categories"]}
+    assert ids == {"cat": 1, "dog": 3, "bird": 4}
+    names = {v: k for k, v in ids.items()}
+    assert [names[a["category_id"]] for a in merged["annotations"]] == [
+        "cat",
+        "dog",
+        "bird",
+        "dog",
+    ]
+
+
+def test_merge_onto_unsorted_ids(tmp_path):
+    """
+    Test that later files continue after the largest image and annotation ids of the
+    first file, not after its last ones, as files written by split list their images
+    in shuffled order.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    img_ids = [4, 2, 8, 9, 6]
+    first = {
+        "images": [{"id": i, "file_name": f"{i}.jpg"} for i in img_ids],
+        "annotations": [
+            {"id": 10 * i, "image_id": i, "category_id": 1} for i in img_ids
+        ],
+        "categories": [{"id": 1, "name": "leaf"}],
+    }
+    second = {
+        "images": [{"id": i, "file_name": f"new_{i}.jpg"} for i in (1, 2, 3)],
+        "annotations": [
+            {"id": i, "image_id": i, "category_id": 1} for i in (1, 2, 3)
+        ],
+        "categories": [{"id": 1, "name": "leaf"}],
+    }
+    out_path = tmp_path / "merged.json"
+    merge_coco([first, second], str(out_path), max_workers=1)
+    with open(out_path) as f:
+        merged = json.load(f)
+
+    assert [img["id"] for img in merged["images"]] == img_ids + [10, 11, 12]
+    ann_ids = [ann["id"] for ann in merged["annotations"]]
+    assert ann_ids == [40, 20, 80, 90, 60, 91, 92, 93]
+    file_names = {img["id"]: img["file_name"] for img in merged["images"]}
+    assert [file_names[a["image_id"]] for a in merged["annotations"]] == [
+        f"{i}.jpg" for i in img_ids
+    ] + [f"new_{i}.jpg" for i in (1, 2, 3)]
+
+
+def test_merge_after_collapsed_categories(tmp_path):
+    """
+    Test that categories collapsed by name or alias leave no id to reuse, and that the
+    merged categories keep their fields and names.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    first = {
+        "images": [{"id": 1, "file_name": "a.jpg"}],
+        "annotations": [
+            {"id": i, "image_id": 1, "category_id": i} for i in (1, 2, 3, 4)
+        ],
+        "categories": [
+            {"id": 1, "name": "Cat", "supercategory": "animal"},
+            {"id": 2, "name": "cat", "supercategory": "animal"},
+            {"id": 3, "name": "dog", "supercategory": "animal"},
+            {"id": 4, "name": "puppy", "supercategory": "animal"},
+        ],
+    }
+    second = {
+        "images": [{"id": 1, "file_name": "b.jpg"}],
+        "annotations": [
+            {"id": i, "image_id": 1, "category_id": i} for i in (1, 2, 3)
+        ],
+        "categories": [
+            {"id": 1, "name": "Bird", "supercategory": "animal"},
+            {"id": 2, "name": "CAT", "supercategory": "pet"},
+            {"id": 3, "name": "Puppy", "supercategory": "animal"},
+        ],
+    }
+    out_path = tmp_path / "merged.json"
+    aliases = {"puppy": "dog"}
+    merge_coco([first, second], str(out_path), max_workers=1, aliases=aliases)
+    with open(out_path) as f:
+        merged = json.load(f)
+
+    assert merged["categories"] == [
+        {"id": 1, "name": "Cat", "supercategory": "animal"},
+        {"id": 3, "name": "dog", "supercategory": "animal"},
+        {"id": 4, "name": "Bird", "supercategory": "animal"},
+    ]
+    assert [a["category_id"] for a in merged["annotations"]] == [1, 1, 3, 3, 4, 1, 3]
+
+
+def test_consolidate_images_renames_clashing_files(coco_data_segmentations, tmp_path):
+    """
+    Test that images of several samples are gathered into one folder, that identical
+    images are placed once, and that clashing but different images get hashed names
+    which the merged annotations refer to.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    img_dir, ann_file = coco_data_segmentations
+    shutil.copytree(img_dir, tmp_path / "a")
+    shutil.copytree(img_dir, tmp_path / "b")
+    names = sorted(p.name for p in (tmp_path / "b").iterdir())
+    # The second sample has a different image under the first name
+    shutil.copy(tmp_path / "b" / names[1], tmp_path / "b" / names[0])
+    (tmp_path / "out").mkdir()
+
+    renames = consolidate_images(
+        [str(tmp_path / "a"), str(tmp_path / "b")], str(tmp_path / "out")
+    )
+
+    assert renames[0] == {}
+    assert list(renames[1]) == [names[0]]
+    new_name = renames[1][names[0]]
+    assert new_name != names[0] and new_name.endswith(os.path.splitext(names[0])[1])
+    placed = sorted(p.name for p in (tmp_path / "out").iterdir())
+    assert placed == sorted(names + [new_name])
+    assert (tmp_path / "out" / new_name).read_bytes() == (
+        tmp_path / "b" / names[1]
+    ).read_bytes()
+
+    out_path = tmp_path / "merged.json"
+    merge_coco([ann_file, ann_file], str(out_path), max_workers=1, renames=renames)
+    with open(out_path) as f:
+        merged = json.load(f)
+    file_names = [img["file_name"] for img in merged["images"]]
+    half = len(file_names) // 2
+    assert names[0] in file_names[:half]
+    assert file_names[half:] == [
+        new_name if name == names[0] else name for name in file_names[:half]
+    ]
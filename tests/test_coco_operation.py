@@ -5,9 +5,12 @@ Huijo Kim (huijo@hexafarms.com)
 from typer.testing import CliRunner
 import pytest
 from cvops.coco_operation import app
+from tools.coco_merge import merge_coco
+import gzip
 import os
 import json
 import shutil
+import yaml
 from pathlib import Path
 
 runner = CliRunner()
@@ -114,6 +117,41 @@ def test_merge_command(coco_data_detections, coco_data_segmentations, tmp_path):
     ), "Expected at least one annotation in 'annotations'."
 
 
+def test_merge_compressed_annotations(
+    coco_data_detections, coco_data_segmentations, tmp_path
+):
+    """
+    Test that 'merge' picks up gzip-compressed annotation files next to plain ones.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    img_dir1, ann_file1 = coco_data_detections
+    img_dir2, ann_file2 = coco_data_segmentations
+    shutil.copytree(img_dir1, tmp_path / "images" / "part1")
+    shutil.copytree(img_dir2, tmp_path / "images" / "part2")
+    (tmp_path / "annotations").mkdir()
+    shutil.copy(ann_file1, tmp_path / "annotations" / "part1.json")
+    with open(ann_file2, "rb") as src:
+        with gzip.open(tmp_path / "annotations" / "part2.json.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    result = runner.invoke(
+        app, ["merge", str(tmp_path / "images"), str(tmp_path / "annotations")]
+    )
+    assert result.exit_code == 0, result.output
+
+    with open(tmp_path / "results/merged/annotations/merged.json") as f:
+        merged = json.load(f)
+    n_images = 0
+    for ann_file in (ann_file1, ann_file2):
+        with open(ann_file) as f:
+            n_images += len(json.load(f)["images"])
+    assert len(merged["images"]) == n_images
+
+
 def test_split_command_basic(coco_data_detections, tmp_path):
     """
     Test the 'split' CLI command's basic functionality to ensure it successfully splits a COCO dataset.
@@ -157,3 +195,400 @@ def test_split_with_image_location(coco_data_detections, tmp_path):
     assert result.exit_code == 0
     assert tmp_path.joinpath("images/new_train_images").exists()
     assert tmp_path.joinpath("images/new_val_images").exists()
+
+
+def test_split_partitions_annotations(coco_data_segmentations, tmp_path):
+    """
+    Test that 'split' assigns every annotated image to exactly one side and keeps each
+    annotation with its image.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    train_ann_path = tmp_path / "train.json"
+    test_ann_path = tmp_path / "test.json"
+    result = runner.invoke(
+        app, ["split", ann_file, str(train_ann_path), str(test_ann_path), "0.6"]
+    )
+    assert result.exit_code == 0
+
+    with open(ann_file) as f:
+        source = json.load(f)
+    with open(train_ann_path) as f:
+        train = json.load(f)
+    with open(test_ann_path) as f:
+        test = json.load(f)
+
+    train_ids = {img["id"] for img in train["images"]}
+    test_ids = {img["id"] for img in test["images"]}
+    assert not train_ids & test_ids
+    assert train_ids | test_ids == {ann["image_id"] for ann in source["annotations"]}
+    assert all(ann["image_id"] in train_ids for ann in train["annotations"])
+    assert all(ann["image_id"] in test_ids for ann in test["annotations"])
+    assert len(train["annotations"]) + len(test["annotations"]) == len(
+        source["annotations"]
+    )
+
+
+def test_shard_delete_unshard(coco_data_segmentations, tmp_path):
+    """
+    Test that 'delete' on a shard directory gives the same dataset as on the COCO file,
+    and that 'unshard' reassembles the shards into standard COCO.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    ann_copy = tmp_path / "annotations.json"
+    shutil.copy(ann_file, ann_copy)
+    shard_dir = tmp_path / "annotations.shards"
+    config = tmp_path / "config.yaml"
+    config.write_text("delete:\n  - person\n  - cup\n")
+
+    result = runner.invoke(
+        app, ["shard", str(ann_copy), str(shard_dir), "--num-shards", "3"]
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["unshard", str(shard_dir), str(tmp_path / "u.json")])
+    assert result.exit_code == 0
+
+    result = runner.invoke(app, ["delete", str(config), str(ann_copy)])
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["delete", str(config), str(shard_dir)])
+    assert result.exit_code == 0
+    result = runner.invoke(
+        app,
+        ["unshard", str(tmp_path / "annotations_delete.shards"), str(tmp_path / "d.json")],
+    )
+    assert result.exit_code == 0
+
+    def normalized(path):
+        with open(path) as f:
+            dataset = json.load(f)
+        for section in ("images", "annotations"):
+            dataset[section] = sorted(dataset[section], key=lambda r: r["id"])
+        return dataset
+
+    assert normalized(tmp_path / "u.json") == normalized(ann_file)
+    assert normalized(tmp_path / "d.json") == normalized(
+        tmp_path / "annotations_delete.json"
+    )
+
+
+def test_update_onto_split_output(
+    coco_data_detections, coco_data_segmentations, tmp_path, monkeypatch
+):
+    """
+    Test 'update' onto the train and val files written by 'split', whose images are in
+    shuffled order: the merged ids stay unique and every annotation stays on its image.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - monkeypatch: fixture - Used to run the commands inside tmp_path.
+    """
+    new_img_dir, new_ann_file = map(os.path.abspath, coco_data_segmentations)
+    _, existing_ann_file = map(os.path.abspath, coco_data_detections)
+    train_path, val_path = tmp_path / "train.json", tmp_path / "val.json"
+    monkeypatch.chdir(tmp_path)
+    result = runner.invoke(
+        app,
+        ["split", existing_ann_file, str(train_path), str(val_path), "0.5"]
+        + ["--seed", "1"],
+    )
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        app,
+        ["update", new_ann_file, str(train_path), str(val_path), "0.5", new_img_dir]
+        + ["--seed", "1"],
+    )
+    assert result.exit_code == 0, result.output
+
+    def annotation_keys(coco):
+        file_names = {img["id"]: img["file_name"] for img in coco["images"]}
+        return sorted(
+            (file_names[ann["image_id"]], json.dumps(ann.get("bbox")))
+            for ann in coco["annotations"]
+        )
+
+    (results_dir,) = (tmp_path / "results").iterdir()
+    expected, merged_keys = [], []
+    for ann_file in (existing_ann_file, new_ann_file):
+        with open(ann_file) as f:
+            expected += annotation_keys(json.load(f))
+    for side in ("train", "val"):
+        with open(results_dir / side / "results/merged/annotations/merged.json") as f:
+            merged = json.load(f)
+        img_ids = [img["id"] for img in merged["images"]]
+        ann_ids = [ann["id"] for ann in merged["annotations"]]
+        assert len(set(img_ids)) == len(img_ids)
+        assert len(set(ann_ids)) == len(ann_ids)
+        merged_keys += annotation_keys(merged)
+    assert sorted(merged_keys) == sorted(expected)
+
+
+def test_update_then_postupdate(
+    coco_data_detections, coco_data_segmentations, tmp_path, monkeypatch
+):
+    """
+    Test the 'update' CLI command end to end: the new batch is split between train and
+    val, appended to the existing files with fresh ids, and the result is laid out the
+    way 'postupdate' expects.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - monkeypatch: fixture - Used to run the commands inside tmp_path.
+    """
+    new_img_dir, new_ann_file = map(os.path.abspath, coco_data_segmentations)
+    existing_img_dir, existing_ann_file = map(os.path.abspath, coco_data_detections)
+    existing = tmp_path / "existing"
+    shutil.copytree(existing_img_dir, existing / "train_images")
+    shutil.copytree(existing_img_dir, existing / "val_images")
+    shutil.copy(existing_ann_file, existing / "train.json")
+    shutil.copy(existing_ann_file, existing / "val.json")
+    monkeypatch.chdir(tmp_path)
+
+    result = runner.invoke(
+        app,
+        [
+            "update",
+            new_ann_file,
+            str(existing / "train.json"),
+            str(existing / "val.json"),
+            "0.8",
+            new_img_dir,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    (results_dir,) = (tmp_path / "results").iterdir()
+    with open(tmp_path / "latest_update_configs.yaml") as f:
+        config = yaml.safe_load(f)
+    assert config["outcome_path"] == str(results_dir)
+    for side in ("train", "val"):
+        assert os.path.isfile(config[f"outcome_{side}_ann"])
+    with open(existing_ann_file) as f:
+        existing_data = json.load(f)
+    with open(new_ann_file) as f:
+        new_data = json.load(f)
+    merged = {}
+    for side in ("train", "val"):
+        with open(results_dir / side / "results/merged/annotations/merged.json") as f:
+            merged[side] = json.load(f)
+        images = merged[side]["images"]
+        assert len({img["id"] for img in images}) == len(images)
+        assert images[: len(existing_data["images"])] == existing_data["images"]
+        new_images_dir = results_dir / side / "images" / f"new_{side}_images"
+        placed = sorted(p.name for p in new_images_dir.iterdir())
+        assert placed == sorted(
+            img["file_name"] for img in images[len(existing_data["images"]) :]
+        )
+
+    n_new = sum(
+        len(m["images"]) - len(existing_data["images"]) for m in merged.values()
+    )
+    n_new_anns = sum(
+        len(m["annotations"]) - len(existing_data["annotations"])
+        for m in merged.values()
+    )
+    assert n_new == len({a["image_id"] for a in new_data["annotations"]})
+    assert n_new_anns == len(new_data["annotations"])
+
+    result = runner.invoke(
+        app,
+        [
+            "postupdate",
+            "--existing-samples-dir",
+            str(existing),
+            "--results-path",
+            str(results_dir),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+
+def test_separate_by_name(coco_data_segmentations, tmp_path):
+    """
+    Test that 'separate_by_name' routes every image and its annotations to the one key
+    found in its file name, with substring, regex and glob keys.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    img_dir, ann_file = coco_data_segmentations
+    shutil.copytree(img_dir, tmp_path / "images")
+    shutil.copy(ann_file, tmp_path / "annotations.json")
+    keys = ["early=re:^0000000[0-2]", "mid=glob:00000005*", "00000006", "0000007"]
+
+    img_path, ann_path = str(tmp_path / "images"), str(tmp_path / "annotations.json")
+    result = runner.invoke(app, ["separate-by-name", img_path, ann_path] + keys)
+    assert result.exit_code == 0, result.output
+
+    with open(ann_file) as f:
+        source = json.load(f)
+    n_images = n_annotations = 0
+    for name in ("early", "mid", "00000006", "0000007"):
+        with open(tmp_path / f"{name}.json") as f:
+            separated = json.load(f)
+        ids = {img["id"] for img in separated["images"]}
+        assert ids and all(ann["image_id"] in ids for ann in separated["annotations"])
+        placed = sorted(p.name for p in (tmp_path / name).iterdir())
+        assert placed == sorted(img["file_name"] for img in separated["images"])
+        n_images += len(ids)
+        n_annotations += len(separated["annotations"])
+    assert n_images == len(source["images"])
+    assert n_annotations == len(source["annotations"])
+
+
+def test_split_by_group(coco_data_segmentations, tmp_path):
+    """
+    Test that 'split --group-by' never puts images of one group on both sides and that
+    a seed gives the same split on every run.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    splits = []
+    for run in range(2):
+        train_ann_path = tmp_path / f"train_{run}.json"
+        test_ann_path = tmp_path / f"test_{run}.json"
+        result = runner.invoke(
+            app,
+            ["split", ann_file, str(train_ann_path), str(test_ann_path), "0.6"]
+            + ["--group-by", r"^0+(\d)", "--seed", "7"],
+        )
+        assert result.exit_code == 0, result.output
+        with open(train_ann_path) as f:
+            train = json.load(f)
+        with open(test_ann_path) as f:
+            test = json.load(f)
+        splits.append((train["images"], test["images"]))
+
+    train_images, test_images = splits[0]
+    assert splits[1] == splits[0]
+    group = lambda img: img["file_name"].lstrip("0")[0]
+    assert not {group(img) for img in train_images} & {
+        group(img) for img in test_images
+    }
+
+
+def test_split_stratified(coco_data_segmentations, tmp_path):
+    """
+    Test that 'split --stratify' partitions the annotations and reports the train and
+    val counts of every category.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    train_ann_path = tmp_path / "train.json"
+    test_ann_path = tmp_path / "test.json"
+    result = runner.invoke(
+        app,
+        ["split", ann_file, str(train_ann_path), str(test_ann_path), "0.6"]
+        + ["--stratify", "--seed", "0"],
+    )
+    assert result.exit_code == 0, result.output
+
+    with open(ann_file) as f:
+        source = json.load(f)
+    with open(train_ann_path) as f:
+        train = json.load(f)
+    with open(test_ann_path) as f:
+        test = json.load(f)
+    assert len(train["annotations"]) + len(test["annotations"]) == len(
+        source["annotations"]
+    )
+    used = {ann["category_id"] for ann in source["annotations"]}
+    for category in source["categories"]:
+        if category["id"] in used:
+            assert f"{category['name']}: " in result.output
+
+
+def test_split_by_hash_keeps_sides(
+    coco_data_detections, coco_data_segmentations, tmp_path
+):
+    """
+    Test that 'split --hash' puts every image on the same side when it is split again
+    as part of a larger dataset, and keeps every annotation with its image.
+
+    Args:
+    - coco_data_detections: fixture - Paths for the detection dataset's images and annotation.
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, det_file = coco_data_detections
+    _, seg_file = coco_data_segmentations
+    merged_file = tmp_path / "merged.json"
+    merge_coco([seg_file, det_file], str(merged_file), max_workers=1)
+
+    sides = []
+    for run, ann_file in enumerate((seg_file, str(merged_file))):
+        train_ann_path = tmp_path / f"train_{run}.json"
+        test_ann_path = tmp_path / f"test_{run}.json"
+        result = runner.invoke(
+            app,
+            ["split", ann_file, str(train_ann_path), str(test_ann_path), "0.5"]
+            + ["--hash"],
+        )
+        assert result.exit_code == 0, result.output
+        side = {}
+        for name, path in (("train", train_ann_path), ("test", test_ann_path)):
+            with open(path) as f:
+                data = json.load(f)
+            ids = {img["id"] for img in data["images"]}
+            assert all(ann["image_id"] in ids for ann in data["annotations"])
+            names = [img["file_name"] for img in data["images"]]
+            side.update(dict.fromkeys(names, name))
+        sides.append(side)
+
+    assert set(sides[0].values()) == {"train", "test"}
+    assert all(sides[1][name] == side for name, side in sides[0].items())
+
+
+def test_kfold(coco_data_segmentations, tmp_path):
+    """
+    Test that 'kfold' writes a train and val file for every fold, with every annotated
+    image in exactly one val file, and places the images of every fold.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    img_dir, ann_file = coco_data_segmentations
+    result = runner.invoke(
+        app,
+        ["kfold", ann_file, str(tmp_path), "3", img_dir]
+        + ["--stratify", "--seed", "0"],
+    )
+    assert result.exit_code == 0, result.output
+
+    with open(ann_file) as f:
+        source = json.load(f)
+    annotated = {ann["image_id"] for ann in source["annotations"]}
+    val_names = []
+    for fold in range(3):
+        fold_dir = tmp_path / f"fold_{fold}"
+        splits = {}
+        for name in ("train", "val"):
+            with open(fold_dir / f"{name}.json") as f:
+                splits[name] = json.load(f)
+            names = [img["file_name"] for img in splits[name]["images"]]
+            assert sorted(names) == sorted(os.listdir(fold_dir / f"{name}_images"))
+        ids = [{img["id"] for img in s["images"]} for s in splits.values()]
+        assert not ids[0] & ids[1] and ids[0] | ids[1] == annotated
+        assert sum(len(s["annotations"]) for s in splits.values()) == len(
+            source["annotations"]
+        )
+        val_names += [img["file_name"] for img in splits["val"]["images"]]
+    assert len(val_names) == len(set(val_names)) == len(annotated)
@@ -0,0 +1,203 @@
+import gzip
+import json
+
+import pytest
+
+from tools.coco_stream import (
+    ITEM,
+    iter_events,
+    iter_records,
+    read_header,
+    read_sections,
+    transform_coco,
+)
+from tools.coco_index import CocoIndex
+from tools.helpers import save_coco
+
+
+@pytest.fixture
+def coco_data_segmentations():
+    return "data/segmentations_2/images", "data/segmentations_2/annotations.json"
+
+
+@pytest.mark.parametrize("chunk_size", [7, 4096])
+def test_events_rebuild_the_dataset(coco_data_segmentations, chunk_size):
+    """
+    Test that the streaming reader yields exactly the records json.load sees, even when
+    records and numbers are cut at chunk borders.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - chunk_size: size of the text chunks read from the file.
+    """
+    _, ann_file = coco_data_segmentations
+    with open(ann_file) as f:
+        expected = json.load(f)
+
+    rebuilt = {}
+    for section, event, value in iter_events(ann_file, chunk_size):
+        if event == ITEM:
+            rebuilt.setdefault(section, []).append(value)
+        elif event == "value":
+            rebuilt[section] = value
+    assert rebuilt == expected
+
+    assert list(iter_records(ann_file, "images")) == expected["images"]
+    assert read_header(ann_file)["categories"] == expected["categories"]
+
+
+def test_transform_drops_and_rewrites_records(coco_data_segmentations, tmp_path):
+    """
+    Test that transform_coco applies section handlers and drops records mapped to None.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    out_file = tmp_path / "out.json"
+
+    def rename(img):
+        img["file_name"] = img["file_name"].replace(".jpg", ".png")
+        return img
+
+    transform_coco(
+        ann_file,
+        str(out_file),
+        {
+            "images": rename,
+            "annotations": lambda a: a if a["category_id"] != 0 else None,
+        },
+    )
+
+    with open(ann_file) as f:
+        source = json.load(f)
+    with open(out_file) as f:
+        result = json.load(f)
+
+    assert list(result.keys()) == list(source.keys())
+    assert all(img["file_name"].endswith(".png") for img in result["images"])
+    assert result["annotations"] == [
+        a for a in source["annotations"] if a["category_id"] != 0
+    ]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_save_coco_streams_generators(coco_data_segmentations, tmp_path, compact):
+    """
+    Test that save_coco writes generator input, byte-identical to json.dump in the default
+    mode and as equivalent compact JSON otherwise.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - compact: whether to write without indentation and key sorting.
+    """
+    _, ann_file = coco_data_segmentations
+    with open(ann_file) as f:
+        source = json.load(f)
+
+    out_file = tmp_path / "saved.json"
+    save_coco(
+        str(out_file),
+        source["info"],
+        source["licenses"],
+        iter(source["images"]),
+        (ann for ann in source["annotations"]),
+        source["categories"],
+        compact=compact,
+    )
+
+    expected = {
+        key: source[key]
+        for key in ("info", "licenses", "images", "annotations", "categories")
+    }
+    text = out_file.read_text()
+    assert json.loads(text) == expected
+    if compact:
+        assert "\n" not in text
+    else:
+        assert text == json.dumps(expected, indent=2, sort_keys=True)
+
+
+def test_compressed_files_roundtrip(coco_data_segmentations, tmp_path):
+    """
+    Test that gzip compressed annotation files are read and written transparently by the
+    streaming reader, transform_coco, save_coco and CocoIndex.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    with open(ann_file) as f:
+        source = json.load(f)
+
+    gz_file = tmp_path / "annotations.json.gz"
+    save_coco(str(gz_file), **source)
+    with gzip.open(gz_file, "rt") as f:
+        assert json.load(f) == source
+
+    out_file = tmp_path / "out.json.gz"
+    transform_coco(str(gz_file), str(out_file), compact=True)
+    with gzip.open(out_file, "rt") as f:
+        assert json.load(f) == source
+    assert list(iter_records(str(out_file), "images")) == source["images"]
+
+    index = CocoIndex.from_file(str(out_file))
+    assert index.file_names == [img["file_name"] for img in source["images"]]
+    assert index.annotations == source["annotations"]
+
+
+@pytest.mark.parametrize("chunk_size", [7, 4096])
+def test_field_passthrough(coco_data_segmentations, tmp_path, chunk_size):
+    """
+    Test that declaring the fields a command needs gives the same content as decoding every
+    record, while untouched records are copied verbatim.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - chunk_size: number of characters read at a time, small values split records.
+    """
+    _, ann_file = coco_data_segmentations
+    with open(ann_file) as f:
+        source = json.load(f)
+
+    header = read_sections(
+        ann_file, ("images", "categories"), fields={"images": ("id", "file_name")}
+    )
+    assert header["categories"] == source["categories"]
+    assert header["images"] == [
+        {"id": img["id"], "file_name": img["file_name"]} for img in source["images"]
+    ]
+    assert list(iter_records(ann_file, "annotations", fields=("image_id",))) == [
+        {"image_id": a["image_id"]} for a in source["annotations"]
+    ]
+
+    def remap(annotation):
+        if annotation["category_id"] == 0:
+            return None
+        annotation["category_id"] += 100
+        annotation["checked"] = True
+        return annotation
+
+    out_file = tmp_path / "out.json"
+    transform_coco(
+        ann_file,
+        str(out_file),
+        {"annotations": remap},
+        chunk_size=chunk_size,
+        fields={"annotations": ("category_id",)},
+    )
+    with open(out_file) as f:
+        result = json.load(f)
+
+    expected = [
+        dict(a, category_id=a["category_id"] + 100, checked=True)
+        for a in source["annotations"]
+        if a["category_id"] != 0
+    ]
+    assert result["annotations"] == expected
+    assert result["images"] == source["images"]
+    assert list(result.keys()) == list(source.keys())
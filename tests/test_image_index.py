@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+
+from tools.image_index import CONFLICTING, DUPLICATE, NEW, ImageIndex, cache_path
+
+
+@pytest.fixture
+def coco_data_segmentations():
+    return "data/segmentations_2/images", "data/segmentations_2/annotations.json"
+
+
+def test_classify_new_duplicate_and_conflicting_images(
+    coco_data_segmentations, tmp_path
+):
+    """
+    Test that incoming images are classified by name and content against the existing
+    splits, and that the digests of the existing images are cached and reused.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    img_dir, _ = coco_data_segmentations
+    names = sorted(os.listdir(img_dir))
+    train_dir, val_dir, new_dir = (tmp_path / d for d in ("train", "val", "new"))
+    for directory in (train_dir, val_dir, new_dir):
+        directory.mkdir()
+    for name in names[:4]:
+        shutil.copy(os.path.join(img_dir, name), train_dir / name)
+    shutil.copy(os.path.join(img_dir, names[4]), val_dir / names[4])
+
+    # Same name and content, renamed copy, same name with other content, new
+    shutil.copy(os.path.join(img_dir, names[0]), new_dir / names[0])
+    shutil.copy(os.path.join(img_dir, names[4]), new_dir / f"renamed_{names[4]}")
+    shutil.copy(os.path.join(img_dir, names[5]), new_dir / names[1])
+    shutil.copy(os.path.join(img_dir, names[6]), new_dir / names[6])
+    new_names = [names[0], f"renamed_{names[4]}", names[1], names[6]]
+
+    index = ImageIndex()
+    index.add("train", names[:4], str(train_dir))
+    index.add("val", names[4:5], str(val_dir))
+    matches = index.classify(new_names, str(new_dir))
+
+    assert [m.status for m in matches] == [DUPLICATE, DUPLICATE, CONFLICTING, NEW]
+    assert matches[0][1:] == ("train", names[0])
+    assert matches[1][1:] == ("val", names[4])
+    assert matches[2][1:] == ("train", names[1])
+    assert os.path.isfile(cache_path(str(train_dir)))
+
+    # Cached digests are trusted while size and mtime match
+    mtime = os.path.getmtime(cache_path(str(train_dir)))
+    index = ImageIndex()
+    index.add("train", names[:4], str(train_dir))
+    assert os.path.getmtime(cache_path(str(train_dir))) == mtime
+
+    # Without image folders, names alone are matched
+    index = ImageIndex()
+    index.add("train", names[:4])
+    statuses = [m.status for m in index.classify(new_names)]
+    assert statuses == [DUPLICATE, NEW, DUPLICATE, NEW]
@@ -0,0 +1,42 @@
+import pytest
+
+from tools.name_keys import NameMatcher
+
+
+def test_matcher_finds_every_key_in_one_pass():
+    """
+    Test that substring keys are all found, including keys that are prefixes or parts
+    of other keys, next to named regex and glob keys.
+    """
+    keys = ["cam1", "cam10", "am1", "row=re:_r\\d{2}_", "png=glob:*.png"]
+    file_names = ["cam1_r01_a.jpg", "cam10_b.png", "cam2_r3_c.jpg", "xcam10cam1.jpg"]
+
+    img_pos, key_pos = NameMatcher(keys).match(file_names)
+
+    found = {(file_names[i], keys[k].split("=")[0]) for i, k in zip(img_pos, key_pos)}
+    assert found == {
+        ("cam1_r01_a.jpg", "cam1"),
+        ("cam1_r01_a.jpg", "am1"),
+        ("cam1_r01_a.jpg", "row"),
+        ("cam10_b.png", "cam1"),
+        ("cam10_b.png", "cam10"),
+        ("cam10_b.png", "am1"),
+        ("cam10_b.png", "png"),
+        ("xcam10cam1.jpg", "cam1"),
+        ("xcam10cam1.jpg", "cam10"),
+        ("xcam10cam1.jpg", "am1"),
+    }
+    assert len(found) == len(img_pos)
+    assert list(key_pos) == sorted(key_pos)
+
+
+@pytest.mark.parametrize("key", ["re:^cam", "=glob:*.png", "cam1\ncam2", ""])
+def test_matcher_rejects_invalid_keys(key):
+    """
+    Test that regex and glob keys without a name and empty keys are refused.
+
+    Args:
+    - key: the invalid name key.
+    """
+    with pytest.raises(ValueError):
+        NameMatcher([key])
@@ -0,0 +1,44 @@
+import numpy as np
+
+from tools.relational import anti_join, key_array, semi_join
+
+IMAGES = [{"id": 3}, {"id": 1}, {"id": 7}, {"id": 1}]
+ANNOTATIONS = [
+    {"id": 10, "image_id": 7},
+    {"id": 11, "image_id": 1},
+    {"id": 12, "image_id": 9},
+    {"id": 13, "image_id": 7},
+]
+
+
+def test_semi_and_anti_join_partition_records():
+    """
+    Test that semi_join keeps and anti_join drops the records whose key is in the ids,
+    both in their original order, with ids given as a list, an array or records.
+    """
+    for ids in ([7, 1], np.array([1, 7]), [{"id": 1}, {"id": 7}]):
+        kept = semi_join(ANNOTATIONS, "image_id", ids)
+        dropped = anti_join(ANNOTATIONS, "image_id", ids)
+        assert [a["id"] for a in kept] == [10, 11, 13]
+        assert [a["id"] for a in dropped] == [12]
+
+    # Duplicated records all match
+    assert semi_join(IMAGES, "id", [1]) == [{"id": 1}, {"id": 1}]
+    assert anti_join(IMAGES, "id", [1]) == [{"id": 3}, {"id": 7}]
+
+
+def test_joins_with_empty_inputs_and_missing_ids():
+    """
+    Test that ids matching no record, and empty records or ids, give empty or complete
+    results instead of errors.
+    """
+    assert semi_join(ANNOTATIONS, "image_id", [4, 5]) == []
+    assert anti_join(ANNOTATIONS, "image_id", [4, 5]) == ANNOTATIONS
+    assert semi_join(ANNOTATIONS, "image_id", [9, 100])[0]["id"] == 12
+
+    for ids in ([], np.zeros(0, dtype=np.int64)):
+        assert semi_join(IMAGES, "id", ids) == []
+        assert anti_join(IMAGES, "id", ids) == IMAGES
+    assert semi_join([], "id", [1, 2]) == []
+    assert anti_join([], "id", [1, 2]) == []
+    assert key_array([]).dtype == np.int64 and len(key_array([])) == 0
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from tools import serialization
+
+
+@pytest.fixture
+def coco_data_segmentations():
+    return "data/segmentations_2/images", "data/segmentations_2/annotations.json"
+
+
+def test_backend_roundtrip(coco_data_segmentations, tmp_path):
+    """
+    Test that the selected JSON backend parses like the standard library, keeps indented output
+    byte-identical to json.dumps and writes compact output with the same content.
+
+    Args:
+    - coco_data_segmentations: fixture - Paths for the segmentation dataset's images and annotations.
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    _, ann_file = coco_data_segmentations
+    with open(ann_file, "rt", encoding="UTF-8") as f:
+        expected = json.load(f)
+
+    dataset = serialization.load(ann_file)
+    assert dataset == expected
+    assert serialization.dumps(dataset, indent=4, sort_keys=True) == json.dumps(
+        expected, indent=4, sort_keys=True
+    )
+
+    out_file = tmp_path / "compact.json"
+    serialization.dump(dataset, str(out_file), compact=True)
+    text = out_file.read_text(encoding="UTF-8")
+    assert "\n" not in text
+    assert json.loads(text) == expected
+
+    with pytest.raises(serialization.JSONDecodeError):
+        serialization.loads('{"images": [}')
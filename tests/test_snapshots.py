@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from tools.snapshots import SnapshotStore
+
+
+def test_snapshot_checkout_and_gc(tmp_path):
+    """
+    Test that two snapshots sharing most images store every distinct file once, that a
+    checkout restores a snapshot exactly, and that gc only deletes objects no remaining
+    snapshot refers to.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    store = SnapshotStore(str(tmp_path / "store"))
+    first, second = tmp_path / "run1", tmp_path / "run2"
+    for run in (first, second):
+        (run / "train_images").mkdir(parents=True)
+        for i in range(5):
+            (run / "train_images" / f"{i}.jpg").write_bytes(b"image %d" % i)
+    (first / "train.json").write_text('{"images": []}')
+    (second / "train.json").write_text('{"images": [1]}')
+    (second / "train_images" / "5.jpg").write_bytes(b"new image")
+
+    store.snapshot(str(first), "run1")
+    result = store.snapshot(str(second), "run2")
+    assert result["new_objects"] == 2
+    assert len(result["files"]) == 7
+    # The recorded files now share the stored objects
+    assert os.path.samefile(
+        first / "train_images" / "0.jpg", second / "train_images" / "0.jpg"
+    )
+    assert store.snapshots() == ["run1", "run2"]
+    with pytest.raises(FileExistsError):
+        store.snapshot(str(second), "run2")
+
+    store.checkout("run1", str(tmp_path / "out"), placement="copy")
+    restored = sorted(
+        os.path.relpath(os.path.join(d, f), tmp_path / "out")
+        for d, _, files in os.walk(tmp_path / "out")
+        for f in files
+    )
+    assert restored == ["train.json"] + [f"train_images/{i}.jpg" for i in range(5)]
+    assert (tmp_path / "out" / "train_images" / "3.jpg").read_bytes() == b"image 3"
+
+    assert store.gc() == (0, 0)
+    store.remove("run2")
+    removed, freed = store.gc()
+    assert removed == 2 and freed == len(b"new image") + len('{"images": [1]}')
+    assert (first / "train_images" / "4.jpg").read_bytes() == b"image 4"
+    store.checkout("run1", str(tmp_path / "out2"), placement="symlink")
+    assert (tmp_path / "out2" / "train.json").read_text() == '{"images": []}'
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+from tools.splits import (
+    TRAIN,
+    VAL,
+    count_matrix,
+    fold_split,
+    group_keys,
+    group_split,
+    hash_split,
+    stratified_folds,
+    stratified_split,
+)
+
+
+@pytest.fixture
+def camera_images():
+    rng = np.random.default_rng(0)
+    cameras = rng.integers(0, 40, size=2000)
+    return [
+        {"id": i, "file_name": f"cam{c:02d}_{i:05d}.jpg", "row": int(c) % 7}
+        for i, c in enumerate(cameras)
+    ]
+
+
+def test_group_split_keeps_groups_together(camera_images):
+    """
+    Test that no group lands on both sides, that train gets close to the requested
+    share of images, and that a seed makes the split reproducible.
+
+    Args:
+    - camera_images: fixture - Image records of 40 cameras, with a row field.
+    """
+    keys = group_keys(camera_images, r"^(cam\d+)_")
+    assert keys[0] == camera_images[0]["file_name"][:5]
+
+    in_train = group_split(keys, 0.8, seed=3)
+    train_groups = {k for k, t in zip(keys, in_train) if t}
+    val_groups = {k for k, t in zip(keys, in_train) if not t}
+    assert not train_groups & val_groups
+    assert abs(in_train.mean() - 0.8) < 0.05
+    assert (group_split(keys, 0.8, seed=3) == in_train).all()
+
+    rows = group_keys(camera_images, "field:row")
+    in_train = group_split(rows, 0.5, seed=1)
+    assert not {r for r, t in zip(rows, in_train) if t} & {
+        r for r, t in zip(rows, in_train) if not t
+    }
+
+
+def test_group_split_respects_pinned_groups(camera_images):
+    """
+    Test that groups pinned to a side stay there whatever the seed, as groups already
+    in the existing train and val splits do during an update.
+
+    Args:
+    - camera_images: fixture - Image records of 40 cameras, with a row field.
+    """
+    keys = group_keys(camera_images, r"^(cam\d+)_")
+    pinned = {"cam00": VAL, "cam01": TRAIN, "cam99": VAL}
+    for seed in range(5):
+        in_train = group_split(keys, 0.5, seed=seed, pinned=pinned)
+        keys_array = np.array(keys)
+        assert not in_train[keys_array == "cam00"].any()
+        assert in_train[keys_array == "cam01"].all()
+
+
+def test_stratified_split_balances_rare_categories(camera_images):
+    """
+    Test that the stratified split puts close to the requested share of every category,
+    rare ones included, in train, and keeps groups whole when keys are given.
+
+    Args:
+    - camera_images: fixture - Image records of 40 cameras, with a row field.
+    """
+    rng = np.random.default_rng(1)
+    img_ids = np.array([img["id"] for img in camera_images])
+    # Category 1 is common, category 9 is on ten images only
+    ann_img_ids = np.concatenate([rng.choice(img_ids, 5000), img_ids[::200]])
+    ann_cat_ids = np.concatenate([rng.integers(1, 9, 5000), np.full(10, 9)])
+
+    counts, cat_ids = count_matrix(img_ids, ann_img_ids, ann_cat_ids)
+    assert counts.shape == (len(img_ids), 9) and cat_ids.tolist() == list(range(1, 10))
+    assert counts.sum() == len(ann_img_ids)
+
+    for seed in range(3):
+        in_train = stratified_split(counts, 0.7, seed=seed)
+        train = np.asarray(counts[in_train].sum(axis=0)).ravel()
+        total = np.asarray(counts.sum(axis=0)).ravel()
+        assert np.abs(train / total - 0.7).max() < 0.05
+        assert train[-1] == 7
+
+    keys = group_keys(camera_images, r"^(cam\d+)_")
+    in_train = stratified_split(counts, 0.7, seed=0, keys=keys)
+    train_groups = {k for k, t in zip(keys, in_train) if t}
+    assert not train_groups & {k for k, t in zip(keys, in_train) if not t}
+
+
+def test_hash_split_is_stable(camera_images):
+    """
+    Test that the hashed split gives every key the same side whatever the other keys,
+    changes with the seed, and puts about the requested share in train.
+
+    Args:
+    - camera_images: fixture - Image records of 40 cameras, with a row field.
+    """
+    names = [img["file_name"] for img in camera_images]
+    in_train = hash_split(names, 0.8)
+    assert abs(in_train.mean() - 0.8) < 0.05
+    assert (hash_split(names[::-1], 0.8)[::-1] == in_train).all()
+    assert (hash_split(names[:100], 0.8) == in_train[:100]).all()
+    assert (hash_split(names, 0.8, seed=1) != in_train).any()
+
+
+def test_folds_are_balanced(camera_images):
+    """
+    Test that every image gets one fold, that folds are of similar size, that groups
+    stay in one fold, and that stratified folds share every category.
+
+    Args:
+    - camera_images: fixture - Image records of 40 cameras, with a row field.
+    """
+    fold = fold_split(len(camera_images), 5, seed=0)
+    assert np.bincount(fold).tolist() == [400] * 5
+
+    keys = group_keys(camera_images, r"^(cam\d+)_")
+    fold = fold_split(len(keys), 5, seed=0, keys=keys)
+    assert all(len({f for k, f in zip(keys, fold) if k == key}) == 1 for key in keys)
+    assert (np.abs(np.bincount(fold, minlength=5) - 400) < 120).all()
+    with pytest.raises(ValueError, match="got no group"):
+        fold_split(len(keys), 5, keys=["cam00"] * len(keys))
+
+    rng = np.random.default_rng(0)
+    img_ids = np.arange(len(camera_images))
+    ann_img_ids = rng.integers(0, len(img_ids), size=5000)
+    ann_cat_ids = np.where(rng.random(5000) < 0.01, 99, rng.integers(0, 4, 5000))
+    counts, cat_ids = count_matrix(img_ids, ann_img_ids, ann_cat_ids)
+    fold = stratified_folds(counts, 5, seed=0)
+    rare = np.asarray(counts[:, cat_ids == 99].sum(axis=1)).ravel() > 0
+    per_fold = np.bincount(fold[rare], minlength=5)
+    assert per_fold.max() - per_fold.min() <= 1
+    assert (np.abs(np.bincount(fold) - 400) <= 2).all()
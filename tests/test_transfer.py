@@ -0,0 +1,116 @@
+import os
+import shutil
+
+import pytest
+
+from tools.transfer import copy_file, transfer
+
+
+def test_transfer_copies_skips_and_reports(tmp_path):
+    """
+    Test that transfer copies every pair into new folders, keeps existing destinations
+    when asked to, and reports missing sources without stopping the other copies.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    for i in range(600):
+        (src_dir / f"{i}.jpg").write_bytes(os.urandom(i))
+
+    pairs = [
+        (str(src_dir / f"{i}.jpg"), str(tmp_path / "dst" / f"{i}.jpg"))
+        for i in range(600)
+    ]
+    stats = transfer(pairs, max_workers=4)
+    assert stats.files == 600 and not stats.failed
+    assert stats.bytes == sum(range(600))
+    for src, dst in pairs:
+        assert open(src, "rb").read() == open(dst, "rb").read()
+
+    (tmp_path / "dst" / "0.jpg").write_bytes(b"kept")
+    pairs.append((str(src_dir / "missing.jpg"), str(tmp_path / "dst" / "missing.jpg")))
+    stats = transfer(pairs[:1] + pairs[-1:], skip_existing=True, missing_ok=True)
+    assert (stats.files, stats.skipped, stats.missing) == (0, 1, 1)
+    assert (tmp_path / "dst" / "0.jpg").read_bytes() == b"kept"
+
+    stats = transfer(pairs[-1:])
+    assert len(stats.failed) == 1
+
+
+def test_copy_file_refuses_same_file(tmp_path):
+    """
+    Test that copying a file onto itself, or onto a hardlink of itself, leaves it intact.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    """
+    src = tmp_path / "a.jpg"
+    src.write_bytes(b"image")
+    os.link(src, tmp_path / "b.jpg")
+    for dst in (src, tmp_path / "b.jpg"):
+        with pytest.raises(shutil.SameFileError):
+            copy_file(str(src), str(dst))
+    assert src.read_bytes() == b"image"
+
+
+def test_copy_file_recovers_from_short_kernel_copies(tmp_path, monkeypatch):
+    """
+    Test that a kernel copy reporting 0 bytes before the end of the file is not taken
+    for a complete copy: the next method, or a plain copy, writes the whole file.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - monkeypatch: fixture - Replaces the kernel copy functions of os.
+    """
+    src = tmp_path / "a.jpg"
+    src.write_bytes(os.urandom(300_000))
+    copy_file_range = getattr(os, "copy_file_range", None)
+
+    def short_copy_file_range(infd, outfd, count, offset_src, offset_dst):
+        # Copies one small chunk, then reports nothing more, like some FUSE mounts
+        if offset_src or copy_file_range is None:
+            return 0
+        return copy_file_range(infd, outfd, 1000, offset_src, offset_dst)
+
+    monkeypatch.setattr(os, "copy_file_range", short_copy_file_range, raising=False)
+    assert copy_file(str(src), str(tmp_path / "b.jpg")) == 300_000
+    assert (tmp_path / "b.jpg").read_bytes() == src.read_bytes()
+
+    monkeypatch.setattr(os, "sendfile", lambda *args: 0, raising=False)
+    assert copy_file(str(src), str(tmp_path / "c.jpg")) == 300_000
+    assert (tmp_path / "c.jpg").read_bytes() == src.read_bytes()
+
+
+@pytest.mark.parametrize("placement", ["hardlink", "symlink", "reflink", "copy"])
+def test_transfer_placements(tmp_path, placement):
+    """
+    Test that every placement gives readable files with the source content, that links
+    share the source file, and that placing again over an earlier link leaves the
+    source untouched.
+
+    Args:
+    - tmp_path: fixture - Temporary directory provided by pytest for test file creation.
+    - placement: how the files are placed.
+    """
+    src = tmp_path / "src" / "a.jpg"
+    src.parent.mkdir()
+    src.write_bytes(b"image")
+    dst = tmp_path / "dst" / "a.jpg"
+
+    stats = transfer([(str(src), str(dst))], placement=placement)
+    assert stats.files == 1 and not stats.failed
+    assert dst.read_bytes() == b"image"
+    if placement == "hardlink":
+        assert os.path.samefile(src, dst) and not dst.is_symlink()
+    elif placement == "symlink":
+        assert dst.is_symlink() and os.readlink(dst) == str(src)
+    else:
+        assert not os.path.samefile(src, dst)
+
+    # Replacing the placed file by a copy of another never writes into the source
+    other = tmp_path / "src" / "b.jpg"
+    other.write_bytes(b"other")
+    transfer([(str(other), str(dst))], placement="copy")
+    assert dst.read_bytes() == b"other" and src.read_bytes() == b"image"
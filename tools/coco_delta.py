@@ -0,0 +1,225 @@
+"""
+Append-only updates of a COCO file.
+
+Adding a small batch to a large train file with merge_coco reads and writes
+the whole file. ``append`` writes the batch as a delta segment next to the
+base file instead. Its ids already continue after the base and the earlier
+segments, so reading the base and its segments in order gives exactly the
+file merge_coco would have written:
+
+    train.json
+    train.delta-00001.json      # images, annotations, all categories
+    train.delta-00002.json
+    train.deltas.json           # segments, last ids, categories, base stamp
+
+``iter_records``, ``read_sections`` and ``load`` see the base together with
+its segments, like their counterparts in coco_stream and serialization.
+``fold`` compacts the segments into a fresh base file.
+
+The log remembers the size and modification time of the base. Segments of
+a base that was rewritten by other means no longer fit it and are refused.
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from tools import coco_stream, serialization
+from tools.coco_merge import merge_coco, plan_merge, scan_ids, write_merged
+from tools.serialization import split_ext
+
+DELTA_FORMAT = "cvops-deltas"
+DELTA_VERSION = 1
+# Sections replaced, not extended, by every segment that has them
+_HEADER = ("info", "licenses", "categories")
+
+
+def log_path(ann_path: str) -> str:
+    """Path of the delta log of ``ann_path``, i.e. ``train.deltas.json``."""
+    return split_ext(ann_path)[0] + ".deltas.json"
+
+
+def segment_path(ann_path: str, seq: int) -> str:
+    """Path of delta segment ``seq``, i.e. ``train.delta-00001.json``."""
+    root, ext = split_ext(ann_path)
+    return f"{root}.delta-{seq:05d}{ext}"
+
+
+def _stamp(ann_path: str) -> Dict[str, int]:
+    stat = os.stat(ann_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_log(ann_path: str) -> Optional[Dict[str, Any]]:
+    """The delta log of ``ann_path``, or None if nothing was appended."""
+    path = log_path(ann_path)
+    if not os.path.isfile(path):
+        return None
+    log = serialization.load(path)
+    if log.get("format") != DELTA_FORMAT:
+        raise ValueError(f"{path} is not a cvops delta log")
+    if log["base"] != _stamp(ann_path):
+        raise ValueError(
+            f"{ann_path} changed after deltas were appended to it; "
+            f"restore it or remove {path} and its segments"
+        )
+    return log
+
+
+def delta_paths(ann_path: str) -> List[str]:
+    """Segments appended to ``ann_path``, oldest first."""
+    log = read_log(ann_path)
+    if log is None:
+        return []
+    directory = os.path.dirname(ann_path)
+    return [os.path.join(directory, name) for name in log["segments"]]
+
+
+def _base_state(ann_path: str) -> Dict[str, Any]:
+    """Categories and largest ids of a base file without segments.
+
+    The largest, not the last: files written by split list their images in
+    shuffled order.
+    """
+    scan = scan_ids(ann_path)
+    img_ids = scan["columns"]["images"]["id"]
+    ann_ids = scan["columns"]["annotations"]["id"]
+    if not all(isinstance(i, int) for i in img_ids + ann_ids):
+        raise ValueError(
+            f"{ann_path}: appending needs integer image and annotation ids"
+        )
+    return {
+        "categories": scan["categories"] or [],
+        "last_image_id": max(img_ids, default=-1),
+        "last_annotation_id": max(ann_ids, default=-1),
+    }
+
+
+def append(
+    ann_path: str,
+    dataset: Union[str, dict],
+    aliases: Optional[Dict[str, str]] = None,
+    compact: bool = True,
+) -> Tuple[str, Dict[str, int]]:
+    """Appends ``dataset`` to ``ann_path`` as a new delta segment.
+
+    Ids and categories are assigned like merge_coco([ann_path, dataset]).
+    Only the new segment and the log are written; the base is scanned once,
+    on the first append.
+
+    Args:
+        ann_path (str): base COCO file
+        dataset (Union[str, dict]): COCO file or dict to append
+        aliases (Optional[Dict[str, str]]): category renames of the new
+            categories, see merge_coco; categories of the base must not be
+            renamed
+        compact (bool): write the segment without indentation
+
+    Returns:
+        Tuple[str, Dict[str, int]]: path of the segment and its number of
+            images, annotations and categories
+    """
+    log = read_log(ann_path)
+    if log is None:
+        log = {
+            "format": DELTA_FORMAT,
+            "version": DELTA_VERSION,
+            "base": _stamp(ann_path),
+            "segments": [],
+            **_base_state(ann_path),
+        }
+    renamed = {k.lower() for k in aliases or {}}
+    if any(c["name"].lower() in renamed for c in log["categories"]):
+        # The base annotations would have to be rewritten
+        raise ValueError(
+            f"Aliases rename categories of {ann_path}; merge instead of appending"
+        )
+    plan = plan_merge([dataset], aliases=aliases, after=log)
+
+    path = segment_path(ann_path, len(log["segments"]) + 1)
+    counts = write_merged(plan, path, compact)
+    log["segments"].append(os.path.basename(path))
+    log["categories"] = plan["categories"]
+    log["last_image_id"] = plan["last_image_id"]
+    log["last_annotation_id"] = plan["last_annotation_id"]
+    serialization.dump(log, log_path(ann_path), indent=2)
+    return path, counts
+
+
+def iter_records(
+    ann_path: str, section: str, fields: Optional[Iterable[str]] = None
+) -> Iterator[Any]:
+    """Records of ``section`` in the base and then in every segment."""
+    fields = None if fields is None else tuple(fields)
+    for path in [ann_path] + delta_paths(ann_path):
+        yield from coco_stream.iter_records(path, section, fields)
+
+
+def read_sections(
+    ann_path: str,
+    sections: Iterable[str],
+    default: Optional[Any] = None,
+    fields: Optional[Dict[str, Iterable[str]]] = None,
+) -> Dict[str, Any]:
+    """coco_stream.read_sections over the base and its segments.
+
+    Arrays are concatenated; info, licenses and categories are taken from
+    the last file that has them, as in the merge.
+    """
+    sections = tuple(sections)
+    result = coco_stream.read_sections(ann_path, sections, default, fields)
+    for path in delta_paths(ann_path):
+        _extend(result, coco_stream.read_sections(path, sections, None, fields))
+    return result
+
+
+def load(ann_path: str) -> dict:
+    """The whole dataset of the base and its segments as one COCO dict."""
+    dataset = serialization.load(ann_path)
+    for path in delta_paths(ann_path):
+        _extend(dataset, serialization.load(path))
+    return dataset
+
+
+def _extend(dataset: dict, segment: dict) -> None:
+    for section, value in segment.items():
+        if value is None:
+            continue
+        if section in _HEADER or not isinstance(value, list):
+            dataset[section] = value
+        else:
+            dataset[section] = (dataset.get(section) or []) + value
+
+
+def fold(ann_path: str, compact: bool = True) -> Dict[str, int]:
+    """Folds the segments of ``ann_path`` into a fresh base file.
+
+    The new base is written next to the old one and moved over it, so
+    readers never see a half-written file. Segments and log are removed
+    afterwards.
+
+    Returns:
+        Dict[str, int]: number of images, annotations and categories of the
+            new base; empty if there was nothing to fold
+    """
+    segments = delta_paths(ann_path)
+    if not segments:
+        return {}
+    directory = os.path.dirname(os.path.abspath(ann_path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=".compact-", suffix=split_ext(ann_path)[1]
+    )
+    os.close(fd)
+    try:
+        # Segment ids continue the base, so the merge keeps every id as it is
+        counts = merge_coco([ann_path] + segments, tmp_path, compact, max_workers=1)
+        shutil.copymode(ann_path, tmp_path)
+        os.replace(tmp_path, ann_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    for path in segments:
+        os.remove(path)
+    os.remove(log_path(ann_path))
+    return counts
@@ -0,0 +1,532 @@
+"""
+Columnar index over a COCO dataset.
+
+pycocotools.COCO builds a dict-of-dicts index (imgToAnns, catToImgs, ...) every
+time it is constructed. CocoIndex keeps the fields the commands actually look
+up in typed NumPy arrays instead, with CSR-style offsets from every image to
+its annotations, so lookups are array slices rather than dict walks.
+
+The columns of an indexed file are cached in a binary sidecar file under
+``.cvops-cache/`` next to it and memory-mapped on later loads. The cache is
+keyed by path, size, mtime and content hash; the JSON records themselves are
+only parsed when a command asks for them.
+
+For uncompressed files the cache also stores the byte span of every image
+and annotation record, so single records are read by seeking into the file
+instead of parsing all of it.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from pycocotools import mask as maskUtils
+
+from tools import coco_delta, serialization
+from tools.coco_stream import END_ARRAY, ITEM, START_ARRAY, iter_spans
+
+CACHE_DIR = ".cvops-cache"
+CACHE_MAGIC = b"CVOPSIDX"
+CACHE_VERSION = 2
+_ALIGN = 64
+
+# Every array attribute of CocoIndex, in the order they are cached
+COLUMNS = (
+    "img_ids",
+    "img_widths",
+    "img_heights",
+    "file_name_blob",
+    "file_name_offsets",
+    "ann_ids",
+    "ann_image_ids",
+    "ann_category_ids",
+    "ann_areas",
+    "ann_bboxes",
+    "ann_has_segmentation",
+    "ann_has_bbox",
+    "cat_ids",
+    "_img_sort",
+    "_ann_sort",
+    "_cat_sort",
+    "ann_img_pos",
+    "ann_order",
+    "img_offsets",
+    "img_spans",
+    "ann_spans",
+)
+
+# Array sections whose record spans are recorded
+_SPAN_SECTIONS = ("images", "annotations")
+
+
+class CocoIndex:
+    """Columnar, read-only index over a COCO dataset.
+
+    Records in ``dataset`` are never copied; the index stores positions into
+    the ``images``, ``annotations`` and ``categories`` lists next to the
+    numeric columns. An index loaded from the cache parses the JSON records
+    lazily, on first access to ``dataset``, ``images`` or ``annotations``.
+    Record accessors such as ``anns_for_image`` and ``take_anns`` read only
+    the requested records through ``img_spans``/``ann_spans`` when those are
+    known, i.e. (start, end) byte offsets of every record in ``ann_path``.
+    """
+
+    def __init__(
+        self,
+        dataset: dict,
+        ann_path: Optional[str] = None,
+        spans: Optional[Dict[str, np.ndarray]] = None,
+    ):
+        self.ann_path = ann_path
+        self._dataset = dataset
+        self._source = None
+        self.info = dataset.get("info")
+        self.categories = dataset.get("categories") or []
+        images = dataset.get("images") or []
+        annotations = dataset.get("annotations") or []
+
+        # Image columns
+        n_imgs = len(images)
+        self.img_ids = np.fromiter(
+            (img["id"] for img in images), dtype=np.int64, count=n_imgs
+        )
+        self.img_widths = np.fromiter(
+            (img.get("width") or 0 for img in images), dtype=np.int64, count=n_imgs
+        )
+        self.img_heights = np.fromiter(
+            (img.get("height") or 0 for img in images), dtype=np.int64, count=n_imgs
+        )
+        encoded = [img["file_name"].encode("UTF-8") for img in images]
+        self.file_name_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self.file_name_offsets = np.zeros(n_imgs + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=self.file_name_offsets[1:])
+
+        # Annotation columns
+        n_anns = len(annotations)
+        self.ann_ids = np.fromiter(
+            (ann.get("id", i) for i, ann in enumerate(annotations)),
+            dtype=np.int64,
+            count=n_anns,
+        )
+        self.ann_image_ids = np.fromiter(
+            (ann["image_id"] for ann in annotations), dtype=np.int64, count=n_anns
+        )
+        self.ann_category_ids = np.fromiter(
+            (ann["category_id"] for ann in annotations), dtype=np.int64, count=n_anns
+        )
+        self.ann_areas = np.fromiter(
+            (ann.get("area") or 0.0 for ann in annotations),
+            dtype=np.float64,
+            count=n_anns,
+        )
+        self.ann_bboxes = np.zeros((n_anns, 4), dtype=np.float64)
+        self.ann_has_bbox = np.zeros(n_anns, dtype=bool)
+        self.ann_has_segmentation = np.zeros(n_anns, dtype=bool)
+        for i, ann in enumerate(annotations):
+            bbox = ann.get("bbox")
+            if bbox:
+                self.ann_bboxes[i] = bbox[:4]
+                self.ann_has_bbox[i] = True
+            segmentation = ann.get("segmentation")
+            self.ann_has_segmentation[i] = bool(segmentation) and any(segmentation)
+
+        # Category columns
+        self.cat_ids = np.fromiter(
+            (cat["id"] for cat in self.categories),
+            dtype=np.int64,
+            count=len(self.categories),
+        )
+
+        # Sorted id -> position lookups
+        self._img_sort = np.argsort(self.img_ids, kind="stable")
+        self._ann_sort = np.argsort(self.ann_ids, kind="stable")
+        self._cat_sort = np.argsort(self.cat_ids, kind="stable")
+
+        # CSR image -> annotation offsets. ann_order lists annotation positions
+        # grouped by image position; the annotations of image i are
+        # ann_order[img_offsets[i]:img_offsets[i + 1]].
+        self.ann_img_pos = self.img_positions(self.ann_image_ids)
+        valid = self.ann_img_pos >= 0
+        self.ann_order = np.flatnonzero(valid)[
+            np.argsort(self.ann_img_pos[valid], kind="stable")
+        ]
+        counts = np.bincount(self.ann_img_pos[valid], minlength=n_imgs)
+        self.img_offsets = np.zeros(n_imgs + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.img_offsets[1:])
+
+        # Byte spans of the records in ann_path, empty when unknown
+        spans = spans or {}
+        empty = np.zeros((0, 2), dtype=np.int64)
+        self.img_spans = spans.get("images", empty)
+        self.ann_spans = spans.get("annotations", empty)
+
+    @classmethod
+    def from_file(cls, ann_path: str, use_cache: bool = True) -> "CocoIndex":
+        """Loads the index of a COCO annotation file.
+
+        With ``use_cache`` the sidecar cache is memory-mapped when it matches
+        the file, and (re)built from the JSON otherwise. Building the cache of
+        an uncompressed file records the byte span of every record. Delta
+        segments appended to the file are included, without the cache.
+        """
+        if coco_delta.delta_paths(ann_path):
+            return cls(coco_delta.load(ann_path), ann_path)
+        if not use_cache:
+            return cls(serialization.load(ann_path), ann_path)
+        index = load_cached_index(ann_path)
+        if index is not None:
+            return index
+        if serialization.compression_of(ann_path) is None:
+            dataset, spans = read_with_spans(ann_path)
+            index = cls(dataset, ann_path, spans)
+        else:
+            index = cls(serialization.load(ann_path), ann_path)
+        save_cached_index(index, ann_path)
+        return index
+
+    @property
+    def dataset(self) -> dict:
+        """The full COCO dict, parsed from ``ann_path`` on first access."""
+        if self._dataset is None:
+            self._dataset = serialization.load(self.ann_path)
+        return self._dataset
+
+    @property
+    def images(self) -> List[dict]:
+        return self.dataset.get("images") or []
+
+    @property
+    def annotations(self) -> List[dict]:
+        return self.dataset.get("annotations") or []
+
+    @property
+    def file_names(self) -> List[str]:
+        """Image file names, aligned with ``img_ids``, without parsing the JSON."""
+        blob = self.file_name_blob.tobytes()
+        offsets = self.file_name_offsets.tolist()
+        return [
+            blob[start:end].decode("UTF-8")
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    @property
+    def n_annotations(self) -> int:
+        return len(self.ann_ids)
+
+    @property
+    def has_spans(self) -> bool:
+        """True if records can be read one by one from ``ann_path``."""
+        return (
+            self.ann_path is not None
+            and len(self.img_spans) == len(self.img_ids)
+            and len(self.ann_spans) == len(self.ann_ids)
+            and len(self.img_spans) + len(self.ann_spans) > 0
+        )
+
+    def _read_spans(self, spans: np.ndarray) -> List[dict]:
+        if self._source is None:
+            with open(self.ann_path, "rb") as f:
+                self._source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        source = self._source
+        return [serialization.loads(source[start:end]) for start, end in spans.tolist()]
+
+    def _records(self, section: str, positions) -> List[dict]:
+        """Records of ``section`` at ``positions``, parsing as little as possible."""
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1)
+        if self._dataset is None and self.has_spans:
+            spans = self.img_spans if section == "images" else self.ann_spans
+            return self._read_spans(spans[positions])
+        records = self.dataset.get(section) or []
+        return [records[i] for i in positions.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.img_ids)
+
+    # Id -> position lookups
+
+    @staticmethod
+    def _positions(ids: np.ndarray, order: np.ndarray, query) -> np.ndarray:
+        query = np.asarray(query, dtype=np.int64).reshape(-1)
+        if len(ids) == 0:
+            return np.full(len(query), -1, dtype=np.int64)
+        sorted_ids = ids[order]
+        idx = np.searchsorted(sorted_ids, query)
+        idx = np.clip(idx, 0, len(ids) - 1)
+        found = sorted_ids[idx] == query
+        return np.where(found, order[idx], -1)
+
+    def img_positions(self, img_ids) -> np.ndarray:
+        """Positions of ``img_ids`` in ``images``; -1 for unknown ids."""
+        return self._positions(self.img_ids, self._img_sort, img_ids)
+
+    def ann_positions(self, ann_ids) -> np.ndarray:
+        """Positions of ``ann_ids`` in ``annotations``; -1 for unknown ids."""
+        return self._positions(self.ann_ids, self._ann_sort, ann_ids)
+
+    def cat_positions(self, cat_ids) -> np.ndarray:
+        """Positions of ``cat_ids`` in ``categories``; -1 for unknown ids."""
+        return self._positions(self.cat_ids, self._cat_sort, cat_ids)
+
+    # Image -> annotation lookups
+
+    def anns_per_image(self) -> np.ndarray:
+        """Number of annotations of every image, aligned with ``images``."""
+        return np.diff(self.img_offsets)
+
+    def ann_positions_for_images(self, img_positions) -> np.ndarray:
+        """Annotation positions belonging to the given image positions."""
+        img_positions = np.asarray(img_positions, dtype=np.int64).reshape(-1)
+        if len(img_positions) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts = self.img_offsets[img_positions]
+        lengths = self.img_offsets[img_positions + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        # Expand every [start, start + length) range without a Python loop
+        run_starts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.ann_order[run_starts + np.arange(total)]
+
+    def anns_for_image(self, img_id) -> List[dict]:
+        """Annotation records of a single image."""
+        pos = self.img_positions([img_id])[0]
+        if pos < 0:
+            return []
+        order = self.ann_order[self.img_offsets[pos] : self.img_offsets[pos + 1]]
+        return self._records("annotations", order)
+
+    # pycocotools-like accessors
+
+    def get_img_ids(self) -> List[int]:
+        return self.img_ids.tolist()
+
+    def get_cat_ids(self, cat_names: Optional[Iterable[str]] = None) -> List[int]:
+        """Category ids, optionally restricted to ``cat_names``."""
+        if cat_names is None:
+            return self.cat_ids.tolist()
+        names = set(cat_names)
+        return [cat["id"] for cat in self.categories if cat["name"] in names]
+
+    def get_ann_ids(self, img_ids=None, cat_ids=None) -> List[int]:
+        """Annotation ids, optionally restricted to images and categories."""
+        return self.ann_ids[self.ann_mask(img_ids, cat_ids)].tolist()
+
+    def ann_mask(self, img_ids=None, cat_ids=None) -> np.ndarray:
+        """Boolean mask over ``annotations`` matching images and categories."""
+        mask = np.ones(self.n_annotations, dtype=bool)
+        if img_ids is not None:
+            mask &= np.isin(self.ann_image_ids, np.asarray(img_ids, dtype=np.int64))
+        if cat_ids is not None:
+            mask &= np.isin(self.ann_category_ids, np.asarray(cat_ids, dtype=np.int64))
+        return mask
+
+    def load_imgs(self, img_ids) -> List[dict]:
+        positions = self.img_positions(img_ids)
+        return self._records("images", positions[positions >= 0])
+
+    def load_anns(self, ann_ids) -> List[dict]:
+        positions = self.ann_positions(ann_ids)
+        return self._records("annotations", positions[positions >= 0])
+
+    def load_cats(self, cat_ids) -> List[dict]:
+        return [self.categories[i] for i in self.cat_positions(cat_ids) if i >= 0]
+
+    def take_anns(self, positions) -> List[dict]:
+        """Annotation records at the given positions."""
+        return self._records("annotations", positions)
+
+    def take_imgs(self, positions) -> List[dict]:
+        """Image records at the given positions."""
+        return self._records("images", positions)
+
+    def category_counts(self) -> Dict[int, int]:
+        """Number of annotations per category id, including empty categories."""
+        counts = np.bincount(
+            self.cat_positions(self.ann_category_ids) + 1,
+            minlength=len(self.categories) + 1,
+        )[1:]
+        return dict(zip(self.cat_ids.tolist(), counts.tolist()))
+
+    def has_segmentation(self) -> bool:
+        """True if any annotation carries non-empty segmentation data."""
+        return bool(self.ann_has_segmentation.any())
+
+    def ann_to_mask(self, ann: dict) -> np.ndarray:
+        """Decodes the segmentation of ``ann`` into a binary mask."""
+        pos = self.img_positions([ann["image_id"]])[0]
+        h, w = int(self.img_heights[pos]), int(self.img_widths[pos])
+        segm = ann["segmentation"]
+        if isinstance(segm, list):
+            rle = maskUtils.merge(maskUtils.frPyObjects(segm, h, w))
+        elif isinstance(segm["counts"], list):
+            rle = maskUtils.frPyObjects(segm, h, w)
+        else:
+            rle = segm
+        return maskUtils.decode(rle)
+
+
+def read_with_spans(ann_path: str):
+    """Loads a COCO file together with the byte span of every record.
+
+    Returns:
+        tuple: the COCO dict and ``{"images": spans, "annotations": spans}``,
+            each an (N, 2) array of [start, end) byte offsets
+    """
+    dataset = {}
+    spans = {section: [] for section in _SPAN_SECTIONS}
+    for section, event, value, start, end in iter_spans(ann_path):
+        if event == START_ARRAY:
+            dataset[section] = []
+        elif event == ITEM:
+            dataset[section].append(value)
+            if section in spans:
+                spans[section].append((start, end))
+        elif event != END_ARRAY:
+            dataset[section] = value
+    return dataset, {
+        section: np.array(rows, dtype=np.int64).reshape(-1, 2)
+        for section, rows in spans.items()
+    }
+
+
+# Sidecar cache
+
+
+def cache_path(ann_path: str) -> str:
+    """Location of the sidecar cache file of ``ann_path``."""
+    directory, name = os.path.split(os.path.abspath(ann_path))
+    return os.path.join(directory, CACHE_DIR, f"{name}.idx")
+
+
+def content_hash(ann_path: str, chunk_size: int = 1 << 23) -> str:
+    """blake2b digest of the file content."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(ann_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_cache_header(path: str):
+    with open(path, "rb") as f:
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        return serialization.loads(f.read(header_len).decode("UTF-8"))
+
+
+def load_cached_index(ann_path: str) -> Optional[CocoIndex]:
+    """Memory-maps the cached index of ``ann_path`` if it is still valid.
+
+    Size and mtime are checked first. If only the mtime changed (i.e. the
+    file was copied or touched) the content hash decides, and a match
+    refreshes the stored mtime. Returns None when there is no usable cache.
+    """
+    path = cache_path(ann_path)
+    if not os.path.isfile(path):
+        return None
+    try:
+        header = _read_cache_header(path)
+        stat = os.stat(ann_path)
+        if header is None or header["version"] != CACHE_VERSION:
+            return None
+        if header["size"] != stat.st_size:
+            return None
+        if header["mtime_ns"] != stat.st_mtime_ns:
+            if header["hash"] != content_hash(ann_path):
+                return None
+            header["mtime_ns"] = stat.st_mtime_ns
+            _write_header(path, header)
+
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # A truncated or inconsistent cache is rebuilt, not reported
+        columns = {}
+        for name, spec in header["columns"].items():
+            dtype, count = np.dtype(spec["dtype"]), int(np.prod(spec["shape"]))
+            if count == 0:
+                column = np.zeros(0, dtype=dtype)
+            else:
+                column = np.frombuffer(
+                    buffer, dtype=dtype, count=count, offset=spec["offset"]
+                )
+            columns[name] = column.reshape(spec["shape"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+    index = CocoIndex.__new__(CocoIndex)
+    index.ann_path = ann_path
+    index._dataset = None
+    index._source = None
+    index.info = header["info"]
+    index.categories = header["categories"]
+    for name, column in columns.items():
+        setattr(index, name, column)
+    return index
+
+
+def _write_header(path: str, header: dict) -> None:
+    """Rewrites the header of an existing cache file in place."""
+    with open(path, "r+b") as f:
+        f.seek(len(CACHE_MAGIC))
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        encoded = serialization.dumps(header).encode("UTF-8")
+        if len(encoded) <= header_len:
+            f.write(encoded.ljust(header_len))
+
+
+def save_cached_index(index: CocoIndex, ann_path: str) -> None:
+    """Writes the columns of ``index`` to the sidecar cache of ``ann_path``.
+
+    Failing to write the cache (read-only directory, full disk) only costs
+    the speed-up, so errors are reported and otherwise ignored.
+    """
+    path = cache_path(ann_path)
+    stat = os.stat(ann_path)
+    header = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(ann_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": content_hash(ann_path),
+        "info": index.info,
+        "categories": index.categories,
+        "columns": {},
+    }
+    columns = [np.ascontiguousarray(getattr(index, name)) for name in COLUMNS]
+
+    # Offsets depend on the header length, so reserve generous header space
+    header_len = 0
+    offset = 0
+    for name, column in zip(COLUMNS, columns):
+        header["columns"][name] = {
+            "dtype": column.dtype.str,
+            "shape": list(column.shape),
+            "offset": offset,
+        }
+        offset += -(-column.nbytes // _ALIGN) * _ALIGN
+    header_len = len(serialization.dumps(header).encode("UTF-8")) + 4096
+    data_start = -(-(len(CACHE_MAGIC) + 8 + header_len) // _ALIGN) * _ALIGN
+    for spec in header["columns"].values():
+        spec["offset"] += data_start
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(CACHE_MAGIC)
+            f.write(struct.pack("<Q", header_len))
+            f.write(serialization.dumps(header).encode("UTF-8").ljust(header_len))
+            for name, column in zip(COLUMNS, columns):
+                f.seek(header["columns"][name]["offset"])
+                f.write(column.tobytes())
+            # Empty columns write nothing; keep every offset inside the file
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write index cache at {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,524 @@
+"""
+Streaming merge of several COCO annotation files into one.
+
+The ids follow the conventions of COCO_Assistant.merge, which cvOps used
+before:
+- The first file keeps its image and annotation ids.
+- Every later file continues after the last id written so far, in record
+  order.
+- Categories are matched by lower-cased name, optionally after renaming
+  them with an alias table, and unknown names are appended. Category ids
+  of the annotations are translated with one lookup array per file.
+- info and licenses are taken from the last file that has them.
+
+Every file is read three times without decoding its polygons: once to
+collect its ids, then once each for the images and annotations sections.
+New ids are computed per file with vectorized lookups and spliced into the
+raw records, so peak memory is a few integer arrays per file. Empty
+``[[]]`` segmentations are replaced by ``[]`` on the way.
+
+With several worker processes, the files are scanned in parallel and each
+worker rewrites whole files into temporary fragments, which the parent then
+streams into the output in input order. New ids only depend on the id
+counts of the files before, so the output is byte-identical whatever the
+number of workers.
+"""
+
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from tools.coco_stream import (
+    END_ARRAY,
+    ITEM,
+    START_ARRAY,
+    VALUE,
+    CocoWriter,
+    RawJSON,
+    find_fields,
+    iter_events,
+    project,
+    splice,
+)
+from tools.transfer import DEFAULT_WORKERS, Placement, file_digest, transfer
+
+EMPTY_SEGMENTATION = re.compile(r"\[\s*\[\s*\]\s*\]")
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg")
+_ARRAYS = ("images", "annotations")
+
+
+def _raw_records(source: Union[str, dict], section: str) -> Iterator[Any]:
+    """Undecoded records of one array section; the records of a COCO dict."""
+    if isinstance(source, dict):
+        yield from source.get(section) or []
+        return
+    ann_path = source
+    events = iter_events(ann_path, raw_sections=_ARRAYS)
+    try:
+        for name, event, value in events:
+            if name != section:
+                continue
+            if event == ITEM:
+                yield value
+            elif event == END_ARRAY:
+                return
+    finally:
+        events.close()
+
+
+def scan_ids(source: Union[str, dict]) -> Dict[str, Any]:
+    """Reads the header sections and the id columns of one COCO file or dict."""
+    columns = {
+        "images": {"id": []},
+        "annotations": {"id": [], "image_id": [], "category_id": []},
+    }
+    if isinstance(source, dict):
+        for section, fields in columns.items():
+            records = source.get(section) or []
+            for field, values in fields.items():
+                values.extend(record.get(field) for record in records)
+        return {
+            "info": source.get("info"),
+            "licenses": source.get("licenses"),
+            "categories": source.get("categories") or [],
+            "columns": columns,
+        }
+    ann_path = source
+    header = {"info": None, "licenses": None, "categories": []}
+    for section, event, value in iter_events(ann_path, raw_sections=_ARRAYS):
+        if section in columns and event == ITEM:
+            record = project(value, columns[section])
+            for field, values in columns[section].items():
+                values.append(record.get(field))
+        elif section in header and event == VALUE:
+            header[section] = value
+        elif section in header and event == ITEM:
+            header[section].append(value)
+        elif section in header and event == START_ARRAY:
+            header[section] = []
+    header["columns"] = columns
+    return header
+
+
+def _lookup(keys: np.ndarray, values: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """values[i] for every query equal to keys[i]; -1 where there is none."""
+    if len(keys) == 0 or len(query) == 0:
+        return np.full(len(query), -1, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    pos = np.clip(np.searchsorted(keys[order], query), 0, len(keys) - 1)
+    found = keys[order][pos] == query
+    return np.where(found, values[order][pos], -1)
+
+
+class CategoryReconciler:
+    """Merges category lists by lower-cased name, like COCO_Assistant.
+
+    Categories not seen before get ids after the largest id in use, unlike
+    COCO_Assistant whose ``len + 1`` collides when the ids have gaps.
+
+    ``aliases`` renames categories before they are matched, in the format of
+    the ``process:`` section of config/category_manage.yaml. Categories of
+    one file that end up with the same name are collapsed into one. Merged
+    categories keep the fields of the record they were first seen with,
+    i.e. ``supercategory``, and its name unless an alias renames it.
+    """
+
+    def __init__(self, aliases: Optional[Dict[str, str]] = None):
+        self.aliases = {k.lower(): v for k, v in (aliases or {}).items()}
+        self.categories = None
+        self.ids = {}
+
+    def _renamed(self, category: dict) -> dict:
+        """``category`` under its alias, if it has one."""
+        alias = self.aliases.get(category["name"].lower())
+        return category if alias is None else dict(category, name=alias)
+
+    def _first(self, categories: List[dict]) -> Dict[Any, Any]:
+        # The first file keeps its ids and category records, renamed by aliases
+        self.categories, mapping = [], {}
+        for category in sorted(categories, key=lambda c: c["id"]):
+            category = self._renamed(category)
+            name = category["name"].lower()
+            if name not in self.ids:
+                self.ids[name] = category["id"]
+                self.categories.append(category)
+            mapping[category["id"]] = self.ids[name]
+        return mapping
+
+    def add(self, categories: List[dict]) -> Dict[Any, Any]:
+        """Adds the categories of the next file; returns its old -> new id map."""
+        if self.categories is None:
+            return self._first(categories)
+        incoming = [(self._renamed(c), c["id"]) for c in categories]
+        new = {}
+        for category, _ in incoming:
+            if category["name"].lower() not in self.ids:
+                new.setdefault(category["name"].lower(), category)
+        # New ids go past the largest id in use, which need not be len(ids):
+        # ids can have gaps, and same-named categories are collapsed
+        next_id = max(self.ids.values(), default=0) + 1
+        for k, name in enumerate(sorted(new)):
+            self.ids[name] = next_id + k
+            self.categories.append(dict(new[name], id=next_id + k))
+        return {old_id: self.ids[c["name"].lower()] for c, old_id in incoming}
+
+
+def translation_table(mapping: Dict[int, int]) -> np.ndarray:
+    """Lookup array with ``table[old_id] == new_id``; -1 for unmapped ids."""
+    mapping = {k: v for k, v in mapping.items() if k >= 0}
+    size = max(mapping, default=-1) + 1
+    table = np.full(size, -1, dtype=np.int64)
+    if mapping:
+        old = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+        table[old] = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+    return table
+
+
+def translate(table: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Maps ``ids`` through ``table``; ids the table does not cover are kept."""
+    inside = (ids >= 0) & (ids < len(table))
+    new_ids = ids.copy()
+    new_ids[inside] = table[ids[inside]]
+    return np.where(new_ids < 0, ids, new_ids)
+
+
+def plan_merge(
+    ann_paths: Sequence[Union[str, dict]],
+    scans: Optional[Sequence[Dict]] = None,
+    aliases: Optional[Dict[str, str]] = None,
+    renames: Optional[Sequence[Dict[str, str]]] = None,
+    after: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """First pass: new image, annotation and category ids of every file.
+
+    Args:
+        ann_paths (Sequence[Union[str, dict]]): input files or COCO dicts,
+            in merge order
+        scans (Optional[Sequence[Dict]]): scan_ids of every file, if already
+            read; otherwise the files are scanned one after another
+        aliases (Optional[Dict[str, str]]): category renames applied before
+            categories are matched by name, see CategoryReconciler
+        renames (Optional[Sequence[Dict[str, str]]]): per file, image base
+            names to rewrite in ``file_name``, see consolidate_images
+        after (Optional[Dict[str, Any]]): ``categories``, ``last_image_id``
+            and ``last_annotation_id`` (the largest ids in use) of a dataset
+            the files are appended to; then the first file is renumbered
+            like the others
+
+    Returns:
+        Dict[str, Any]: ``files`` with the new id columns per input file,
+            plus the merged ``categories``, ``info`` and ``licenses`` and the
+            largest ids written, ``last_image_id`` and ``last_annotation_id``.
+    """
+    files = []
+    reconciler = CategoryReconciler(aliases)
+    info = licenses = None
+    last_img_id = last_ann_id = -1
+    if after is not None:
+        reconciler.add(after["categories"] or [])
+        last_img_id = after["last_image_id"]
+        last_ann_id = after["last_annotation_id"]
+    if scans is None:
+        scans = map(scan_ids, ann_paths)
+    for k, (ann_path, scan) in enumerate(zip(ann_paths, scans)):
+        img_ids = np.asarray(scan["columns"]["images"]["id"])
+        anns = scan["columns"]["annotations"]
+        ann_img_ids = np.asarray(anns["image_id"])
+        cat_ids = np.asarray(anns["category_id"], dtype=np.int64)
+        # Categories missing from the file's own list keep their ids
+        table = translation_table(reconciler.add(scan["categories"] or []))
+        new_cat_ids = translate(table, cat_ids)
+
+        if k == 0 and after is None:
+            if img_ids.dtype.kind in "iu":
+                new_img_ids = img_ids.astype(np.int64)
+                new_ann_ids = np.asarray(anns["id"])
+            else:
+                # String ids are replaced by positions
+                new_img_ids = np.arange(len(img_ids), dtype=np.int64)
+                new_ann_ids = np.arange(len(anns["id"]), dtype=np.int64)
+        else:
+            new_img_ids = last_img_id + 1 + np.arange(len(img_ids), dtype=np.int64)
+            new_ann_ids = last_ann_id + 1 + np.arange(len(anns["id"]), dtype=np.int64)
+
+        new_ann_img_ids = _lookup(img_ids, new_img_ids, ann_img_ids)
+        if (new_ann_img_ids < 0).any():
+            missing = ann_img_ids[new_ann_img_ids < 0][:5].tolist()
+            name = ann_path if isinstance(ann_path, str) else f"Dataset {k}"
+            raise ValueError(f"{name}: annotations refer to unknown images {missing}")
+
+        files.append(
+            {
+                "path": ann_path,
+                "img_ids": new_img_ids,
+                "ann_ids": new_ann_ids,
+                "ann_img_ids": new_ann_img_ids,
+                "ann_cat_ids": new_cat_ids,
+                "renames": renames[k] if renames else None,
+            }
+        )
+        # Continue after the largest id, not the last one: files written by
+        # split list their images in shuffled order
+        if len(new_img_ids):
+            last_img_id = max(last_img_id, int(new_img_ids.max()))
+        if len(new_ann_ids):
+            last_ann_id = max(last_ann_id, int(new_ann_ids.max()))
+        if scan["info"] is not None:
+            info = scan["info"]
+        if scan["licenses"] is not None:
+            licenses = scan["licenses"]
+
+    return {
+        "files": files,
+        "categories": reconciler.categories or [],
+        "info": info,
+        "licenses": licenses,
+        "last_image_id": last_img_id,
+        "last_annotation_id": last_ann_id,
+    }
+
+
+def _rewrite(
+    raw: Union[RawJSON, dict],
+    values: Dict[str, Any],
+    fix_segmentation: bool = False,
+    renames: Optional[Dict[str, str]] = None,
+) -> Union[RawJSON, dict]:
+    """Splices new field values (and a normalized segmentation) into a record.
+
+    ``renames`` maps image base names to their names in the merged image
+    folder; a renamed ``file_name`` is rewritten as well. Records of
+    in-memory datasets are dicts and are copied before they are changed.
+    """
+    if isinstance(raw, dict):
+        record = dict(raw, **values)
+        if fix_segmentation and record.get("segmentation") == [[]]:
+            record["segmentation"] = []
+        file_name = record.get("file_name")
+        if renames and isinstance(file_name, str):
+            record["file_name"] = renames.get(os.path.basename(file_name), file_name)
+        return record
+    fields = tuple(values) + (("file_name",) if renames else ())
+    spans = find_fields(raw, fields + (("segmentation",) if fix_segmentation else ()))
+    current = project(raw, fields, spans)
+    changes = {f: v for f, v in values.items() if current.get(f, None) != v}
+    if fix_segmentation and "segmentation" in spans:
+        start, end = spans["segmentation"]
+        if EMPTY_SEGMENTATION.fullmatch(raw, start, end):
+            changes["segmentation"] = []
+    file_name = current.get("file_name")
+    if renames and isinstance(file_name, str):
+        new_name = renames.get(os.path.basename(file_name))
+        if new_name is not None:
+            changes["file_name"] = new_name
+    return splice(raw, changes, spans) if changes else raw
+
+
+def _rewritten(file: Dict[str, Any], section: str) -> Iterator[Any]:
+    """The records of one section of one input file, with their new ids."""
+    records = _raw_records(file["path"], section)
+    if section == "images":
+        renames = file.get("renames")
+        for raw, img_id in zip(records, file["img_ids"].tolist()):
+            yield _rewrite(raw, {"id": img_id}, renames=renames)
+        return
+    columns = zip(
+        file["ann_ids"].tolist(),
+        file["ann_img_ids"].tolist(),
+        file["ann_cat_ids"].tolist(),
+    )
+    for raw, (ann_id, img_id, cat_id) in zip(records, columns):
+        values = {"id": ann_id, "image_id": img_id, "category_id": cat_id}
+        yield _rewrite(raw, values, fix_segmentation=True)
+
+
+def _write_fragments(
+    file: Dict[str, Any], tmp_dir: str, compact: bool
+) -> Dict[str, Any]:
+    """Rewrites the records of one file into a fragment per section.
+
+    Runs in a worker process. Fragments are formatted by a CocoWriter with
+    the settings of the final writer, see CocoWriter.write_formatted.
+    """
+    formatter = CocoWriter(None, compact=compact)
+    fragments = {}
+    name = os.path.basename(file["path"]) if isinstance(file["path"], str) else ""
+    for section in _ARRAYS:
+        fd, path = tempfile.mkstemp(suffix=f".{section}", prefix=name, dir=tmp_dir)
+        count = 0
+        with open(fd, "w", encoding="UTF-8") as f:
+            for record in _rewritten(file, section):
+                if count:
+                    f.write(",")
+                f.write(formatter.format_record(record))
+                count += 1
+        fragments[section] = (path, count)
+    return fragments
+
+
+def consolidate_images(
+    img_dirs: Sequence[str],
+    out_dir: str,
+    placement: Union[Placement, str] = Placement.hardlink,
+    max_workers: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Gathers the images of several folders flat into ``out_dir``.
+
+    Images keep their names unless an earlier folder already has an image of
+    that name. An identical image is then not placed twice; a different one
+    gets part of its content hash in its name, ``img.png`` becoming
+    ``img_<hash>.png``. Names are decided in folder order before any file is
+    placed, so the result does not depend on thread scheduling. Files are
+    hashed by a thread pool and placed by tools.transfer.
+
+    Args:
+        img_dirs (Sequence[str]): image folders, in merge order
+        out_dir (str): existing output folder
+        placement (Union[Placement, str]): copy, hardlink, symlink or reflink,
+            falling back to copies where links are refused
+        max_workers (Optional[int]): threads, ThreadPoolExecutor's default if None
+
+    Returns:
+        List[Dict[str, str]]: per folder, the renamed base names and their
+            new names, to be passed to merge_coco as ``renames``
+    """
+    sources = [
+        (k, name, os.path.join(img_dir, name))
+        for k, img_dir in enumerate(img_dirs)
+        for name in sorted(os.listdir(img_dir))
+        if os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES
+    ]
+    owners, to_hash = {}, set()
+    for _, name, path in sources:
+        if name in owners:
+            to_hash.update((owners[name], path))
+        else:
+            owners[name] = path
+
+    renames = [{} for _ in img_dirs]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        to_hash = sorted(to_hash)
+        digests = dict(zip(to_hash, pool.map(file_digest, to_hash)))
+
+    placed = {}
+    for k, name, path in sources:
+        if owners[name] != path:
+            if digests[path] == digests[owners[name]]:
+                continue
+            stem, ext = os.path.splitext(name)
+            renames[k][name] = f"{stem}_{digests[path][:8]}{ext}"
+            name = renames[k][name]
+        placed.setdefault(name, path)
+    stats = transfer(
+        ((path, os.path.join(out_dir, name)) for name, path in placed.items()),
+        placement=placement,
+        max_workers=max_workers or DEFAULT_WORKERS,
+        desc="Merging images",
+    )
+    if stats.failed:
+        raise OSError(f"Could not place {len(stats.failed)} images in {out_dir}")
+    return renames
+
+
+def merge_coco(
+    ann_paths: Sequence[Union[str, dict]],
+    out_path: str,
+    compact: bool = True,
+    max_workers: Optional[int] = None,
+    aliases: Optional[Dict[str, str]] = None,
+    renames: Optional[Sequence[Dict[str, str]]] = None,
+) -> Dict[str, int]:
+    """Merges COCO files into ``out_path``, written exactly once.
+
+    Args:
+        ann_paths (Sequence[Union[str, dict]]): input files, in merge order.
+            COCO dicts already in memory can be mixed in; they are merged
+            like a file with the same content.
+        out_path (str): merged COCO file
+        compact (bool): write without indentation
+        max_workers (Optional[int]): worker processes, one per core if None;
+            1 merges in this process
+        aliases (Optional[Dict[str, str]]): category renames, i.e. the
+            ``process:`` section of config/category_manage.yaml
+        renames (Optional[Sequence[Dict[str, str]]]): per file, image base
+            names to rewrite in ``file_name``, as returned by
+            consolidate_images
+
+    Returns:
+        Dict[str, int]: number of merged images, annotations and categories
+    """
+    workers = max_workers or os.cpu_count() or 1
+    if workers > 1 and len(ann_paths) > 1:
+        return _merge_parallel(ann_paths, out_path, compact, workers, aliases, renames)
+
+    plan = plan_merge(ann_paths, aliases=aliases, renames=renames)
+    return write_merged(plan, out_path, compact)
+
+
+def write_merged(
+    plan: Dict[str, Any], out_path: str, compact: bool = True
+) -> Dict[str, int]:
+    """Second pass in this process: writes the files of ``plan`` with their new ids.
+
+    Returns:
+        Dict[str, int]: number of merged images, annotations and categories
+    """
+    counts = {}
+    with CocoWriter(out_path, compact=compact) as writer:
+        for section in _ARRAYS:
+            writer.begin_array(section)
+            for file in plan["files"]:
+                for record in _rewritten(file, section):
+                    writer.write_record(record)
+            counts[section] = writer.end_array()
+        _write_header(writer, plan)
+    return {**counts, "categories": len(plan["categories"])}
+
+
+def _merge_parallel(
+    ann_paths: Sequence[Union[str, dict]],
+    out_path: str,
+    compact: bool,
+    workers: int,
+    aliases: Optional[Dict[str, str]],
+    renames: Optional[Sequence[Dict[str, str]]],
+) -> Dict[str, int]:
+    # Hundreds of small files: hand them out in chunks to save round trips
+    chunksize = max(1, len(ann_paths) // (workers * 4))
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    tmp = tempfile.TemporaryDirectory(dir=out_dir)
+    with ProcessPoolExecutor(max_workers=workers) as pool, tmp as tmp_dir:
+        scans = list(pool.map(scan_ids, ann_paths, chunksize=chunksize))
+        plan = plan_merge(ann_paths, scans, aliases, renames)
+        del scans
+        fragments = list(
+            pool.map(
+                _write_fragments,
+                plan["files"],
+                [tmp_dir] * len(ann_paths),
+                [compact] * len(ann_paths),
+                chunksize=chunksize,
+            )
+        )
+        counts = {}
+        with CocoWriter(out_path, compact=compact) as writer:
+            for section in _ARRAYS:
+                writer.begin_array(section)
+                for file_fragments in fragments:
+                    path, count = file_fragments[section]
+                    with open(path, encoding="UTF-8") as f:
+                        writer.write_formatted(f, count)
+                    os.remove(path)
+                counts[section] = writer.end_array()
+            _write_header(writer, plan)
+    return {**counts, "categories": len(plan["categories"])}
+
+
+def _write_header(writer: CocoWriter, plan: Dict[str, Any]) -> None:
+    writer.write_value("info", plan["info"])
+    writer.write_value("licenses", plan["licenses"])
+    writer.write_value("categories", plan["categories"])
@@ -0,0 +1,241 @@
+"""
+Sharded COCO datasets: a directory of JSONL files partitioned by image id.
+
+A monolithic COCO file can only be parsed front to back by one process. A
+shard directory splits the ``images`` and ``annotations`` arrays into
+``num_shards`` pairs of JSONL files, one record per line, routing every image
+and every annotation to shard ``image_id % num_shards``. An image and all of
+its annotations therefore always live in the same shard, and shards can be
+processed independently by a process pool.
+
+Layout:
+    dataset.shards/
+    ├── header.json               # format, shard counts, info/licenses/categories
+    ├── images-00000.jsonl
+    ├── annotations-00000.jsonl
+    ├── images-00001.jsonl
+    └── ...
+
+Shards may be gzip compressed (``.jsonl.gz``); the header records which.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from tools import serialization
+from tools.coco_stream import (
+    ITEM,
+    START_ARRAY,
+    VALUE,
+    CocoWriter,
+    iter_events,
+)
+
+HEADER_FILE = "header.json"
+SHARD_FORMAT = "cvops-shards"
+SHARD_VERSION = 1
+SHARDED_SECTIONS = ("images", "annotations")
+
+
+def is_shard_dir(path: str) -> bool:
+    """True if ``path`` is a directory written by shard_coco."""
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def read_header(shard_dir: str) -> Dict[str, Any]:
+    header = serialization.load(os.path.join(shard_dir, HEADER_FILE))
+    if header.get("format") != SHARD_FORMAT:
+        raise ValueError(f"{shard_dir} is not a cvops shard directory")
+    return header
+
+
+def write_header(shard_dir: str, header: Dict[str, Any]) -> None:
+    serialization.dump(header, os.path.join(shard_dir, HEADER_FILE), indent=2)
+
+
+def shard_path(shard_dir: str, header: Dict[str, Any], section: str, shard: int) -> str:
+    return os.path.join(shard_dir, f"{section}-{shard:05d}{header['extension']}")
+
+
+def iter_shard(path: str) -> Iterator[Any]:
+    """Yields the records of one JSONL shard file."""
+    with serialization.open_file(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield serialization.loads(line)
+
+
+def load_shard(shard_dir: str, shard: int, header: Optional[Dict] = None) -> Dict:
+    """Loads one shard as a small COCO dict, with the header sections."""
+    header = header or read_header(shard_dir)
+    dataset = dict(header["sections"])
+    for section in SHARDED_SECTIONS:
+        dataset[section] = list(
+            iter_shard(shard_path(shard_dir, header, section, shard))
+        )
+    return dataset
+
+
+def _write_lines(f, records) -> int:
+    count = 0
+    for record in records:
+        f.write(serialization.dumps(record, compact=True))
+        f.write("\n")
+        count += 1
+    return count
+
+
+def shard_coco(
+    ann_path: str, shard_dir: str, num_shards: int = 8, compress: bool = False
+) -> Dict[str, Any]:
+    """Splits a COCO file into ``num_shards`` JSONL shards in one streaming pass.
+
+    Args:
+        ann_path (str): COCO annotation file, possibly compressed
+        shard_dir (str): output directory, created if missing
+        num_shards (int): number of shards
+        compress (bool): gzip the shard files
+
+    Returns:
+        Dict[str, Any]: the shard header
+    """
+    if num_shards < 1:
+        raise ValueError("num_shards must be at least 1")
+    os.makedirs(shard_dir, exist_ok=True)
+    header = {
+        "format": SHARD_FORMAT,
+        "version": SHARD_VERSION,
+        "num_shards": num_shards,
+        "extension": ".jsonl.gz" if compress else ".jsonl",
+        "section_order": [],
+        "sections": {},
+        "counts": {section: [0] * num_shards for section in SHARDED_SECTIONS},
+    }
+    files = {
+        section: [
+            serialization.open_file(shard_path(shard_dir, header, section, i), "wt")
+            for i in range(num_shards)
+        ]
+        for section in SHARDED_SECTIONS
+    }
+    key = {"images": "id", "annotations": "image_id"}
+    try:
+        for section, event, value in iter_events(ann_path):
+            if event in (START_ARRAY, VALUE):
+                header["section_order"].append(section)
+            if section in SHARDED_SECTIONS:
+                if event == ITEM:
+                    shard = value[key[section]] % num_shards
+                    _write_lines(files[section][shard], (value,))
+                    header["counts"][section][shard] += 1
+            elif event == START_ARRAY:
+                header["sections"][section] = []
+            elif event == ITEM:
+                header["sections"][section].append(value)
+            elif event == VALUE:
+                header["sections"][section] = value
+    finally:
+        for section_files in files.values():
+            for f in section_files:
+                f.close()
+    write_header(shard_dir, header)
+    return header
+
+
+def unshard_coco(shard_dir: str, out_path: str, compact: bool = False) -> None:
+    """Reassembles a shard directory into a standard COCO file.
+
+    Sections keep the order of the original file. Records are written shard
+    by shard, so their order may differ from the original file while ids
+    and content are unchanged.
+    """
+    header = read_header(shard_dir)
+    with CocoWriter(out_path, compact=compact) as writer:
+        for section in header["section_order"]:
+            if section in SHARDED_SECTIONS:
+                writer.begin_array(section)
+                for shard in range(header["num_shards"]):
+                    path = shard_path(shard_dir, header, section, shard)
+                    for record in iter_shard(path):
+                        writer.write_record(record)
+                writer.end_array()
+            else:
+                writer.write_value(section, header["sections"][section])
+
+
+def map_shards(
+    shard_dir: str,
+    fn: Callable[..., Any],
+    *args,
+    max_workers: Optional[int] = None,
+) -> List[Any]:
+    """Runs ``fn(shard_dir, shard, *args)`` for every shard in a process pool.
+
+    ``fn`` and ``args`` must be picklable, i.e. module-level functions.
+    Results are returned in shard order.
+    """
+    num_shards = read_header(shard_dir)["num_shards"]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(fn, shard_dir, shard, *args) for shard in range(num_shards)
+        ]
+        return [future.result() for future in futures]
+
+
+def _transform_shard(
+    shard_dir: str, shard: int, out_dir: str, handlers: Dict[str, Callable]
+) -> Dict[str, int]:
+    header = read_header(shard_dir)
+    counts = {}
+    for section in SHARDED_SECTIONS:
+        records = iter_shard(shard_path(shard_dir, header, section, shard))
+        handler = handlers.get(section)
+        if handler is not None:
+            records = (r for r in map(handler, records) if r is not None)
+        out_path = shard_path(out_dir, header, section, shard)
+        with serialization.open_file(out_path, "wt") as f:
+            counts[section] = _write_lines(f, records)
+    return counts
+
+
+def transform_shards(
+    shard_dir: str,
+    out_dir: str,
+    handlers: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    replace: Optional[Dict[str, Any]] = None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Sharded counterpart of coco_stream.transform_coco.
+
+    ``handlers`` and ``replace`` work as in transform_coco. Handlers of the
+    sharded sections run in parallel, one process per shard, so they must be
+    picklable (module-level functions or functools.partial of them).
+    """
+    handlers = handlers or {}
+    replace = replace or {}
+    header = read_header(shard_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    results = map_shards(
+        shard_dir,
+        _transform_shard,
+        out_dir,
+        {s: h for s, h in handlers.items() if s in SHARDED_SECTIONS},
+        max_workers=max_workers,
+    )
+    for section in SHARDED_SECTIONS:
+        header["counts"][section] = [counts[section] for counts in results]
+
+    # The small header sections are rewritten in this process
+    for section, value in header["sections"].items():
+        handler = handlers.get(section)
+        if section in replace:
+            value = replace[section]
+        elif handler is not None and isinstance(value, list):
+            value = [r for r in map(handler, value) if r is not None]
+        elif handler is not None:
+            value = handler(value)
+        header["sections"][section] = value
+    write_header(out_dir, header)
+    return header
@@ -0,0 +1,653 @@
+"""
+Incremental reader and writer for COCO annotation files.
+
+json.load needs the whole file as one string plus the complete object tree,
+which is several times the file size. The reader here walks the top-level
+COCO object in fixed-size chunks and decodes the elements of array sections
+(``images``, ``annotations``, ...) one record at a time, in the spirit of
+ijson's event based parsing, so only one record is alive at a time.
+
+CocoWriter is the output side: it emits sections and array records as they
+come, so datasets can be written from generators. transform_coco combines
+both for one-pass rewrites.
+
+Sections or records a command does not need are not decoded at all: the
+walk scans over them with a regular expression and hands them on as RawJSON
+text, which CocoWriter copies verbatim. With ``fields``, only the named
+top-level fields of each record are decoded, i.e. ``category_id`` of an
+annotation without its segmentation polygons.
+
+Records are decoded with the standard library's ``raw_decode``, which is the
+only decoder that parses a value from the middle of a buffer. Writing goes
+through tools.serialization and so uses the fast backend in compact mode.
+"""
+
+import json
+import os
+import re
+import shutil
+from functools import lru_cache
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from tools import serialization
+
+CHUNK_SIZE = 1 << 20
+
+_WS = re.compile(r"[ \t\n\r]*")
+_RUN = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR_END = re.compile(r"[,}\]\s]")
+_decoder = json.JSONDecoder()
+
+# Event kinds yielded by iter_events
+START_ARRAY = "start_array"
+ITEM = "item"
+END_ARRAY = "end_array"
+VALUE = "value"
+
+
+class RawJSON(str):
+    """Undecoded JSON text of a value, written verbatim by CocoWriter."""
+
+
+def _scan(text: str, pos: int, depth: int) -> Tuple[int, int]:
+    """Scans an array or object from ``pos`` on, without decoding it.
+
+    Returns the position and bracket depth reached. Depth 0 means the value
+    ended right before that position; otherwise ``text`` ended first and the
+    scan can be resumed from there once more text is available.
+    """
+    n = len(text)
+    while True:
+        # Jump over everything but brackets, strings included, in one match
+        pos = _RUN.match(text, pos).end()
+        if pos >= n or text[pos] == '"':
+            # End of text, possibly inside a string cut at the chunk border
+            return pos, depth
+        depth += 1 if text[pos] in "[{" else -1
+        pos += 1
+        if depth == 0:
+            return pos, 0
+
+
+def _value_end(text: str, pos: int) -> int:
+    """End position of the complete JSON value starting at ``pos``."""
+    char = text[pos]
+    if char in "[{":
+        end, depth = _scan(text, pos, 0)
+        if depth:
+            raise ValueError("Malformed COCO file: unterminated value")
+        return end
+    if char == '"':
+        return _STRING.match(text, pos).end()
+    match = _SCALAR_END.search(text, pos)
+    return match.start() if match else len(text)
+
+
+def field_spans(raw: str) -> Dict[str, Tuple[int, int]]:
+    """Maps every top-level key of a raw JSON object to the span of its value."""
+    spans = {}
+    pos = _WS.match(raw, raw.index("{") + 1).end()
+    if raw[pos] == "}":
+        return spans
+    while True:
+        key = _STRING.match(raw, pos)
+        pos = _WS.match(raw, key.end()).end()
+        if raw[pos] != ":":
+            raise ValueError("Malformed COCO file: expected ':' in record")
+        start = _WS.match(raw, pos + 1).end()
+        end = _value_end(raw, start)
+        spans[json.loads(key.group())] = (start, end)
+        pos = _WS.match(raw, end).end()
+        if raw[pos] == "}":
+            return spans
+        pos = _WS.match(raw, pos + 1).end()
+
+
+@lru_cache(maxsize=64)
+def _field_pattern(fields: Tuple[str, ...]) -> "re.Pattern":
+    keys = "|".join(re.escape(json.dumps(field)) for field in fields)
+    return re.compile(r'(?<!\\)(' + keys + r')\s*:\s*')
+
+
+def find_fields(raw: str, fields: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    """Spans of the values of ``fields`` in a raw JSON object.
+
+    Looks the keys up directly instead of walking the whole record, and falls
+    back to field_spans if a match might not be a top-level key.
+    """
+    fields = tuple(fields)
+    spans = {}
+    for match in _field_pattern(fields).finditer(raw):
+        prefix = raw[: match.start()]
+        if (
+            prefix.count("{") - prefix.count("}") != 1
+            or prefix.count("[") != prefix.count("]")
+        ):
+            # Nested key, or brackets inside strings; walk the record properly
+            all_spans = field_spans(raw)
+            return {field: all_spans[field] for field in fields if field in all_spans}
+        field = json.loads(match.group(1))
+        if field not in spans:
+            spans[field] = (match.end(), _value_end(raw, match.end()))
+            if len(spans) == len(fields):
+                break
+    return spans
+
+
+def project(raw: str, fields: Iterable[str], spans=None) -> Dict[str, Any]:
+    """Decodes only ``fields`` of a raw JSON object; missing fields are left out."""
+    spans = find_fields(raw, fields) if spans is None else spans
+    return {
+        field: serialization.loads(raw[spans[field][0] : spans[field][1]])
+        for field in fields
+        if field in spans
+    }
+
+
+def splice(raw: str, changes: Dict[str, Any], spans=None) -> RawJSON:
+    """Writes changed or new top-level fields into a raw JSON object.
+
+    ``spans`` are the value spans of (at least) the changed fields, as given
+    by find_fields. Untouched parts of the record, i.e. its polygons, are
+    kept byte for byte. New fields are appended after the last one.
+    """
+    spans = {} if spans is None else spans
+    missing = [field for field in changes if field not in spans]
+    if missing:
+        spans = {**spans, **find_fields(raw, missing)}
+    edits = []
+    appended = []
+    for field, value in changes.items():
+        if field in spans:
+            start, end = spans[field]
+            edits.append((start, end, serialization.dumps(value)))
+        else:
+            appended.append(
+                f"{serialization.dumps(field)}: {serialization.dumps(value)}"
+            )
+    if appended:
+        append_at = len(raw[: raw.rindex("}")].rstrip())
+        separator = "" if raw[append_at - 1] == "{" else ", "
+        edits.append((append_at, append_at, separator + ", ".join(appended)))
+
+    pieces = []
+    pos = 0
+    for start, end, text in sorted(edits, key=lambda edit: edit[0]):
+        pieces += [raw[pos:start], text]
+        pos = end
+    pieces.append(raw[pos:])
+    return RawJSON("".join(pieces))
+
+
+class _Buffer:
+    """Sliding text window over a file with helpers for the top-level walk."""
+
+    def __init__(self, f, chunk_size: int, track_bytes: bool = False):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        # Characters dropped from the front of buf so far
+        self.consumed = 0
+        # Byte offset of the character at buf[_mark], kept only if track_bytes
+        self.track_bytes = track_bytes
+        self._mark = 0
+        self._mark_bytes = 0
+
+    def byte_offset(self) -> int:
+        """Byte offset of the current position in the (decoded) file."""
+        self._mark_bytes += len(self.buf[self._mark : self.pos].encode("UTF-8"))
+        self._mark = self.pos
+        return self._mark_bytes
+
+    def fill(self) -> bool:
+        """Appends one more chunk; returns False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos > len(self.buf) // 2:
+            if self.track_bytes:
+                self.byte_offset()
+            self.buf = self.buf[self.pos :]
+            self.consumed += self.pos
+            self.pos = 0
+            self._mark = 0
+        self.buf += chunk
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or '' at end of file."""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f"Malformed COCO file: expected one of {chars!r}, got {char!r}"
+            )
+        self.pos += 1
+        return char
+
+    def decode(self) -> Any:
+        """Decodes the next complete JSON value, reading more text as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number cut at the chunk border decodes fine but is incomplete
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def skip(self) -> RawJSON:
+        """Returns the text of the next JSON value without decoding it."""
+        char = self.peek()
+        start = self.consumed + self.pos
+        if char not in "[{":
+            # Strings and numbers are cheap to decode and find the end reliably
+            self.decode()
+            return RawJSON(self.buf[start - self.consumed : self.pos])
+        pos, depth = self.pos, 0
+        while True:
+            pos, depth = _scan(self.buf, pos, depth)
+            if depth == 0:
+                break
+            offset = self.consumed + pos
+            if not self.fill():
+                raise ValueError("Malformed COCO file: unexpected end of file")
+            pos = offset - self.consumed
+        self.pos = pos
+        return RawJSON(self.buf[start - self.consumed : pos])
+
+
+def iter_events(
+    ann_path: str,
+    chunk_size: int = CHUNK_SIZE,
+    raw_sections: Iterable[str] = (),
+) -> Iterator[Tuple[str, str, Any]]:
+    """Walks the top-level COCO object and yields ``(section, event, value)``.
+
+    Array sections yield ``start_array``, one ``item`` per element and
+    ``end_array``; any other section yields a single ``value`` event.
+    Items and values of ``raw_sections`` are yielded undecoded, as RawJSON.
+    Closing the generator early stops reading the file.
+    """
+    raw_sections = frozenset(raw_sections)
+    walk = _walk(ann_path, chunk_size, False, raw_sections.__contains__)
+    for section, event, value, _, _ in walk:
+        yield section, event, value
+
+
+def iter_spans(
+    ann_path: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[str, str, Any, int, int]]:
+    """Like iter_events, but yields ``(section, event, value, start, end)``.
+
+    ``start`` and ``end`` are the byte offsets of the item or value in the
+    decompressed file, so ``loads(data[start:end])`` gives ``value`` back.
+    Array start and end events carry -1 offsets.
+    """
+    return _walk(ann_path, chunk_size, True)
+
+
+def _walk(
+    ann_path: str,
+    chunk_size: int,
+    track_bytes: bool,
+    is_raw: Callable[[str], bool] = lambda section: False,
+):
+    with serialization.open_file(ann_path, "rt") as f:
+        reader = _Buffer(f, chunk_size, track_bytes)
+        raw = False
+
+        def decode():
+            read = reader.skip if raw else reader.decode
+            if not track_bytes:
+                return read(), -1, -1
+            reader.peek()
+            start = reader.byte_offset()
+            value = read()
+            return value, start, reader.byte_offset()
+
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            section = reader.decode()
+            raw = is_raw(section)
+            reader.expect(":")
+            if reader.peek() == "[":
+                reader.expect("[")
+                yield section, START_ARRAY, None, -1, -1
+                if reader.peek() == "]":
+                    reader.expect("]")
+                else:
+                    while True:
+                        yield (section, ITEM) + decode()
+                        if reader.expect(",]") == "]":
+                            break
+                yield section, END_ARRAY, None, -1, -1
+            else:
+                yield (section, VALUE) + decode()
+            if reader.expect(",}") == "}":
+                return
+
+
+def iter_records(
+    ann_path: str, section: str, fields: Optional[Iterable[str]] = None
+) -> Iterator[Any]:
+    """Yields the records of one array section, i.e. ``images``, one by one.
+
+    Other sections are skipped without decoding them. With ``fields`` only
+    those fields of every record are decoded and yielded.
+    """
+    fields = None if fields is None else tuple(fields)
+    events = _walk(
+        ann_path,
+        CHUNK_SIZE,
+        False,
+        lambda name: name != section or fields is not None,
+    )
+    try:
+        for name, event, value, _, _ in events:
+            if name != section:
+                continue
+            if event == ITEM:
+                yield value if fields is None else project(value, fields)
+            elif event == END_ARRAY:
+                return
+            elif event == VALUE:
+                value = serialization.loads(value) if fields is not None else value
+                for record in value or []:
+                    yield record if fields is None else _pick(record, fields)
+                return
+    finally:
+        events.close()
+
+
+def _pick(record: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    return {field: record[field] for field in fields if field in record}
+
+
+def read_sections(
+    ann_path: str,
+    sections: Iterable[str],
+    default: Optional[Any] = None,
+    fields: Optional[Dict[str, Iterable[str]]] = None,
+) -> Dict[str, Any]:
+    """Loads the named sections and nothing else.
+
+    Other sections are skipped without decoding them, and the walk stops as
+    soon as every requested section was seen. ``fields`` maps a section to
+    the record fields to decode, i.e. ``{"images": ("id", "file_name")}``;
+    the other fields of those records are skipped as well.
+    """
+    wanted = set(sections)
+    fields = {name: tuple(names) for name, names in (fields or {}).items()}
+    result = {name: default for name in wanted}
+    seen = set()
+    events = _walk(
+        ann_path,
+        CHUNK_SIZE,
+        False,
+        lambda name: name not in wanted or name in fields,
+    )
+    try:
+        for name, event, value, _, _ in events:
+            if name not in wanted:
+                continue
+            if event == START_ARRAY:
+                result[name] = []
+            elif event == ITEM:
+                if name in fields:
+                    value = project(value, fields[name])
+                result[name].append(value)
+            else:
+                if event == VALUE:
+                    if name in fields:
+                        value = serialization.loads(value)
+                        if isinstance(value, list):
+                            value = [_pick(record, fields[name]) for record in value]
+                    result[name] = value
+                seen.add(name)
+                if seen == wanted:
+                    break
+    finally:
+        events.close()
+    return result
+
+
+def read_header(ann_path: str) -> Dict[str, Any]:
+    """Loads ``info``, ``licenses`` and ``categories`` without the big arrays."""
+    return read_sections(ann_path, ("info", "licenses", "categories"))
+
+
+class CocoWriter:
+    """Writes a COCO file section by section and record by record.
+
+    With ``compact=False`` the output is byte-identical to
+    ``json.dump(dataset, f, indent=indent, sort_keys=sort_keys)`` for the
+    same section order. ``compact=True`` drops indentation and key sorting,
+    which roughly halves write time and file size on large datasets.
+
+    The file is compressed as its suffix (``.gz``, ``.zst``) says, unless
+    ``compression`` is given explicitly.
+
+    Usage:
+        with CocoWriter(path, compact=True) as writer:
+            writer.write_value("categories", categories)
+            writer.write_array("images", iter_images())
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        compact: bool = False,
+        indent: int = 2,
+        sort_keys: bool = False,
+        compression: Optional[str] = "infer",
+    ):
+        self.file_path = file_path
+        self.compression = compression
+        self.indent = None if compact else indent
+        self.sort_keys = sort_keys and not compact
+        self.separators = (",", ":") if compact else (",", ": ")
+        self._file = None
+        self._n_sections = 0
+        self._n_items = 0
+
+    def __enter__(self) -> "CocoWriter":
+        self._file = serialization.open_file(
+            self.file_path, "wt", compression=self.compression
+        )
+        self._file.write("{")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._file.write(self._newline(0) + "}" if self._n_sections else "}")
+        self._file.close()
+
+    def _newline(self, level: int) -> str:
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * level)
+
+    def _dumps(self, value: Any, level: int) -> str:
+        if isinstance(value, RawJSON):
+            return value
+        text = serialization.dumps(
+            value,
+            indent=self.indent,
+            sort_keys=self.sort_keys,
+            compact=self.indent is None,
+        )
+        if self.indent is None:
+            return text
+        # Nested values are indented relative to their position in the file
+        return text.replace("\n", self._newline(level))
+
+    def _start_section(self, section: str) -> None:
+        if self._n_sections:
+            self._file.write(",")
+        self._file.write(
+            self._newline(1) + serialization.dumps(section) + self.separators[1]
+        )
+        self._n_sections += 1
+
+    def write_value(self, section: str, value: Any) -> None:
+        """Writes a whole section, i.e. ``info`` or ``categories``."""
+        self._start_section(section)
+        self._file.write(self._dumps(value, 1))
+
+    def begin_array(self, section: str) -> None:
+        """Opens an array section to be filled with write_record."""
+        self._start_section(section)
+        self._file.write("[")
+        self._n_items = 0
+
+    def format_record(self, record: Any) -> str:
+        """The text write_record emits for ``record``, without the separator.
+
+        Works on a writer that was never entered, so worker processes can
+        format records the way the final writer would.
+        """
+        return self._newline(2) + self._dumps(record, 2)
+
+    def write_record(self, record: Any) -> None:
+        """Appends one record to the array opened with begin_array."""
+        if self._n_items:
+            self._file.write(",")
+        self._file.write(self.format_record(record))
+        self._n_items += 1
+
+    def write_formatted(self, fragment: IO[str], count: int) -> None:
+        """Appends ``count`` records read from ``fragment``.
+
+        ``fragment`` holds the output of format_record for each record,
+        joined with ",", as written by a writer with the same settings.
+        """
+        if not count:
+            return
+        if self._n_items:
+            self._file.write(",")
+        shutil.copyfileobj(fragment, self._file)
+        self._n_items += count
+
+    def end_array(self) -> int:
+        """Closes the current array section and returns its record count."""
+        self._file.write(self._newline(1) + "]" if self._n_items else "]")
+        return self._n_items
+
+    def write_array(self, section: str, records: Iterable[Any]) -> int:
+        """Writes an array section from any iterable, i.e. a generator."""
+        self.begin_array(section)
+        for record in records:
+            self.write_record(record)
+        return self.end_array()
+
+
+def transform_coco(
+    ann_path: str,
+    out_path: str,
+    handlers: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    replace: Optional[Dict[str, Any]] = None,
+    compact: bool = False,
+    indent: int = 4,
+    chunk_size: int = CHUNK_SIZE,
+    fields: Optional[Dict[str, Iterable[str]]] = None,
+) -> None:
+    """Rewrites a COCO file in one streaming pass.
+
+    ``handlers`` maps a section name to a function applied to each record of
+    that section (or to the value of a non-array section). Returning None
+    from the handler drops the record. ``replace`` maps a section name to a
+    value written instead of the original section. Other sections are copied
+    as they are, keeping the original section order.
+
+    ``fields`` switches to pass-through mode and maps a section to the record
+    fields its handler needs, i.e. ``{"annotations": ("category_id",)}``.
+    Handlers of these sections get a dict of just those fields; changed or
+    added fields are spliced into the original record text. Sections without
+    a handler are copied verbatim, without being decoded or reformatted.
+
+    ``out_path`` may equal ``ann_path``; the result is written to a temporary
+    file next to it and moved into place at the end. Both paths may be
+    compressed, independently of each other.
+    """
+    handlers = handlers or {}
+    replace = replace or {}
+    if fields is not None:
+        fields = {name: tuple(names) for name, names in fields.items()}
+
+    def is_raw(section: str) -> bool:
+        if section in replace:
+            return True
+        if fields is None:
+            return False
+        return section in fields or section not in handlers
+
+    tmp_path = f"{out_path}.tmp"
+    with CocoWriter(
+        tmp_path,
+        compact=compact,
+        indent=indent,
+        compression=serialization.compression_of(out_path),
+    ) as writer:
+        walk = _walk(ann_path, chunk_size, False, is_raw)
+        for section, event, value, _, _ in walk:
+            handler = handlers.get(section)
+            if section in replace:
+                if event in (START_ARRAY, VALUE):
+                    writer.write_value(section, replace[section])
+            elif event == START_ARRAY:
+                writer.begin_array(section)
+            elif event == ITEM:
+                if handler is not None:
+                    if fields is not None and section in fields:
+                        value = _apply_to_fields(handler, value, fields[section])
+                    else:
+                        value = handler(value)
+                    if value is None:
+                        continue
+                writer.write_record(value)
+            elif event == END_ARRAY:
+                writer.end_array()
+            else:
+                if handler is not None:
+                    if isinstance(value, RawJSON):
+                        value = serialization.loads(value)
+                    value = handler(value)
+                writer.write_value(section, value)
+    os.replace(tmp_path, out_path)
+
+
+def _apply_to_fields(
+    handler: Callable[[Any], Any], raw: RawJSON, fields: Tuple[str, ...]
+) -> Optional[RawJSON]:
+    """Runs ``handler`` on the projected ``fields`` of a raw record."""
+    spans = find_fields(raw, fields)
+    projected = project(raw, fields, spans)
+    result = handler(dict(projected))
+    if result is None:
+        return None
+    changes = {
+        field: value
+        for field, value in result.items()
+        if field not in projected or projected[field] != value
+    }
+    return splice(raw, changes, spans) if changes else raw
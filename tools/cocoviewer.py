@@ -4,7 +4,6 @@
 View images with bboxes from the COCO dataset.
 """
 import colorsys
-import json
 import logging
 import os
 import random
@@ -16,16 +15,21 @@ from turtle import __forwardmethods
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageTk
 
+from tools import coco_delta
+from tools.coco_index import CocoIndex
+
 
 class Data:
     """Handles data related stuff."""
 
     def __init__(self, image_dir, annotations_file):
         self.image_dir = image_dir
-        instances, images, categories = parse_coco(annotations_file)
-        self.instances = instances
+        # The cached index lists images and categories without parsing the JSON,
+        # and reads the annotations of the current image by their byte offsets
+        self.index = CocoIndex.from_file(annotations_file)
+        images = list(zip(self.index.img_ids.tolist(), self.index.file_names))
         self.images = ImageList(images)  # NOTE: image list is based on annotations file
-        self.categories = categories  # Dataset categories
+        self.categories = get_categories({"categories": self.index.categories})
 
         # Prepare the very first image
         self.current_image = self.images.next()  # Set the first image as current
@@ -37,9 +41,7 @@ class Data:
         full_path = os.path.join(self.image_dir, img_name)
 
         # Get objects and category ids
-        objects = [
-            obj for obj in self.instances["annotations"] if obj["image_id"] == img_id
-        ]
+        objects = self.index.anns_for_image(img_id)
         obj_categories_ids = [obj["category_id"] for obj in objects]
 
         # List of category ids of all objects
@@ -86,8 +88,7 @@ def load_annotations(fname: str) -> dict:
     """Loads annotations file."""
     logging.info(f"Parsing {fname}...")
 
-    with open(fname) as f:
-        instances = json.load(f)
+    instances = coco_delta.load(fname)
     return instances
 
 
@@ -665,7 +666,7 @@ class Controller:
         )
         self.file_name_status.set(f"{self.data.current_image[-1]}")
         self.description_status.set(
-            f"{self.data.instances.get('info', {}).get('description', '')}"
+            f"{(self.data.index.info or {}).get('description', '')}"
         )
         self.nobjects_status.set(f"objects: {len(self.current_img_obj_categories)}")
         self.ncategories_status.set(f"categories: {len(self.current_img_categories)}")
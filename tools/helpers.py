@@ -4,11 +4,11 @@ import numpy as np
 from pathlib import Path
 from PIL import Image
 from typing import Dict, List
-import json
-import funcy
-from pycocotools.coco import COCO
 import shutil
 
+from tools.coco_index import CocoIndex
+from tools.coco_stream import CocoWriter, iter_records, transform_coco
+
 
 def load(path: str) -> List[str]:
     """load files
@@ -55,32 +55,26 @@ def palette2mask(ann: str, conv: Dict[int, List[int]]) -> np.ndarray:
     return drawing
 
 
-def save_coco(file, info, licenses, images, annotations, categories):
-    with open(file, "wt", encoding="UTF-8") as coco:
-        json.dump(
-            {
-                "info": info,
-                "licenses": licenses,
-                "images": images,
-                "annotations": annotations,
-                "categories": categories,
-            },
-            coco,
-            indent=2,
-            sort_keys=True,
-        )
-
-
-def filter_annotations(annotations, images):
-    image_ids = funcy.lmap(lambda i: int(i["id"]), images)
-    return funcy.lfilter(lambda a: int(a["image_id"]) in image_ids, annotations)
-
-
-def filter_images(images, annotations):
+def save_coco(file, info, licenses, images, annotations, categories, compact=False):
+    """Writes a COCO file; images and annotations may be any iterable.
 
-    annotation_ids = funcy.lmap(lambda i: int(i["image_id"]), annotations)
-
-    return funcy.lfilter(lambda a: int(a["id"]) in annotation_ids, images)
+    The default output matches json.dump(indent=2, sort_keys=True). With
+    ``compact`` records are written without indentation or key sorting.
+    A ``.gz`` or ``.zst`` suffix on ``file`` compresses the output.
+    """
+    sections = {
+        "info": info,
+        "licenses": licenses,
+        "images": images,
+        "annotations": annotations,
+        "categories": categories,
+    }
+    with CocoWriter(file, compact=compact, sort_keys=True) as coco:
+        for name in sections if compact else sorted(sections):
+            if name in ("images", "annotations"):
+                coco.write_array(name, sections[name])
+            else:
+                coco.write_value(name, sections[name])
 
 
 def locate_images(source: str, destination: str) -> None:
@@ -120,39 +114,26 @@ def has_segmentation_data(ann_path: str) -> bool:
     """
     Checks if the COCO annotation file contains segmentation data.
     """
-    coco = COCO(ann_path)
-    catIds = coco.getCatIds()
-    imgIds = coco.getImgIds()
-    for imgId in imgIds:
-        annIds = coco.getAnnIds(imgIds=imgId, catIds=catIds, iscrowd=None)
-        anns = coco.loadAnns(annIds)
-        for ann in anns:
-            if "segmentation" in ann and any(ann["segmentation"]):
-                # segmentation exists and it's not empty, then return True.
-                return True
-    return False
+    return CocoIndex.from_file(ann_path).has_segmentation()
 
 
 def check_coco_sanity(coco_path: str):
-    flag = False
-    coco_file = COCO(coco_path)
+    # Look for empty segmentations first; most files need no rewrite at all
+    flag = any(
+        "segmentation" in ann and ann["segmentation"] == [[]]
+        for ann in iter_records(coco_path, "annotations")
+    )
 
-    # Load annotations
-    annotations = coco_file.dataset["annotations"]
+    if flag:
 
-    # Iterate over annotations
-    for i, ann in enumerate(annotations):
-        # Check if the 'segmentation' key exists and if it's empty
-        if "segmentation" in ann and ann["segmentation"] == [[]]:
+        def fix_segmentation(ann):
             # Replace empty segmentation with an empty list
-            annotations[i]["segmentation"] = []
-            flag = True
-
-    if flag:
-        # Update the COCO dataset
-        coco_file.dataset["annotations"] = annotations
+            if "segmentation" in ann and ann["segmentation"] == [[]]:
+                ann["segmentation"] = []
+            return ann
 
         # Save the updated COCO file
-        with open(coco_path, "w") as f:
-            print(f"Rewrite file at {coco_path}")
-            json.dump(coco_file.dataset, f)
+        print(f"Rewrite file at {coco_path}")
+        transform_coco(
+            coco_path, coco_path, {"annotations": fix_segmentation}, compact=True
+        )
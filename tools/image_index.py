@@ -0,0 +1,141 @@
+"""
+Duplicate detection of incoming images against existing splits.
+
+``update`` adds a new batch to train and val. A re-labelled batch can hold
+images that are already in one of them, which would then be counted twice
+or leak from val into train. ``ImageIndex`` keeps two maps over the
+existing images, from base name and from content digest to the split that
+holds them, and classifies every new image with two lookups:
+
+- new: neither its name nor its content is known
+- duplicate: same content as an existing image, under any name
+- conflicting: same name as an existing image, different content
+
+Digests are computed in a thread pool. Those of the existing images are
+cached next to each image folder (``train_images.digests.json``), keyed on
+file size and modification time, so that only added or changed files are
+read again on the next update.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from tools import serialization
+from tools.transfer import DEFAULT_WORKERS, file_digest
+
+NEW = "new"
+DUPLICATE = "duplicate"
+CONFLICTING = "conflicting"
+
+
+def cache_path(img_dir: str) -> str:
+    """Digest cache of ``img_dir``, i.e. ``train_images.digests.json``."""
+    return os.path.normpath(img_dir) + ".digests.json"
+
+
+def image_digests(
+    img_dir: str,
+    file_names: Iterable[str],
+    max_workers: int = DEFAULT_WORKERS,
+    use_cache: bool = True,
+) -> Dict[str, str]:
+    """Content digests of the named files in ``img_dir``.
+
+    Missing files are left out. With ``use_cache`` the digests are read
+    through the cache, which is rewritten when digests were computed and
+    ignored if it cannot be read.
+
+    Returns:
+        Dict[str, str]: base name to hex digest
+    """
+    path = cache_path(img_dir)
+    cache = {}
+    if use_cache and os.path.isfile(path):
+        try:
+            cache = serialization.load(path)
+        except ValueError:
+            pass
+
+    digests, stale, stats = {}, [], {}
+    for name in {os.path.basename(f) for f in file_names}:
+        try:
+            stat = os.stat(os.path.join(img_dir, name))
+        except FileNotFoundError:
+            continue
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+        entry = cache.get(name)
+        if entry is not None and entry[:2] == stats[name]:
+            digests[name] = entry[2]
+        else:
+            stale.append(name)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            paths = [os.path.join(img_dir, name) for name in stale]
+            for name, digest in zip(stale, pool.map(file_digest, paths)):
+                digests[name] = digest
+                cache[name] = stats[name] + [digest]
+        if use_cache:
+            serialization.dump(cache, path)
+    return digests
+
+
+class Match(NamedTuple):
+    """Classification of one new image."""
+
+    status: str
+    # Split and base name of the existing image it matches, if any
+    split: Optional[str] = None
+    file_name: Optional[str] = None
+
+
+class ImageIndex:
+    """Base names and content digests of the images of existing splits."""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self.max_workers = max_workers
+        self.by_name: Dict[str, tuple] = {}
+        self.by_digest: Dict[str, tuple] = {}
+
+    def add(
+        self, split: str, file_names: Iterable[str], img_dir: Optional[str] = None
+    ) -> None:
+        """Indexes the images of ``split``; without ``img_dir`` by name only."""
+        names = [os.path.basename(f) for f in file_names]
+        digests = {}
+        if img_dir and os.path.isdir(img_dir):
+            digests = image_digests(img_dir, names, self.max_workers)
+        for name in names:
+            digest = digests.get(name)
+            self.by_name.setdefault(name, (split, digest))
+            if digest is not None:
+                self.by_digest.setdefault(digest, (split, name))
+
+    def classify(
+        self, file_names: List[str], img_dir: Optional[str] = None
+    ) -> List[Match]:
+        """Classifies new images as new, duplicate or conflicting.
+
+        Without ``img_dir``, or for images whose content is unknown on either
+        side, a known name counts as a duplicate. New images are hashed
+        without a cache; they are usually seen once.
+        """
+        names = [os.path.basename(f) for f in file_names]
+        digests = {}
+        if img_dir and os.path.isdir(img_dir):
+            digests = image_digests(img_dir, names, self.max_workers, use_cache=False)
+
+        matches = []
+        for name in names:
+            digest = digests.get(name)
+            if digest is not None and digest in self.by_digest:
+                matches.append(Match(DUPLICATE, *self.by_digest[digest]))
+            elif name in self.by_name:
+                split, existing = self.by_name[name]
+                conflicting = digest is not None and existing is not None
+                status = CONFLICTING if conflicting else DUPLICATE
+                matches.append(Match(status, split, name))
+            else:
+                matches.append(Match(NEW))
+        return matches
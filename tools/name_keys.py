@@ -0,0 +1,148 @@
+"""
+Matching image file names against many name keys at once.
+
+separate_by_name routes every image to the keys found in its file name. A
+key is one of:
+- ``cam1``: a substring of the file name
+- ``cam1=re:^cam1_\\d+``: a regular expression searched in the file name
+- ``cam1=glob:cam1_*.jpg``: a shell pattern matching the whole file name
+
+Regex and glob keys are named by the part before ``=``.
+
+Substring keys are matched in one pass: all file names are joined into one
+string and searched with a single compiled regex of the keys, nested by
+common prefixes like a trie and wrapped in a lookahead so that matches at
+every position are reported. At each position the regex reports the
+longest key starting there; the keys contained in it are found through a
+precomputed closure. Regex and glob keys are compiled once and run per file
+name.
+"""
+
+import fnmatch
+import re
+from typing import List, Tuple
+
+import numpy as np
+
+SEPARATOR = "\n"
+
+
+class NameMatcher:
+    """Finds which of ``keys`` occur in each file name."""
+
+    def __init__(self, keys: List[str]):
+        self.labels, substrings, self.patterns = [], [], []
+        for k, key in enumerate(keys):
+            label, kind, pattern = _parse(key)
+            if label in self.labels:
+                raise ValueError(f"Duplicate name key {label}")
+            self.labels.append(label)
+            if kind == "re":
+                self.patterns.append((k, re.compile(pattern).search))
+            elif kind == "glob":
+                self.patterns.append((k, re.compile(fnmatch.translate(pattern)).match))
+            else:
+                substrings.append((k, pattern))
+
+        self.substring_ids = np.array([k for k, _ in substrings], dtype=np.int64)
+        self.substrings = None
+        if substrings:
+            texts = [text for _, text in substrings]
+            self.substrings = re.compile(f"(?=({_trie_pattern(texts)}))")
+            self.text_ids = {text: i for i, text in enumerate(texts)}
+            # Substring keys contained in each substring key, itself included
+            self.contained = [
+                [j for j, other in enumerate(texts) if other in text] for text in texts
+            ]
+
+    def match(self, file_names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """All (file name position, key position) pairs with a match.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: positions into ``file_names`` and
+                ``labels``, sorted by key and then by file name
+        """
+        names, keys = [], []
+        if self.substrings is not None and file_names:
+            blob = SEPARATOR.join(file_names)
+            if blob.count(SEPARATOR) != len(file_names) - 1:
+                raise ValueError("File names must not contain line breaks")
+            lengths = np.fromiter(map(len, file_names), dtype=np.int64)
+            ends = np.cumsum(lengths + len(SEPARATOR))
+            positions, groups = [], []
+            text_ids = self.text_ids
+            for m in self.substrings.finditer(blob):
+                positions.append(m.start())
+                groups.append(text_ids[m.group(1)])
+            positions = np.array(positions, dtype=np.int64)
+            name_pos = np.searchsorted(ends, positions, side="right")
+            # Expand every match to the keys it contains
+            contained = self.contained
+            sizes = np.fromiter((len(c) for c in contained), dtype=np.int64)
+            flat = np.fromiter(
+                (j for c in contained for j in c),
+                dtype=np.int64,
+                count=int(sizes.sum()),
+            )
+            starts = np.cumsum(sizes) - sizes
+            groups = np.array(groups, dtype=np.int64)
+            counts = sizes[groups]
+            run = np.repeat(starts[groups] - np.cumsum(counts) + counts, counts)
+            names.append(np.repeat(name_pos, counts))
+            keys.append(self.substring_ids[flat[run + np.arange(int(counts.sum()))]])
+
+        for k, matches in self.patterns:
+            hits = np.array(
+                [i for i, name in enumerate(file_names) if matches(name)],
+                dtype=np.int64,
+            )
+            names.append(hits)
+            keys.append(np.full(len(hits), k, dtype=np.int64))
+
+        if not names:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # One integer per pair sorts by key, then by file name
+        pairs = np.sort(np.concatenate(keys) * len(file_names) + np.concatenate(names))
+        first = np.ones(len(pairs), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        pairs = pairs[first]
+        return pairs % len(file_names), pairs // len(file_names)
+
+
+def _trie_pattern(texts: List[str]) -> str:
+    """Regex matching any of ``texts``, the longest one where several could.
+
+    The alternatives are nested by common prefixes, so that the engine
+    discards a position after one character instead of trying every key.
+    """
+    trie = {}
+    for text in texts:
+        node = trie
+        for char in text:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def pattern(node: dict) -> str:
+        branches = [re.escape(c) + pattern(child) for c, child in node.items() if c]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # Greedy: a longer key is tried before the key ending here
+        return f"(?:{body})?" if "" in node else body
+
+    return pattern(trie)
+
+
+def _parse(key: str) -> Tuple[str, str, str]:
+    """Splits a name key into its label, kind and pattern."""
+    label, sep, rest = key.partition("=")
+    for kind in ("re", "glob"):
+        if sep and rest.startswith(kind + ":"):
+            if not label:
+                raise ValueError(f"Name key {key} needs a name before '='")
+            return label, kind, rest[len(kind) + 1 :]
+    if key.startswith(("re:", "glob:")):
+        raise ValueError(f"Name key {key} needs a name, i.e. cam1={key}")
+    if not key or SEPARATOR in key:
+        raise ValueError(f"Invalid name key {key!r}")
+    return key, "substring", key
@@ -0,0 +1,56 @@
+"""
+Relational helpers over lists of COCO records.
+
+Records are joined on integer id columns extracted into NumPy arrays, so
+every join is a sort/hash based ``np.isin`` or ``np.searchsorted`` pass
+instead of a Python membership test against a list.
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+
+def key_array(records: Sequence[dict], key: str = "id") -> np.ndarray:
+    """Extracts the integer ``key`` column of ``records``."""
+    return np.fromiter(
+        (int(record[key]) for record in records), dtype=np.int64, count=len(records)
+    )
+
+
+def _as_ids(ids) -> np.ndarray:
+    """Accepts either an id array/list or a list of records carrying ``id``."""
+    if len(ids) and isinstance(ids[0], dict):
+        return key_array(ids, "id")
+    return np.asarray(ids, dtype=np.int64).reshape(-1)
+
+
+def semi_join(records: Sequence[dict], key: str, ids) -> List[dict]:
+    """Records whose ``key`` is in ``ids``, in their original order.
+
+    Args:
+        records (Sequence[dict]): COCO records, i.e. images or annotations
+        key (str): integer field of the records to join on
+        ids: ids to keep, or records whose ``id`` should be kept
+
+    Returns:
+        List[dict]: matching records
+    """
+    mask = np.isin(key_array(records, key), _as_ids(ids))
+    return [records[i] for i in np.flatnonzero(mask)]
+
+
+def anti_join(records: Sequence[dict], key: str, ids) -> List[dict]:
+    """Records whose ``key`` is not in ``ids``, in their original order.
+
+    Args:
+        records (Sequence[dict]): COCO records, i.e. images or annotations
+        key (str): integer field of the records to join on
+        ids: ids to drop, or records whose ``id`` should be dropped
+
+    Returns:
+        List[dict]: remaining records
+    """
+    mask = np.isin(key_array(records, key), _as_ids(ids), invert=True)
+    return [records[i] for i in np.flatnonzero(mask)]
+
@@ -0,0 +1,173 @@
+"""
+JSON serialization used by every reader and writer of the project.
+
+Parsing and writing annotation files dominates the run time of split, delete,
+process and check_coco_sanity, so the fastest installed backend is used:
+orjson, then ujson, then the standard library. The backend can be forced with
+the ``CVOPS_JSON_BACKEND`` environment variable (``orjson``, ``ujson`` or
+``json``).
+
+Indented output always goes through the standard library, since the fast
+backends format floats and non-ASCII text differently and pretty files are
+expected to stay byte-identical to ``json.dump``. Compact output, where only
+the parsed content matters, uses the fast backend.
+
+Paths ending in ``.gz`` or ``.zst`` are (de)compressed on the fly by
+``open_file``, so every reader and writer built on it accepts
+``annotations.json.gz`` and ``annotations.json.zst`` as well. zstd support
+needs the optional ``zstandard`` package.
+"""
+
+import gzip
+import json
+import os
+from typing import IO, Any, Optional, Tuple
+
+JSONDecodeError = json.JSONDecodeError
+
+_PREFERRED = ("orjson", "ujson", "json")
+
+# File suffix -> compression
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _select_backend(name: Optional[str]):
+    candidates = [name] if name else _PREFERRED
+    for candidate in candidates:
+        if candidate == "json":
+            return "json", json
+        try:
+            return candidate, __import__(candidate)
+        except ImportError:
+            continue
+    return "json", json
+
+
+BACKEND, _backend = _select_backend(os.environ.get("CVOPS_JSON_BACKEND"))
+
+
+def compression_of(file_path: str) -> Optional[str]:
+    """Compression implied by the suffix of ``file_path``, or None."""
+    return COMPRESSIONS.get(os.path.splitext(file_path)[1].lower())
+
+
+def split_ext(file_path: str) -> Tuple[str, str]:
+    """Splits ``file_path`` into root and extension, keeping compression suffixes.
+
+    Example:
+        split_ext("data/train.json.gz") -> ("data/train", ".json.gz")
+    """
+    root, ext = os.path.splitext(file_path)
+    if ext.lower() in COMPRESSIONS:
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return root, ext
+
+
+def open_file(
+    file_path: str, mode: str = "rt", compression: Optional[str] = "infer"
+) -> IO:
+    """Opens a plain, gzip or zstd file, streaming (de)compression as it goes.
+
+    Args:
+        file_path (str): path to open
+        mode (str): one of "rt", "wt", "rb", "wb"
+        compression (Optional[str]): "gzip", "zstd", None for a plain file,
+            or "infer" to decide by the suffix of ``file_path``
+    """
+    if compression == "infer":
+        compression = compression_of(file_path)
+    text = {"encoding": "UTF-8"} if "t" in mode else {}
+    if text and "r" in mode:
+        # Keep line endings as they are, so text offsets map to file bytes
+        text["newline"] = ""
+    if compression is None:
+        return open(file_path, mode, **text)
+    if compression == "gzip":
+        if "w" in mode:
+            return gzip.open(file_path, mode, compresslevel=GZIP_LEVEL, **text)
+        return gzip.open(file_path, mode, **text)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                f"Reading or writing {file_path} needs the zstandard package: "
+                "pip install zstandard"
+            )
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if "w" in mode else None
+        return zstandard.open(file_path, mode, cctx=cctx, **text)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def loads(data) -> Any:
+    """Parses a JSON document given as str or bytes.
+
+    Raises:
+        JSONDecodeError: if ``data`` is not valid JSON, whatever the backend.
+    """
+    if BACKEND == "json":
+        return json.loads(data)
+    try:
+        return _backend.loads(data)
+    except JSONDecodeError:
+        raise
+    except ValueError as e:
+        # ujson raises plain ValueErrors
+        raise JSONDecodeError(str(e), data if isinstance(data, str) else "", 0)
+
+
+def load(file_path: str) -> Any:
+    """Parses a JSON file, compressed or not."""
+    with open_file(file_path, "rb") as f:
+        data = f.read()
+    if BACKEND == "json":
+        return json.loads(data.decode("UTF-8"))
+    return loads(data)
+
+
+def dumps(
+    value: Any,
+    indent: Optional[int] = None,
+    sort_keys: bool = False,
+    compact: bool = False,
+) -> str:
+    """Serializes ``value`` to a JSON string.
+
+    With ``compact=True`` the output has no whitespace and is produced by the
+    fast backend. Otherwise it equals ``json.dumps(value, indent=indent,
+    sort_keys=sort_keys)``.
+    """
+    if not compact or BACKEND == "json":
+        separators = (",", ":") if compact else None
+        return json.dumps(
+            value, indent=indent, sort_keys=sort_keys, separators=separators
+        )
+    try:
+        if BACKEND == "orjson":
+            option = _backend.OPT_SORT_KEYS if sort_keys else 0
+            return _backend.dumps(value, option=option).decode("UTF-8")
+        return _backend.dumps(
+            value,
+            sort_keys=sort_keys,
+            ensure_ascii=False,
+            escape_forward_slashes=False,
+        )
+    except (TypeError, ValueError, OverflowError):
+        # Values the fast backend refuses, i.e. integers beyond 64 bits
+        return json.dumps(value, sort_keys=sort_keys, separators=(",", ":"))
+
+
+def dump(
+    value: Any,
+    file_path: str,
+    indent: Optional[int] = None,
+    sort_keys: bool = False,
+    compact: bool = False,
+) -> None:
+    """Writes ``value`` to ``file_path``, see ``dumps`` for the options."""
+    text = dumps(value, indent=indent, sort_keys=sort_keys, compact=compact)
+    with open_file(file_path, "wt") as f:
+        f.write(text)
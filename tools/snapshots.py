@@ -0,0 +1,186 @@
+"""
+Content-addressed store for dataset snapshots.
+
+Every update run writes ``results/<epoch>/`` and every postupdate writes
+``processed_results/<epoch>/``, each with all images of the dataset. Most
+of those images are the same from one run to the next. The store keeps each
+distinct file once, named by its content hash, and describes a snapshot by a
+manifest mapping relative paths to hashes.
+
+Layout:
+    .cvops-store/
+    ├── objects/
+    │   └── 3f/
+    │       └── 9a1c...           # file content, named by its blake2b digest
+    └── snapshots/
+        └── <name>.json           # {"files": {"train_images/a.jpg": "3f9a1c...", ...}}
+
+Snapshotted directories are relinked to the stored objects (hardlinks, so
+the files stay where they are but take no extra space). Checkouts place the
+objects back into any directory as links or copies. Hardlinked files share
+their content with the store: edit a copy, never a link.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple, Union
+
+from tools import serialization
+from tools.transfer import (
+    DEFAULT_WORKERS,
+    Placement,
+    file_digest,
+    place_file,
+    transfer,
+)
+
+STORE_DIR = ".cvops-store"
+SNAPSHOT_FORMAT = "cvops-snapshot"
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """Objects and snapshot manifests under ``root``."""
+
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def manifest_path(self, name: str) -> str:
+        return os.path.join(self.snapshots_dir, f"{name}.json")
+
+    def snapshots(self) -> List[str]:
+        """Names of the stored snapshots, oldest first."""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        names = [
+            os.path.splitext(f)[0]
+            for f in os.listdir(self.snapshots_dir)
+            if f.endswith(".json")
+        ]
+        return sorted(names, key=lambda n: (os.path.getmtime(self.manifest_path(n)), n))
+
+    def load_manifest(self, name: str) -> Dict[str, Any]:
+        path = self.manifest_path(name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No snapshot named {name} in {self.root}")
+        manifest = serialization.load(path)
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path} is not a cvops snapshot manifest")
+        return manifest
+
+    def _store(self, path: str, digest: str) -> bool:
+        """Makes ``path`` a link to its object; True if the object is new."""
+        obj = self.object_path(digest)
+        if os.path.exists(obj):
+            # Known content: drop the duplicate and link the stored object
+            place_file(obj, path, Placement.hardlink)
+            return False
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        place_file(path, obj, Placement.hardlink)
+        return True
+
+    def snapshot(
+        self, directory: str, name: str, max_workers: int = DEFAULT_WORKERS
+    ) -> Dict[str, Any]:
+        """Stores every file under ``directory`` and writes a manifest ``name``.
+
+        Files are hashed in a thread pool. Files with content already in the
+        store are replaced by hardlinks to the stored objects.
+
+        Returns:
+            Dict[str, Any]: the manifest, with the number of new objects and
+                their size under ``new_objects`` and ``new_bytes``
+        """
+        if os.path.exists(self.manifest_path(name)):
+            raise FileExistsError(f"Snapshot {name} already exists in {self.root}")
+        paths = sorted(
+            os.path.join(dirpath, f)
+            for dirpath, _, files in os.walk(directory)
+            for f in files
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            digests = list(pool.map(file_digest, paths))
+
+        files, sizes = {}, {}
+        new_objects = new_bytes = 0
+        for path, digest in zip(paths, digests):
+            rel_path = os.path.relpath(path, directory).replace(os.sep, "/")
+            files[rel_path] = digest
+            sizes[digest] = os.path.getsize(path)
+            # Identical files within the snapshot are handled by the check
+            if self._store(path, digest):
+                new_objects += 1
+                new_bytes += sizes[digest]
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "name": name,
+            "created": time.ctime(),
+            "source": os.path.abspath(directory),
+            "files": files,
+            "size": sum(sizes[d] for d in files.values()),
+        }
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        serialization.dump(manifest, self.manifest_path(name), indent=2)
+        return {**manifest, "new_objects": new_objects, "new_bytes": new_bytes}
+
+    def checkout(
+        self,
+        name: str,
+        target: str,
+        placement: Union[Placement, str] = Placement.hardlink,
+    ) -> int:
+        """Places the files of snapshot ``name`` under ``target``.
+
+        Returns:
+            int: number of files placed
+        """
+        manifest = self.load_manifest(name)
+        stats = transfer(
+            (
+                (self.object_path(digest), os.path.join(target, *rel_path.split("/")))
+                for rel_path, digest in manifest["files"].items()
+            ),
+            placement=placement,
+            desc=f"Checking out {name}",
+        )
+        if stats.failed:
+            raise OSError(f"Could not check out {len(stats.failed)} files of {name}")
+        return stats.files
+
+    def remove(self, name: str) -> None:
+        """Deletes the manifest of a snapshot; its objects stay until gc."""
+        self.load_manifest(name)
+        os.remove(self.manifest_path(name))
+
+    def gc(self) -> Tuple[int, int]:
+        """Deletes objects no snapshot refers to.
+
+        Returns:
+            Tuple[int, int]: number and total size of the deleted objects
+        """
+        referenced = set()
+        for name in self.snapshots():
+            referenced.update(self.load_manifest(name)["files"].values())
+
+        removed = freed = 0
+        if not os.path.isdir(self.objects_dir):
+            return removed, freed
+        for fanout in os.listdir(self.objects_dir):
+            fanout_dir = os.path.join(self.objects_dir, fanout)
+            for rest in os.listdir(fanout_dir):
+                if fanout + rest not in referenced:
+                    path = os.path.join(fanout_dir, rest)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+            if not os.listdir(fanout_dir):
+                os.rmdir(fanout_dir)
+        return removed, freed
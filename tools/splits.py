@@ -0,0 +1,322 @@
+"""
+Train/val assignment of images for split and update.
+
+Frames of one camera or greenhouse row look alike. Split image by image,
+they land on both sides and val no longer measures generalization. A group
+split keeps every group on one side. Groups come from the file name, i.e.
+``--group-by "^(cam\\d+)_"``, or from an image field, i.e.
+``--group-by field:video_id``.
+
+Groups are numbered with one np.unique over the keys, shuffled with a
+seeded generator and given to train until the running image count comes
+closest to the ratio. Everything after the keys is vectorized, so the cost
+is linear in the number of images.
+
+A hashed split places every image by a stable hash of its file name, or
+group key, and the seed: an image lands on the same side on every run and
+in every update, and each image is placed on its own, so the file can be
+streamed. The share of train is the ratio on average, not exactly.
+
+A stratified split keeps the share of every category close to the ratio on
+both sides, rare ones included. It runs iterative stratification (Sechidis
+et al., 2011) on a sparse image x category count matrix: the category with
+the fewest unassigned images goes first, and its images are divided
+between the sides by what each side still needs of it. Images are handled
+one category at a time with sparse column slices instead of one by one, so
+the loop runs once per category whatever the number of images.
+
+K-fold cross-validation assigns every image a fold in one array. Plain and
+grouped folds are cut from one shuffle, like the group split; stratified
+folds run the same iterative stratification with K equal shares instead of
+two.
+"""
+
+import hashlib
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+FIELD_PREFIX = "field:"
+TRAIN, VAL = 0, 1
+
+
+def group_keys(images: Sequence[dict], group_by: str) -> List[str]:
+    """Group key of every image.
+
+    ``field:<name>`` reads an image field. Anything else is a regex searched
+    in ``file_name``; its first group, or the whole match if it has none, is
+    the key. Images without the field, or that the regex does not match,
+    form groups of their own.
+    """
+    if group_by.startswith(FIELD_PREFIX):
+        field = group_by[len(FIELD_PREFIX) :]
+        return [
+            str(img[field]) if img.get(field) is not None else f"\0{img['file_name']}"
+            for img in images
+        ]
+    pattern = re.compile(group_by)
+    group = 1 if pattern.groups else 0
+    keys = []
+    for img in images:
+        m = pattern.search(img["file_name"])
+        keys.append(m.group(group) if m else f"\0{img['file_name']}")
+    return keys
+
+
+def group_split(
+    keys: Sequence[str],
+    train_size: float,
+    seed: Optional[int] = None,
+    pinned: Optional[Dict[str, int]] = None,
+) -> np.ndarray:
+    """Assigns whole groups to train or val.
+
+    Args:
+        keys (Sequence[str]): group key of every image, see group_keys
+        train_size (float): share of the images to put in train
+        seed (Optional[int]): seed of the group shuffle; random if None
+        pinned (Optional[Dict[str, int]]): groups with a fixed side, TRAIN or
+            VAL, i.e. the groups already in existing splits
+
+    Returns:
+        np.ndarray: True for the images that go to train
+    """
+    if not 0 < train_size < 1:
+        raise ValueError(f"train_size must be in (0, 1), got {train_size}")
+    if len(keys) == 0:
+        return np.zeros(0, dtype=bool)
+    groups, inverse = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+    sizes = np.bincount(inverse, minlength=len(groups))
+
+    side = np.full(len(groups), -1, dtype=np.int64)
+    if pinned:
+        pinned_keys = np.asarray(list(pinned), dtype=str)
+        pos = np.clip(np.searchsorted(groups, pinned_keys), 0, len(groups) - 1)
+        found = groups[pos] == pinned_keys
+        side[pos[found]] = np.fromiter(pinned.values(), dtype=np.int64)[found]
+
+    # Free groups in random order; train takes the prefix whose image count
+    # is closest to what train still needs
+    target = train_size * len(keys) - sizes[side == TRAIN].sum()
+    order = np.random.default_rng(seed).permutation(np.flatnonzero(side < 0))
+    running = np.concatenate([[0], np.cumsum(sizes[order])])
+    n_train = int(np.argmin(np.abs(running - target)))
+    side[order[:n_train]] = TRAIN
+    side[order[n_train:]] = VAL
+    return side[inverse] == TRAIN
+
+
+def hash_split(
+    keys: Iterable[str], train_size: float, seed: Optional[int] = None
+) -> np.ndarray:
+    """Assigns every key to train or val by its blake2b digest and the seed.
+
+    Returns:
+        np.ndarray: True for the keys that go to train
+    """
+    if not 0 < train_size < 1:
+        raise ValueError(f"train_size must be in (0, 1), got {train_size}")
+    salt = b"" if seed is None else f"{seed}:".encode()
+    digests = np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(salt + key.encode("UTF-8"), digest_size=8).digest(),
+                "big",
+            )
+            for key in keys
+        ),
+        dtype=np.uint64,
+    )
+    # The top 53 bits as a uniform float in [0, 1)
+    return (digests >> np.uint64(11)) * 2.0**-53 < train_size
+
+
+def count_matrix(
+    img_ids: np.ndarray, ann_img_ids: np.ndarray, ann_cat_ids: np.ndarray
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Number of annotations of every category on every image.
+
+    Annotations of images not in ``img_ids`` are left out.
+
+    Returns:
+        Tuple[sparse.csr_matrix, np.ndarray]: the image x category counts,
+            rows in the order of ``img_ids``, and the category id of every
+            column
+    """
+    img_ids = np.asarray(img_ids, dtype=np.int64)
+    ann_img_ids = np.asarray(ann_img_ids, dtype=np.int64)
+    ann_cat_ids = np.asarray(ann_cat_ids, dtype=np.int64)
+    if len(img_ids) == 0:
+        return sparse.csr_matrix((0, 0), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    order = np.argsort(img_ids, kind="stable")
+    pos = np.searchsorted(img_ids[order], ann_img_ids)
+    rows = order[np.minimum(pos, len(img_ids) - 1)]
+    known = img_ids[rows] == ann_img_ids
+    cat_ids, cols = np.unique(ann_cat_ids[known], return_inverse=True)
+    counts = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.int64), (rows[known], cols)),
+        shape=(len(img_ids), len(cat_ids)),
+    )
+    return counts, cat_ids
+
+
+def fold_split(
+    n_images: int,
+    n_folds: int,
+    seed: Optional[int] = None,
+    keys: Optional[Sequence[str]] = None,
+) -> np.ndarray:
+    """Assigns images, or whole groups, to ``n_folds`` folds of similar size.
+
+    Args:
+        n_images (int): number of images
+        n_folds (int): number of folds, at least 2
+        seed (Optional[int]): seed of the shuffle; random if None
+        keys (Optional[Sequence[str]]): group key of every image, see
+            group_keys; whole groups are assigned
+
+    Returns:
+        np.ndarray: fold of every image, in [0, n_folds)
+    """
+    _check_folds(n_folds, n_images)
+    rng = np.random.default_rng(seed)
+    if keys is None:
+        fold = np.empty(n_images, dtype=np.int64)
+        fold[rng.permutation(n_images)] = np.arange(n_images) % n_folds
+        return fold
+    groups, inverse = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+    sizes = np.bincount(inverse, minlength=len(groups))
+    # Groups in random order, cut where the running image count crosses a
+    # multiple of n_images / n_folds, counting each group at its middle
+    order = rng.permutation(len(groups))
+    middles = np.cumsum(sizes[order]) - sizes[order] / 2
+    fold = np.empty(len(groups), dtype=np.int64)
+    fold[order] = np.minimum(middles * n_folds // n_images, n_folds - 1)
+    empty = np.flatnonzero(np.bincount(fold, minlength=n_folds) == 0)
+    if len(empty):
+        raise ValueError(
+            f"Fold {empty[0]} got no group; use fewer folds or smaller groups"
+        )
+    return fold[inverse]
+
+
+def stratified_split(
+    counts: sparse.spmatrix,
+    train_size: float,
+    seed: Optional[int] = None,
+    keys: Optional[Sequence[str]] = None,
+    pinned: Optional[Dict[str, int]] = None,
+) -> np.ndarray:
+    """Assigns images to train or val, balancing every category.
+
+    Args:
+        counts (sparse.spmatrix): image x category counts, see count_matrix
+        train_size (float): share of every category to put in train
+        seed (Optional[int]): seed of the shuffle within a category
+        keys (Optional[Sequence[str]]): group key of every image; whole
+            groups are assigned, with their summed counts
+        pinned (Optional[Dict[str, int]]): groups with a fixed side, TRAIN or
+            VAL; needs ``keys``
+
+    Returns:
+        np.ndarray: True for the images that go to train
+    """
+    if not 0 < train_size < 1:
+        raise ValueError(f"train_size must be in (0, 1), got {train_size}")
+    shares = np.array([train_size, 1 - train_size])
+    return _stratify(counts, shares, seed, keys, pinned) == TRAIN
+
+
+def stratified_folds(
+    counts: sparse.spmatrix,
+    n_folds: int,
+    seed: Optional[int] = None,
+    keys: Optional[Sequence[str]] = None,
+) -> np.ndarray:
+    """Assigns images to ``n_folds`` folds, balancing every category.
+
+    Args:
+        counts (sparse.spmatrix): image x category counts, see count_matrix
+        n_folds (int): number of folds, at least 2
+        seed (Optional[int]): seed of the shuffle within a category
+        keys (Optional[Sequence[str]]): group key of every image; whole
+            groups are assigned, with their summed counts
+
+    Returns:
+        np.ndarray: fold of every image, in [0, n_folds)
+    """
+    _check_folds(n_folds, counts.shape[0])
+    return _stratify(counts, np.full(n_folds, 1 / n_folds), seed, keys)
+
+
+def _check_folds(n_folds: int, n_images: int) -> None:
+    if n_folds < 2:
+        raise ValueError(f"n_folds must be at least 2, got {n_folds}")
+    if n_folds > n_images:
+        raise ValueError(f"Cannot make {n_folds} folds of {n_images} images")
+
+
+def _stratify(
+    counts: sparse.spmatrix,
+    shares: np.ndarray,
+    seed: Optional[int] = None,
+    keys: Optional[Sequence[str]] = None,
+    pinned: Optional[Dict[str, int]] = None,
+) -> np.ndarray:
+    """Iterative stratification into ``len(shares)`` folds; the fold of every image."""
+    n_images, n_folds = counts.shape[0], len(shares)
+    counts = sparse.csr_matrix(counts)
+    side = np.full(n_images, -1, dtype=np.int64)
+    inverse = None
+    if keys is not None:
+        groups, inverse = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+        membership = sparse.csr_matrix(
+            (np.ones(n_images, dtype=np.int64), (inverse, np.arange(n_images))),
+            shape=(len(groups), n_images),
+        )
+        counts = membership @ counts
+        side = np.full(len(groups), -1, dtype=np.int64)
+        if pinned:
+            pinned_keys = np.asarray(list(pinned), dtype=str)
+            pos = np.clip(np.searchsorted(groups, pinned_keys), 0, len(groups) - 1)
+            found = groups[pos] == pinned_keys
+            side[pos[found]] = np.fromiter(pinned.values(), dtype=np.int64)[found]
+
+    present = (counts > 0).astype(np.int64).tocsr()
+    by_category = present.tocsc()
+    total = np.asarray(present.sum(axis=0)).ravel()
+    desired = np.outer(shares, total).astype(np.float64)
+    for fold in range(n_folds):
+        desired[fold] -= np.asarray(present[side == fold].sum(axis=0)).ravel()
+    remaining = np.asarray(present[side < 0].sum(axis=0)).ravel()
+
+    rng = np.random.default_rng(seed)
+    while remaining.any():
+        # Rarest category first, while its images can still be spread
+        live = np.flatnonzero(remaining > 0)
+        category = live[np.argmin(remaining[live])]
+        rows = by_category.indices[
+            by_category.indptr[category] : by_category.indptr[category + 1]
+        ]
+        rows = rng.permutation(rows[side[rows] < 0])
+        need = np.maximum(desired[:, category], 0)
+        share = need / need.sum() if need.sum() > 0 else shares
+        bounds = np.round(np.cumsum(share[:-1]) * len(rows)).astype(np.int64)
+        for fold, part in enumerate(np.split(rows, bounds)):
+            side[part] = fold
+            added = np.asarray(present[part].sum(axis=0)).ravel()
+            desired[fold] -= added
+            remaining -= added
+
+    # Rows without annotations fill up the image counts, fold by fold
+    rest = rng.permutation(np.flatnonzero(side < 0))
+    targets = np.diff(np.round(np.cumsum(np.r_[0, shares]) * len(side)))
+    missing = np.maximum(targets - np.bincount(side[side >= 0], minlength=n_folds), 0)
+    bounds = np.minimum(np.cumsum(missing[:-1]), len(rest)).astype(np.int64)
+    for fold, part in enumerate(np.split(rest, bounds)):
+        side[part] = fold
+    if inverse is not None:
+        side = side[inverse]
+    return side
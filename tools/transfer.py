@@ -0,0 +1,285 @@
+"""
+Parallel placement of image files.
+
+split, separate_by_name and postupdate place every image of a dataset in a
+new folder. Copied one after another, each file waits for the round trips
+of the previous one, which dominates on network file systems. ``transfer``
+copies through a bounded thread pool instead. Data is moved by the kernel
+(copy_file_range, then sendfile) without passing through Python. Progress
+is reported in batches, and a throughput summary is printed at the end.
+
+Instead of copying, files can be placed as hardlinks, symlinks or reflinks
+(copy-on-write clones), which take no extra space and no time to write.
+Where the file system cannot link, e.g. across devices, the file is copied
+instead and counted as a fallback.
+
+Usage:
+    stats = transfer([(src, dst), ...], skip_existing=True)
+    if stats.failed:
+        ...
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Iterable, List, Optional, Tuple, Union
+
+from tqdm import tqdm
+
+# Copies are I/O bound; network file systems want many requests in flight
+DEFAULT_WORKERS = 16
+PROGRESS_BATCH = 256
+
+# ioctl cloning a whole file on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+class Placement(str, Enum):
+    """How images are placed in their new folder."""
+
+    copy = "copy"
+    hardlink = "hardlink"
+    symlink = "symlink"
+    reflink = "reflink"
+
+
+# Errors meaning "this fast path is not available here", not "the copy failed"
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+}
+# Errors after which a link is replaced by a copy
+_LINK_FALLBACK = _UNSUPPORTED | {errno.EPERM, errno.EMLINK, errno.ENOTTY}
+
+
+def _kernel_copy(infd: int, outfd: int, size: int) -> bool:
+    """Copies ``size`` bytes inside the kernel; False if no fast path copies them.
+
+    A method that stops short, because the file shrank or the file system
+    reports 0 bytes copied, counts as a failure: ``outfd`` is emptied for the
+    next method or the caller to start over.
+    """
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(infd, outfd, size - offset, offset, offset)
+                else:
+                    n = os.sendfile(outfd, infd, offset, size - offset)
+                if n == 0:
+                    break
+                offset += n
+        except OSError as e:
+            if offset == 0 and e.errno in _UNSUPPORTED:
+                continue
+            raise
+        if offset == size:
+            return True
+        os.ftruncate(outfd, 0)
+        os.lseek(outfd, 0, os.SEEK_SET)
+    return False
+
+
+def copy_file(src: str, dst: str) -> int:
+    """Copies content and permission bits of ``src`` to ``dst``, like shutil.copy.
+
+    Returns:
+        int: number of bytes copied
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src} and {dst} are the same file")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        if not _kernel_copy(fsrc.fileno(), fdst.fileno(), size):
+            fsrc.seek(0)
+            fdst.seek(0)
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+            size = fdst.tell()
+    shutil.copymode(src, dst)
+    return size
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hex blake2b digest of the content of ``path``."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(src: str, dst: str) -> None:
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copymode(src, dst)
+
+
+def _symlink(src: str, dst: str) -> None:
+    os.symlink(os.path.abspath(src), dst)
+
+
+_LINKERS = {
+    Placement.hardlink: os.link,
+    Placement.symlink: _symlink,
+    Placement.reflink: _reflink,
+}
+
+
+def place_file(
+    src: str, dst: str, placement: Union[Placement, str] = Placement.copy
+) -> Tuple[int, Placement]:
+    """Places ``src`` at ``dst`` as a copy or a link, replacing ``dst``.
+
+    Links fall back to copies where the file system refuses them.
+
+    Returns:
+        Tuple[int, Placement]: size of the file and the placement used
+    """
+    placement = Placement(placement)
+    size = os.stat(src).st_size
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            if placement in (Placement.hardlink, Placement.symlink):
+                return size, placement
+            raise shutil.SameFileError(f"{src} and {dst} are the same file")
+        # Never write through an old link into the file it points to
+        os.remove(dst)
+    if placement != Placement.copy:
+        try:
+            _LINKERS[placement](src, dst)
+            return size, placement
+        except OSError as e:
+            if e.errno not in _LINK_FALLBACK:
+                raise
+    return copy_file(src, dst), Placement.copy
+
+
+class TransferStats:
+    """Counts of one transfer call."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.missing = 0
+        self.failed: List[Tuple[str, str]] = []
+        self.fallbacks = 0
+        self.seconds = 0.0
+
+    def summary(self) -> str:
+        seconds = max(self.seconds, 1e-9)
+        text = (
+            f"Placed {self.files} files ({self.bytes / 1e6:.1f} MB) in "
+            f"{self.seconds:.1f}s: {self.files / seconds:.0f} files/s, "
+            f"{self.bytes / 1e6 / seconds:.1f} MB/s"
+        )
+        if self.skipped:
+            text += f", {self.skipped} already present"
+        if self.missing:
+            text += f", {self.missing} missing sources"
+        if self.fallbacks:
+            text += f", {self.fallbacks} copied because links were refused"
+        if self.failed:
+            text += f", {len(self.failed)} failed"
+        return text
+
+
+def transfer(
+    pairs: Iterable[Tuple[str, str]],
+    placement: Union[Placement, str] = Placement.copy,
+    max_workers: int = DEFAULT_WORKERS,
+    skip_existing: bool = False,
+    missing_ok: bool = False,
+    desc: str = "Placing images",
+    progress: bool = True,
+) -> TransferStats:
+    """Places every ``(src, dst)`` pair through a bounded thread pool.
+
+    Destination folders are created as needed. Failed copies do not stop the
+    others; they are listed in the returned stats and in the summary.
+
+    Args:
+        pairs (Iterable[Tuple[str, str]]): source and destination paths
+        placement (Union[Placement, str]): copy, hardlink, symlink or reflink
+        max_workers (int): copies in flight
+        skip_existing (bool): keep destinations that already exist
+        missing_ok (bool): count missing sources instead of failing them
+        desc (str): label of the progress bar
+        progress (bool): show progress and print the summary
+
+    Returns:
+        TransferStats: files and bytes placed, skipped and failed copies
+    """
+    pairs = list(pairs)
+    placement = Placement(placement)
+    stats = TransferStats()
+    start = time.perf_counter()
+    for directory in {os.path.dirname(dst) for _, dst in pairs}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def place(src: str, dst: str) -> Optional[Tuple[int, Placement]]:
+        if skip_existing and os.path.lexists(dst):
+            return None
+        return place_file(src, dst, placement)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, tqdm(
+        total=len(pairs), desc=desc, unit="file", disable=not progress
+    ) as bar:
+        pending = deque()
+        done = 0
+
+        def collect():
+            nonlocal done
+            src, future = pending.popleft()
+            try:
+                placed = future.result()
+            except FileNotFoundError as e:
+                if missing_ok and not os.path.exists(src):
+                    stats.missing += 1
+                else:
+                    stats.failed.append((src, str(e)))
+            except OSError as e:
+                stats.failed.append((src, str(e)))
+            else:
+                if placed is None:
+                    stats.skipped += 1
+                else:
+                    stats.files += 1
+                    stats.bytes += placed[0]
+                    stats.fallbacks += placed[1] != placement
+            done += 1
+            if done % PROGRESS_BATCH == 0:
+                bar.update(PROGRESS_BATCH)
+
+        # Keep a bounded window of futures so huge datasets stay cheap
+        for src, dst in pairs:
+            pending.append((src, pool.submit(place, src, dst)))
+            if len(pending) >= max_workers * 4:
+                collect()
+        while pending:
+            collect()
+        bar.update(done % PROGRESS_BATCH)
+
+    stats.seconds = time.perf_counter() - start
+    if progress:
+        print(stats.summary())
+        for src, error in stats.failed[:10]:
+            print(f"Failed to place {src}: {error}")
+    return stats